@@ -0,0 +1,358 @@
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import numpy as np
+import GazeDataCache
+
+
+#
+# Purpose of this script:
+# Measures how fast the time-critical functions of Step 6 and Step 7 (and the .csv readers/writers) are on synthetic
+# recordings of realistic size (30 FPS, tens of minutes, NaN bursts, outliers, fixations and saccades). For every
+# benchmark the throughput (frames per second) and the peak memory (allocated while the benchmark runs, measured with
+# tracemalloc) are reported and, with --output, written to a .json file. Passing the .json file of an earlier run with --compare
+# reports every benchmark that got slower by more than --tolerance (the script exits with 1 in that case).
+#
+# The reference implementations that need quadratic time (determine_fixations()) only get the first
+# --reference-frames frames of the recording.
+#
+# Examples (run from this folder):
+# $ python Benchmark.py --minutes 20 --output BenchmarkBaseline.json
+# $ python Benchmark.py --minutes 20 --output BenchmarkNew.json --compare BenchmarkBaseline.json
+#
+
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Step_6'))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Step_7'))
+import CleanExtractedFeatures
+import FeatureEngineering
+
+
+# Returns the columns of a synthetic recording (keys like the columns of the files in ../Step_5/FeatureExtractionData).
+# The frame rate of the recording is somewhere between 24.9 and 30 FPS (with some jitter from frame to frame, like the SIT
+# videos). The gaze alternates between fixations (noise far below the fixation thresholds of the method) and saccades
+# (1 to 3 frames, jumps far above the thresholds). There are short NaN bursts (gaze estimation failed for 1 to 3 frames)
+# and single frame outliers.
+def generate_synthetic_recording(duration_in_s, method, seed):
+
+    rng = np.random.default_rng(seed)
+
+    fps = rng.uniform(24.9, 30.0)
+    count_frames = int(duration_in_s * fps)
+
+    frame_durations = rng.normal(1.0 / fps, 0.05 / fps, count_frames)
+    timestamps = np.round(np.concatenate(([0.0], np.cumsum(frame_durations[:-1]))), 3)
+
+    threshold_yaw = FeatureEngineering.threshold_by_method[method]['yaw']
+    threshold_pitch = FeatureEngineering.threshold_by_method[method]['pitch']
+
+    yaw = np.empty(count_frames)
+    pitch = np.empty(count_frames)
+
+    i = 0
+    target_yaw = 0.0
+    target_pitch = 0.0
+
+    while i < count_frames:
+
+        # fixation
+        count_fixation_frames = max(3, int(rng.exponential(0.4) * fps))
+        fixation = slice(i, min(i + count_fixation_frames, count_frames))
+        yaw[fixation] = target_yaw + rng.normal(0.0, threshold_yaw / 8, fixation.stop - fixation.start)
+        pitch[fixation] = target_pitch + rng.normal(0.0, threshold_pitch / 8, fixation.stop - fixation.start)
+        i = fixation.stop
+
+        # saccade towards the next target
+        previous_yaw = target_yaw
+        previous_pitch = target_pitch
+        target_yaw = np.clip(target_yaw + rng.choice([-1, 1]) * rng.uniform(3, 8) * threshold_yaw, -0.6, 0.6)
+        target_pitch = np.clip(target_pitch + rng.choice([-1, 1]) * rng.uniform(3, 8) * threshold_pitch, -0.5, 0.5)
+
+        count_saccade_frames = rng.integers(1, 4)
+        for k in range(count_saccade_frames):
+            if i >= count_frames:
+                break
+            yaw[i] = previous_yaw + (target_yaw - previous_yaw) * (k + 1) / (count_saccade_frames + 1)
+            pitch[i] = previous_pitch + (target_pitch - previous_pitch) * (k + 1) / (count_saccade_frames + 1)
+            i += 1
+
+    # single frame outliers
+    is_outlier = rng.random(count_frames) < 0.002
+    yaw[is_outlier] += rng.choice([-2.0, 2.0], np.count_nonzero(is_outlier))
+
+    yaw = np.round(yaw, 3)
+    pitch = np.round(pitch, 3)
+
+    # NaN bursts (roughly one every 10 seconds)
+    success = np.ones(count_frames, dtype=np.int64)
+    for burst_start in rng.choice(count_frames, size=int(duration_in_s / 10), replace=False):
+        success[burst_start:burst_start + rng.integers(1, 4)] = 0
+
+    yaw[success == 0] = np.nan
+    pitch[success == 0] = np.nan
+
+    return {
+        'frame': np.arange(1, count_frames + 1),
+        'timestamp in s': timestamps,
+        'success': success,
+        'yaw in radians': yaw,
+        'pitch in radians': pitch
+    }
+
+def write_recording_to_file(path, recording):
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(list(recording.keys()))
+
+        for row in zip(*[recording[column_name].tolist() for column_name in recording]):
+            writer.writerow(row)
+
+# Runs function once while tracing the memory allocations and then repeat times without tracing.
+# Returns the fastest time in seconds and the peak memory in bytes.
+def measure(function, repeat):
+
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = []
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    return min(seconds), peak_memory
+
+# Returns a list of (name, count frames, function) tuples.
+def get_benchmarks(recording, path, temporary_folder, method, reference_frames):
+
+    rows = [
+        dict(zip(recording.keys(), row))
+        for row in zip(*[recording[column_name].tolist() for column_name in recording])
+    ]
+
+    cleaned_data = CleanExtractedFeatures.clean_feature_extraction_data(rows, path)
+
+    x = [elem['yaw in radians'] for elem in cleaned_data]
+    y = [elem['pitch in radians'] for elem in cleaned_data]
+    t = [elem['timestamp in s'] for elem in cleaned_data]
+
+    is_fixation = FeatureEngineering.determine_fixations_with_running_means(x, y, t, method)
+    segments = FeatureEngineering.determine_segments(is_fixation)
+
+    def read_csv_file_without_cache():
+        shutil.rmtree(os.path.join(temporary_folder, GazeDataCache.cache_folder_name), ignore_errors=True)
+        CleanExtractedFeatures.read_csv_file(path)
+
+    def segment_based_features():
+        segments = FeatureEngineering.determine_segments(is_fixation)
+        FeatureEngineering.compute_fixation_durations_from_segments(x, y, t, segments)
+        FeatureEngineering.compute_saccades_from_segments(x, y, t, segments)
+
+    count_frames = len(rows)
+    count_cleaned_frames = len(cleaned_data)
+    count_reference_frames = min(reference_frames, count_cleaned_frames)
+
+    return [
+        (
+            'write_cleaned_data_to_file',
+            count_cleaned_frames,
+            lambda: CleanExtractedFeatures.write_cleaned_data_to_file(os.path.join(temporary_folder, 'Cleaned.csv'), cleaned_data)
+        ),
+        (
+            'GazeDataCache.parse_csv_file',
+            count_frames,
+            lambda: GazeDataCache.parse_csv_file(path)
+        ),
+        (
+            'read_csv_file (not cached)',
+            count_frames,
+            read_csv_file_without_cache
+        ),
+        (
+            'read_csv_file (cached)',
+            count_frames,
+            lambda: CleanExtractedFeatures.read_csv_file(path)
+        ),
+        (
+            'read_csv_file_incrementally',
+            count_frames,
+            lambda: list(CleanExtractedFeatures.read_csv_file_incrementally(path))
+        ),
+        (
+            'clean_feature_extraction_data',
+            count_frames,
+            lambda: CleanExtractedFeatures.clean_feature_extraction_data(rows, path)
+        ),
+        (
+            'clean_feature_extraction_data (reference outlier detection)',
+            count_frames,
+            lambda: CleanExtractedFeatures.clean_feature_extraction_data(rows, path, use_reference_outlier_detection=True)
+        ),
+        (
+            'determine_fixations (reference)',
+            count_reference_frames,
+            lambda: FeatureEngineering.determine_fixations(x[:count_reference_frames], y[:count_reference_frames], t[:count_reference_frames], method)
+        ),
+        (
+            'determine_fixations_with_running_means',
+            count_cleaned_frames,
+            lambda: FeatureEngineering.determine_fixations_with_running_means(x, y, t, method)
+        ),
+        (
+            'compute_fixation_durations',
+            count_cleaned_frames,
+            lambda: FeatureEngineering.compute_fixation_durations(x, y, t, is_fixation)
+        ),
+        (
+            'compute_saccades',
+            count_cleaned_frames,
+            lambda: FeatureEngineering.compute_saccades(x, y, t, is_fixation)
+        ),
+        (
+            'determine_segments + compute_*_from_segments',
+            count_cleaned_frames,
+            segment_based_features
+        ),
+        (
+            'compute_velocity_acceleration',
+            count_cleaned_frames,
+            lambda: FeatureEngineering.compute_velocity_acceleration(x, y, t, is_fixation)
+        ),
+        (
+            'EyeGazeFeatures.run',
+            count_cleaned_frames,
+            lambda: FeatureEngineering.EyeGazeFeatures(x, y, t, method).run()
+        )
+    ]
+
+def run_benchmarks(minutes, method, seed, repeat, reference_frames):
+
+    recording = generate_synthetic_recording(minutes * 60.0, method, seed)
+
+    temporary_folder = tempfile.mkdtemp()
+
+    try:
+        path = os.path.join(temporary_folder, 'Synthetic.csv')
+        write_recording_to_file(path, recording)
+
+        results = dict()
+
+        for name, count_frames, function in get_benchmarks(recording, path, temporary_folder, method, reference_frames):
+
+            seconds, peak_memory = measure(function, repeat)
+
+            results[name] = {
+                'frames': count_frames,
+                'seconds': seconds,
+                'frames per second': count_frames / seconds if seconds > 0 else float('inf'),
+                'peak memory in bytes': peak_memory
+            }
+
+            print(
+                name.ljust(62),
+                str(round(results[name]['frames per second'])).rjust(12), 'frames/s',
+                str(round(peak_memory / 1024**2, 1)).rjust(9), 'MiB'
+            )
+    finally:
+        shutil.rmtree(temporary_folder)
+
+    return results
+
+# Prints the benchmarks whose throughput decreased by more than tolerance (fraction) compared to previous_results.
+# Returns the names of these benchmarks.
+def compare_results(results, previous_results, tolerance):
+
+    regressions = []
+
+    print('\nCompared to the earlier run (throughput now / throughput then):')
+
+    for name in results:
+
+        if name not in previous_results:
+            continue
+
+        ratio = results[name]['frames per second'] / previous_results[name]['frames per second']
+        is_regression = ratio < 1.0 - tolerance
+
+        print(name.ljust(62), str(round(ratio, 2)).rjust(8), ' <-- REGRESSION' if is_regression else '')
+
+        if is_regression:
+            regressions.append(name)
+
+    return regressions
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Benchmarks Step 6 and Step 7 on synthetic recordings')
+
+    parser.add_argument('--minutes', dest='minutes', help='length of the synthetic recording (default: 20)', type=float, default=20.0)
+    parser.add_argument('--method', dest='method', help='fixation thresholds of this method are used', type=str, default='MCGaze')
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--repeat', dest='repeat', help='the fastest of this many runs counts (default: 3)', type=int, default=3)
+    parser.add_argument(
+        '--reference-frames',
+        dest='reference_frames',
+        help='number of frames for the quadratic reference implementations (default: 5000)',
+        type=int,
+        default=5000
+        )
+    parser.add_argument('--output', dest='output_path', help='.json file to write the results to (default: the results are only printed)', type=str, default=None)
+    parser.add_argument('--compare', dest='previous_results_path', help='.json file of an earlier run', type=str, default=None)
+    parser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        help='a throughput decrease by more than this fraction counts as regression (default: 0.2)',
+        type=float,
+        default=0.2
+        )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    results = run_benchmarks(args.minutes, args.method, args.seed, args.repeat, args.reference_frames)
+
+    if args.output_path is not None:
+
+        with open(args.output_path, 'w') as f:
+            json.dump(
+                {
+                    'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'machine': platform.platform(),
+                    'parameters': {
+                        'minutes': args.minutes,
+                        'method': args.method,
+                        'seed': args.seed,
+                        'repeat': args.repeat,
+                        'reference frames': args.reference_frames
+                    },
+                    'benchmarks': results
+                },
+                f,
+                indent=1
+            )
+
+    if args.previous_results_path is not None:
+
+        with open(args.previous_results_path) as f:
+            previous_results = json.load(f)['benchmarks']
+
+        if len(compare_results(results, previous_results, args.tolerance)) > 0:
+            exit(1)
@@ -0,0 +1,287 @@
+import os
+import csv
+import math
+import numpy as np
+import GazeDataCache
+
+
+#
+# Purpose of this script:
+# Shared helpers of ../Step_3/MethodValidation.ipynb and ../Step_4/MethodComparison.ipynb (both notebooks used to keep their
+# own copy of them). The gaze estimations during the calibration mouse clicks are analyzed per calibration point: mean
+# yaw and pitch angle, their standard deviations and the (absolute) differences resp. euclidean distances of the single gaze
+# estimations to the mean of their calibration point.
+#
+# Instead of looping over the rows of every .csv file, all gaze estimations of all methods (and of any number of calibration
+# videos, see analyze_calibration_videos()) are put into arrays once and every gaze estimation gets the index of the group
+# (calibration video, method, calibration point) it belongs to. All statistics are then computed for all groups at once with
+# grouped sums (see compute_statistics_by_group()).
+#
+# The functions at the bottom return the same dictionaries as the functions of the notebooks did, e.g.:
+# import sys
+# sys.path.append('../Common')
+# from CalibrationAnalysis import get_estimated_yaw_and_pitch_by_calibration_point
+#
+
+
+calibration_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Step_3')
+
+
+def rad_to_deg(value_in_radians):
+    return value_in_radians * 180 / math.pi
+
+# Returns the calibration points, the first frames and the last frames (numpy arrays) of the calibration frames file
+# (see ../Step_3/CalibrationFrames.csv). Frames are counted from 1.
+def read_calibration_frames(path=os.path.join(calibration_folder, 'CalibrationFrames.csv')):
+
+    with open(path) as csv_file:
+        rows = list(csv.DictReader(csv_file))
+
+    return (
+        np.array([int(row['calibration point']) for row in rows], dtype=np.int64),
+        np.array([int(row['first frame']) for row in rows], dtype=np.int64),
+        np.array([int(row['last frame']) for row in rows], dtype=np.int64)
+    )
+
+# Returns the estimated yaw and pitch angles in degrees of all frames of the file (row i belongs to frame i+1).
+def read_estimated_yaw_and_pitch(path, gaze_estimation_method):
+
+    gaze_data = GazeDataCache.read_gaze_data(path)
+
+    yaw = rad_to_deg(np.asarray(gaze_data['yaw in radians'], dtype=np.float64))
+    pitch = np.asarray(gaze_data['pitch in radians'], dtype=np.float64)
+
+    # in case of rt_gene I messed up the adjustment to OpenFace convention, hence need to negate pitch
+    if gaze_estimation_method == 'rt_gene':
+        pitch = -pitch
+
+    return yaw, rad_to_deg(pitch)
+
+# Returns the row indices of all frames from the first to the last frame of every calibration point (concatenated)
+# together with the index of the calibration point (0, 1, ...) each of them belongs to.
+def get_calibration_rows(first_frames, last_frames):
+
+    counts = last_frames - first_frames + 1
+    calibration_point_indices = np.repeat(np.arange(len(first_frames)), counts)
+
+    # first_frames[k] - 1, first_frames[k], ..., last_frames[k] - 1 for every calibration point k
+    starts = np.repeat(first_frames - 1 - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+
+    return starts + np.arange(np.sum(counts)), calibration_point_indices
+
+# yaw[j] and pitch[j] belong to the group groups[j] (0, ..., count_groups - 1). Gaze estimations with nan angles are
+# ignored (if yaw is nan then pitch is nan as well).
+# Returns a dictionary of arrays with one element per group ('count', 'mean yaw', 'mean pitch', 'std yaw', 'std pitch',
+# 'mean abs yaw difference', 'max abs yaw difference', 'mean abs pitch difference', 'max abs pitch difference',
+# 'mean distance', 'max distance'; nan for groups without gaze estimations) and the differences resp. distances of the
+# single gaze estimations to the mean of their group ('groups', 'abs yaw differences', 'abs pitch differences', 'distances').
+# Just like the notebooks did, the differences and distances refer to the means rounded to decimals decimals (None: not
+# rounded). The standard deviations are population standard deviations like np.std() and refer to the unrounded means.
+def compute_statistics_by_group(yaw, pitch, groups, count_groups, decimals=3):
+
+    is_valid = ~np.isnan(yaw)
+    yaw = yaw[is_valid]
+    pitch = pitch[is_valid]
+    groups = groups[is_valid]
+
+    counts = np.bincount(groups, minlength=count_groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        # np.bincount() sums up in the order of the gaze estimations, just like the loops of the notebooks did.
+        mean_yaw = np.bincount(groups, weights=yaw, minlength=count_groups) / counts
+        mean_pitch = np.bincount(groups, weights=pitch, minlength=count_groups) / counts
+
+        std_yaw = np.sqrt(np.bincount(groups, weights=(yaw - mean_yaw[groups])**2, minlength=count_groups) / counts)
+        std_pitch = np.sqrt(np.bincount(groups, weights=(pitch - mean_pitch[groups])**2, minlength=count_groups) / counts)
+
+        # round() instead of np.round(), because np.round() is not always rounded exactly like round().
+        if decimals is not None:
+            mean_yaw = np.array([round(value, decimals) for value in mean_yaw.tolist()], dtype=np.float64)
+            mean_pitch = np.array([round(value, decimals) for value in mean_pitch.tolist()], dtype=np.float64)
+
+        abs_yaw_differences = np.abs(yaw - mean_yaw[groups])
+        abs_pitch_differences = np.abs(pitch - mean_pitch[groups])
+        distances = np.sqrt(abs_yaw_differences*abs_yaw_differences + abs_pitch_differences*abs_pitch_differences)
+
+        statistics = {
+            'count': counts,
+            'mean yaw': mean_yaw,
+            'mean pitch': mean_pitch,
+            'std yaw': std_yaw,
+            'std pitch': std_pitch
+        }
+
+        for name, values in [('abs yaw difference', abs_yaw_differences), ('abs pitch difference', abs_pitch_differences), ('distance', distances)]:
+
+            maxima = np.full(count_groups, -np.inf)
+            np.maximum.at(maxima, groups, values)
+
+            statistics['mean ' + name] = np.bincount(groups, weights=values, minlength=count_groups) / counts
+            statistics['max ' + name] = np.where(counts > 0, maxima, np.nan)
+
+    statistics['groups'] = groups
+    statistics['abs yaw differences'] = abs_yaw_differences
+    statistics['abs pitch differences'] = abs_pitch_differences
+    statistics['distances'] = distances
+
+    return statistics
+
+# Parameter videos is a list of (calibration frames path, estimated gaze folder) tuples, one per calibration video
+# (e.g. [('../Step_3/CalibrationFrames.csv', '../Step_3/EstimatedGaze')]). The estimated gaze folder contains one
+# <method>.csv file per method.
+# All calibration points of all methods of all videos are analyzed at once (see compute_statistics_by_group()).
+# Returns statistics where statistics[i][method] is a dictionary like the one returned by compute_statistics_by_group()
+# for video i and the method, with one element per calibration point (in the order of the calibration frames file, see
+# the additional key 'calibration point'). The per gaze estimation values ('abs yaw differences' etc.) are split up by
+# calibration point as well (lists of arrays).
+def analyze_calibration_videos(videos, methods, decimals=3):
+
+    yaw_parts = []
+    pitch_parts = []
+    group_parts = []
+    # (video index, method, calibration points, first group) for every video and method
+    group_ranges = []
+    count_groups = 0
+
+    for i, (calibration_frames_path, estimated_gaze_folder) in enumerate(videos):
+
+        calibration_points, first_frames, last_frames = read_calibration_frames(calibration_frames_path)
+        rows, calibration_point_indices = get_calibration_rows(first_frames, last_frames)
+
+        for method in methods:
+
+            yaw, pitch = read_estimated_yaw_and_pitch(os.path.join(estimated_gaze_folder, method + '.csv'), method)
+
+            yaw_parts.append(yaw[rows])
+            pitch_parts.append(pitch[rows])
+            group_parts.append(count_groups + calibration_point_indices)
+            group_ranges.append((i, method, calibration_points, count_groups))
+
+            count_groups += len(calibration_points)
+
+    statistics_of_all_groups = compute_statistics_by_group(
+        np.concatenate(yaw_parts),
+        np.concatenate(pitch_parts),
+        np.concatenate(group_parts),
+        count_groups,
+        decimals
+    )
+
+    # Split the per gaze estimation values up by group (they are sorted by group already).
+    split_indices = np.searchsorted(statistics_of_all_groups['groups'], np.arange(1, count_groups))
+    values_by_group = {
+        name: np.split(statistics_of_all_groups[name], split_indices)
+        for name in ['abs yaw differences', 'abs pitch differences', 'distances']
+    }
+
+    statistics = [dict() for video in videos]
+
+    for i, method, calibration_points, first_group in group_ranges:
+
+        groups = slice(first_group, first_group + len(calibration_points))
+
+        statistics[i][method] = {'calibration point': calibration_points}
+
+        for name in statistics_of_all_groups:
+            if name in values_by_group:
+                statistics[i][method][name] = values_by_group[name][groups]
+            elif name != 'groups':
+                statistics[i][method][name] = statistics_of_all_groups[name][groups]
+
+    return statistics
+
+
+#
+# The functions of the notebooks (same parameters and return values).
+#
+
+def get_first_and_last_frame_by_calibration_point(path=os.path.join(calibration_folder, 'CalibrationFrames.csv')):
+
+    calibration_points, first_frames, last_frames = read_calibration_frames(path)
+
+    return {
+        calibration_point: {'first frame': first_frame, 'last frame': last_frame}
+        for calibration_point, first_frame, last_frame in zip(calibration_points.tolist(), first_frames.tolist(), last_frames.tolist())
+    }
+
+# There are multiple frames that belong to a specific calibration point
+# (all frames between the first and last mouse click). Hence, this function
+# returns a dictionary of lists where each list element is also a dictionary
+# containing the estimated yaw and pitch angle.
+def get_estimated_yaw_and_pitch_by_calibration_point(gaze_estimation_method, estimated_gaze_folder=os.path.join(calibration_folder, 'EstimatedGaze')):
+
+    calibration_points, first_frames, last_frames = read_calibration_frames()
+    yaw, pitch = read_estimated_yaw_and_pitch(os.path.join(estimated_gaze_folder, gaze_estimation_method + '.csv'), gaze_estimation_method)
+
+    return {
+        calibration_point: [
+            {'yaw': elem_yaw, 'pitch': elem_pitch}
+            for elem_yaw, elem_pitch in zip(yaw[first_frame-1:last_frame].tolist(), pitch[first_frame-1:last_frame].tolist())
+        ]
+        for calibration_point, first_frame, last_frame in zip(calibration_points.tolist(), first_frames.tolist(), last_frames.tolist())
+    }
+
+# Converts the return value of get_estimated_yaw_and_pitch_by_calibration_point() into arrays for compute_statistics_by_group().
+def get_arrays_by_group(estimated_yaw_and_pitch_by_calibration_point):
+
+    calibration_points = list(estimated_yaw_and_pitch_by_calibration_point)
+
+    yaw = np.array([elem['yaw'] for calibration_point in calibration_points for elem in estimated_yaw_and_pitch_by_calibration_point[calibration_point]], dtype=np.float64)
+    pitch = np.array([elem['pitch'] for calibration_point in calibration_points for elem in estimated_yaw_and_pitch_by_calibration_point[calibration_point]], dtype=np.float64)
+    groups = np.repeat(np.arange(len(calibration_points)), [len(estimated_yaw_and_pitch_by_calibration_point[calibration_point]) for calibration_point in calibration_points])
+
+    return calibration_points, yaw, pitch, groups
+
+def calculate_mean_of_estimated_yaw_and_pitch_by_calibration_point(estimated_yaw_and_pitch_by_calibration_point):
+
+    calibration_points, yaw, pitch, groups = get_arrays_by_group(estimated_yaw_and_pitch_by_calibration_point)
+    statistics = compute_statistics_by_group(yaw, pitch, groups, len(calibration_points))
+
+    return {
+        calibration_point: {'yaw': mean_yaw, 'pitch': mean_pitch}
+        for calibration_point, mean_yaw, mean_pitch in zip(calibration_points, statistics['mean yaw'].tolist(), statistics['mean pitch'].tolist())
+    }
+
+# Returns the abs yaw differences, abs pitch differences and distances of the gaze estimations (without nan angles) to the
+# given means (as dictionaries of lists with the calibration points as keys).
+def calculate_differences_to_calibration_point_means(
+    estimated_yaw_and_pitch_by_calibration_point,
+    mean_of_estimated_yaw_and_pitch_by_calibration_point
+):
+
+    calibration_points, yaw, pitch, groups = get_arrays_by_group(estimated_yaw_and_pitch_by_calibration_point)
+
+    is_valid = ~np.isnan(yaw)
+    groups = groups[is_valid]
+
+    mean_yaw = np.array([mean_of_estimated_yaw_and_pitch_by_calibration_point[calibration_point]['yaw'] for calibration_point in calibration_points])
+    mean_pitch = np.array([mean_of_estimated_yaw_and_pitch_by_calibration_point[calibration_point]['pitch'] for calibration_point in calibration_points])
+
+    abs_yaw_differences = np.abs(yaw[is_valid] - mean_yaw[groups])
+    abs_pitch_differences = np.abs(pitch[is_valid] - mean_pitch[groups])
+    distances = np.sqrt(abs_yaw_differences*abs_yaw_differences + abs_pitch_differences*abs_pitch_differences)
+
+    return [
+        {calibration_point: values[groups == k].tolist() for k, calibration_point in enumerate(calibration_points)}
+        for values in [abs_yaw_differences, abs_pitch_differences, distances]
+    ]
+
+def calculate_distances_to_calibration_point_means(
+    estimated_yaw_and_pitch_by_calibration_point,
+    mean_of_estimated_yaw_and_pitch_by_calibration_point
+):
+
+    return calculate_differences_to_calibration_point_means(estimated_yaw_and_pitch_by_calibration_point, mean_of_estimated_yaw_and_pitch_by_calibration_point)[2]
+
+def calculate_abs_yaw_and_pitch_differences_to_calibration_point_means(
+    estimated_yaw_and_pitch_by_calibration_point,
+    mean_of_estimated_yaw_and_pitch_by_calibration_point
+):
+
+    abs_yaw_differences, abs_pitch_differences, distances = calculate_differences_to_calibration_point_means(
+        estimated_yaw_and_pitch_by_calibration_point,
+        mean_of_estimated_yaw_and_pitch_by_calibration_point
+    )
+
+    return abs_yaw_differences, abs_pitch_differences
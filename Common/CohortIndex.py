@@ -0,0 +1,428 @@
+import os
+import csv
+import json
+import argparse
+import numpy as np
+import GazeDataStore
+
+
+#
+# Purpose of this script:
+# Information about the SIT videos is spread over several files: the condition in FilenameToConditionMap.csv, the gender in
+# the four VideoIdToGenderMap_<n>.csv files of Step 8, the recorded parts in the folders of Step 5 and the cleaned resp.
+# excluded parts in the output of Step 6. Every step used to parse (and probe) these sources again. The cohort index joins them
+# into one table with one row per video (in the order of FilenameToConditionMap.csv):
+# 1. condition ('ASC' or 'NT') and gender ('female', 'male', 'diverse' or None if the video is not in the gender maps)
+# 2. per method: the parts in ../Step_5/FeatureExtractionData/<method>, the cleaned parts (kept by Step 6) and the exclusion
+#    reasons of the excluded parts (see ../Step_6/CleanedFeatureExtractionData/ExclusionReasons.csv)
+# Videos are looked up by id in O(1) and get_mask() returns (cached) boolean masks over the rows for every subgroup, so a
+# subgroup of e.g. a feature matrix is selected with array indexing (see get_mask_of_videos()).
+#
+# The table is cached in ../.cohort_index.json together with the modification time and size of every source (file or
+# folder). load_cohort_index() rebuilds it whenever one of the sources changed.
+#
+# Example (run from this folder):
+# $ python CohortIndex.py
+#
+
+
+repository_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+default_condition_map_path = os.path.join(repository_folder, 'Step_5', 'FeatureExtractionData', 'FilenameToConditionMap.csv')
+default_gender_map_paths = [os.path.join(repository_folder, 'Step_8', 'VideoIdToGenderMap_' + str(i) + '.csv') for i in range(1, 5)]
+default_feature_extraction_folder = os.path.join(repository_folder, 'Step_5', 'FeatureExtractionData')
+default_cleaned_folder = os.path.join(repository_folder, 'Step_6', 'CleanedFeatureExtractionData')
+default_cache_path = os.path.join(repository_folder, '.cohort_index.json')
+
+genders = ['female', 'male', 'diverse']
+
+# Values of the column "gender" in the gender maps ('-9' means unknown).
+gender_by_value = {
+    '1': 'female', '1.0': 'female', 'female': 'female',
+    '2': 'male', '2.0': 'male', 'male': 'male',
+    '3': 'diverse', '3.0': 'diverse', 'diverse': 'diverse'
+}
+
+# Step 7 uses the first cleaned one of these parts of every video (see get_feature_filename()).
+feature_parts = [2, 3, 4]
+
+# Ids that occur multiple times in VideoIdToGenderMap_1.csv and VideoIdToGenderMap_2.csv. The notebook of Step 8 verified
+# that these duplicates don't contradict each other, any other duplicate in these two files is an error.
+# VideoIdToGenderMap_3.csv contains many duplicates, but no garbage like "-9", VideoIdToGenderMap_4.csv is handmade.
+ids_that_occur_multiple_times = [
+    '01-008', '01-027', '01-015', '04-015', '04-012',
+    '04-020', '04-051', '04-017', '04-048', '04-064',
+    '04-077', '02-037', '91-017', '00-000', '94-006',
+    '91-019', '91-025', '94-014', '94-030'
+]
+
+
+# Returns a dictionary with the ids of the gender maps as keys and 'female', 'male' or 'diverse' as values (in the order of
+# the files). Gender maps that don't exist are skipped (see check_gender_maps_exist()).
+# Some ids occur multiple times in the gender maps, the first occurrence wins. Raises ValueError if an id occurs multiple
+# times in VideoIdToGenderMap_1.csv or VideoIdToGenderMap_2.csv that is not in ids_that_occur_multiple_times.
+def read_gender_by_id(gender_map_paths):
+
+    gender_by_id = dict()
+
+    for path in gender_map_paths:
+
+        if not os.path.isfile(path):
+            continue
+
+        with open(path) as csv_file:
+
+            # VideoIdToGenderMap_3.csv is separated by semicolons.
+            delimiter = ';' if os.path.basename(path) == 'VideoIdToGenderMap_3.csv' else ','
+
+            for row in csv.DictReader(csv_file, delimiter=delimiter):
+
+                # .strip() is necessary as some ids have whitespaces in the file.
+                video_id = row['id'].strip()
+
+                if video_id in gender_by_id:
+                    if os.path.basename(path) in ['VideoIdToGenderMap_1.csv', 'VideoIdToGenderMap_2.csv'] and video_id not in ids_that_occur_multiple_times:
+                        raise ValueError('the video id ' + video_id + ' occurs multiple times in the gender maps (' + path + ')')
+                    continue
+
+                if row['gender'] == '-9':
+                    continue
+
+                if row['gender'] not in gender_by_value:
+                    raise ValueError('unknown gender "' + row['gender'] + '" in ' + path)
+
+                gender_by_id[video_id] = gender_by_value[row['gender']]
+
+    return gender_by_id
+
+# Raises FileNotFoundError if one of the gender maps doesn't exist. Without them the gender of every video is None, so
+# everything filtered by gender would be empty.
+def check_gender_maps_exist(gender_map_paths=default_gender_map_paths):
+
+    missing_paths = [path for path in gender_map_paths if not os.path.isfile(path)]
+
+    if len(missing_paths) > 0:
+        raise FileNotFoundError('gender map(s) missing: ' + ', '.join(missing_paths) + ' (see Step_8/NOTE_FilesMissing.txt)')
+
+# Returns the gender of the video (None if it is not in the gender maps). Like in the notebook of Step 8 an id of the
+# gender maps belongs to every video it is a substring of.
+def find_gender(video_id, gender_by_id):
+
+    if video_id in gender_by_id:
+        return gender_by_id[video_id]
+
+    for gender_id in gender_by_id:
+        if gender_id in video_id:
+            return gender_by_id[gender_id]
+
+    return None
+
+# Returns a dictionary with the video ids as keys and the sorted parts of the .csv files in folder as values
+# (files without '_part_<n>' are ignored). Returns an empty dictionary if the folder doesn't exist.
+def read_parts_by_video_id(folder):
+
+    parts_by_video_id = dict()
+
+    if not os.path.isdir(folder):
+        return parts_by_video_id
+
+    for filename in os.listdir(folder):
+
+        if not (os.path.splitext(filename)[1] == '.csv' and os.path.isfile(os.path.join(folder, filename))):
+            continue
+
+        video_id, part = GazeDataStore.split_filename(filename)
+
+        if part is not None:
+            parts_by_video_id.setdefault(video_id, []).append(part)
+
+    return {video_id: sorted(parts) for video_id, parts in parts_by_video_id.items()}
+
+# Returns the set of filenames listed in CleanedFiles.csv of Step 6 (None if Step 6 didn't write this list).
+def read_cleaned_filenames(cleaned_folder):
+
+    path = os.path.join(cleaned_folder, 'CleanedFiles.csv')
+
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as csv_file:
+        return {row['filename'] for row in csv.DictReader(csv_file)}
+
+# Returns a dictionary with the methods as keys and dictionaries filename -> exclusion reason as values
+# (see ../Step_6/CleanedFeatureExtractionData/ExclusionReasons.csv).
+def read_exclusion_reasons(cleaned_folder):
+
+    exclusion_reasons_by_method = dict()
+    path = os.path.join(cleaned_folder, 'ExclusionReasons.csv')
+
+    if os.path.isfile(path):
+        with open(path) as csv_file:
+            for row in csv.DictReader(csv_file):
+                exclusion_reasons_by_method.setdefault(row['method'], dict())[row['filename']] = row['exclusion reason']
+
+    return exclusion_reasons_by_method
+
+# Returns the paths of all sources of the cohort table.
+def get_source_paths(methods, condition_map_path, gender_map_paths, feature_extraction_folder, cleaned_folder):
+
+    return (
+        [condition_map_path] + list(gender_map_paths) +
+        [os.path.join(feature_extraction_folder, method) for method in methods] +
+        [os.path.join(cleaned_folder, method) for method in methods] +
+        [os.path.join(cleaned_folder, 'CleanedFiles.csv'), os.path.join(cleaned_folder, 'ExclusionReasons.csv')]
+    )
+
+# Returns [path, modification time in ns, size in bytes] for every path ([path, None, None] if it doesn't exist).
+# The modification time of a folder changes whenever a file is added to it or removed from it.
+def get_source_signature(source_paths):
+
+    signature = []
+
+    for path in source_paths:
+        try:
+            source_stat = os.stat(path)
+            signature.append([os.path.abspath(path), source_stat.st_mtime_ns, source_stat.st_size])
+        except OSError:
+            signature.append([os.path.abspath(path), None, None])
+
+    return signature
+
+# Joins all sources into one table (a dictionary of columns with one entry per video of the condition map).
+def build_cohort_table(methods, condition_map_path, gender_map_paths, feature_extraction_folder, cleaned_folder):
+
+    condition_by_video_id = GazeDataStore.read_condition_by_video_id(condition_map_path)
+    gender_by_id = read_gender_by_id(gender_map_paths)
+    cleaned_filenames = read_cleaned_filenames(cleaned_folder)
+    exclusion_reasons_by_method = read_exclusion_reasons(cleaned_folder)
+
+    video_ids = list(condition_by_video_id.keys())
+
+    table = {
+        'methods': list(methods),
+        'video ids': video_ids,
+        'conditions': [condition_by_video_id[video_id] for video_id in video_ids],
+        'genders': [find_gender(video_id, gender_by_id) for video_id in video_ids],
+        'parts': dict(),
+        'cleaned parts': dict(),
+        'exclusion reasons': dict()
+    }
+
+    for method in methods:
+
+        parts_by_video_id = read_parts_by_video_id(os.path.join(feature_extraction_folder, method))
+
+        # Without CleanedFiles.csv the cleaned files are looked up in the folder of the method.
+        if cleaned_filenames is None:
+            cleaned_parts_by_video_id = read_parts_by_video_id(os.path.join(cleaned_folder, method))
+        else:
+            cleaned_parts_by_video_id = dict()
+            for filename in cleaned_filenames:
+                video_id, part = GazeDataStore.split_filename(filename)
+                # Files only excluded for derived methods like the ensemble are listed in CleanedFiles.csv as well.
+                if part is not None and filename not in exclusion_reasons_by_method.get(method, dict()):
+                    cleaned_parts_by_video_id.setdefault(video_id, []).append(part)
+
+        exclusion_reasons = exclusion_reasons_by_method.get(method, dict())
+
+        table['parts'][method] = [parts_by_video_id.get(video_id, []) for video_id in video_ids]
+        table['cleaned parts'][method] = [sorted(cleaned_parts_by_video_id.get(video_id, [])) for video_id in video_ids]
+        # Lists of [part, exclusion reason] (JSON only allows strings as keys).
+        table['exclusion reasons'][method] = [
+            [[part, exclusion_reasons[video_id + '_part_' + str(part) + '.csv']] for part in parts_by_video_id.get(video_id, []) if video_id + '_part_' + str(part) + '.csv' in exclusion_reasons]
+            for video_id in video_ids
+        ]
+
+    return table
+
+
+class CohortIndex:
+    def __init__(self, table):
+
+        self.methods = table['methods']
+        self.video_ids = table['video ids']
+        self.conditions = np.array(table['conditions'], dtype=object)
+        self.genders = np.array(table['genders'], dtype=object)
+        self._table = table
+
+        self._row_by_video_id = {video_id: row for row, video_id in enumerate(self.video_ids)}
+        self._masks = dict()
+
+    def __len__(self):
+
+        return len(self.video_ids)
+
+    def __contains__(self, video_id):
+
+        return video_id in self._row_by_video_id
+
+    # Returns the row of the video (raises KeyError for unknown videos).
+    def get_row(self, video_id):
+
+        return self._row_by_video_id[video_id]
+
+    # Returns everything the index knows about the video.
+    def get(self, video_id):
+
+        row = self.get_row(video_id)
+
+        return {
+            'video id': video_id,
+            'condition': self.conditions[row],
+            'gender': self.genders[row],
+            'parts': {method: self._table['parts'][method][row] for method in self.methods},
+            'cleaned parts': {method: self._table['cleaned parts'][method][row] for method in self.methods},
+            'exclusion reasons': {method: dict((part, reason) for part, reason in self._table['exclusion reasons'][method][row]) for method in self.methods}
+        }
+
+    def get_cleaned_parts(self, video_id, method):
+
+        return self._table['cleaned parts'][method][self.get_row(video_id)]
+
+    # Returns the name of the cleaned file Step 7 computes the features of (the first cleaned one of the parts 2, 3 and 4),
+    # None if there is none.
+    def get_feature_filename(self, video_id, method):
+
+        cleaned_parts = self.get_cleaned_parts(video_id, method)
+
+        for part in feature_parts:
+            if part in cleaned_parts:
+                return video_id + '_part_' + str(part) + '.csv'
+
+        return None
+
+    # Returns a boolean mask over the rows for the videos of the given condition ('ASC' or 'NT'), gender ('female', 'male' or
+    # 'diverse') and with a feature file (see get_feature_filename()) for the given method. None means any. The masks are
+    # computed only once (don't modify them).
+    def get_mask(self, condition=None, gender=None, method=None):
+
+        key = (condition, gender, method)
+
+        if key not in self._masks:
+
+            mask = np.ones(len(self.video_ids), dtype=bool)
+
+            if condition is not None:
+                mask &= self.conditions == condition
+            if gender is not None:
+                mask &= self.genders == gender
+            if method is not None:
+                mask &= np.array([self.get_feature_filename(video_id, method) is not None for video_id in self.video_ids], dtype=bool)
+
+            self._masks[key] = mask
+
+        return self._masks[key]
+
+    # Returns the rows of the videos with the given names (e.g. the column "video" of the features of Step 7, '<id>_part_<n>').
+    # Videos that are not in the index get the row -1.
+    def get_rows_of_videos(self, video_names):
+
+        return np.array([
+            self._row_by_video_id.get(GazeDataStore.split_filename(video_name + '.csv')[0], self._row_by_video_id.get(video_name, -1))
+            for video_name in video_names
+        ], dtype=np.int64)
+
+    # Same as get_mask(), but over the given videos instead of the rows of the index. Videos that are not in the index are
+    # never selected.
+    def get_mask_of_videos(self, video_names, condition=None, gender=None, method=None):
+
+        rows = self.get_rows_of_videos(video_names)
+        mask = np.zeros(len(rows), dtype=bool)
+        mask[rows >= 0] = self.get_mask(condition, gender, method)[rows[rows >= 0]]
+
+        return mask
+
+    # Returns the same dictionary as get_SIT_video_filenames() of ../Step_7/ApplyFeatureEngineering.py:
+    # filenames[method][condition] is the list of the feature files (see get_feature_filename()) in the order of the index.
+    def get_SIT_video_filenames(self, methods):
+
+        filenames = dict()
+
+        for method in methods:
+
+            filenames[method] = {
+                'ASC': [],
+                'NT': []
+            }
+
+            for video_id, condition in zip(self.video_ids, self.conditions):
+
+                filename = self.get_feature_filename(video_id, method)
+
+                if filename is not None:
+                    filenames[method][condition].append(filename)
+
+        return filenames
+
+
+# Returns the cohort index. The table is read from cache_path if none of its sources changed since it was written, otherwise
+# it is built again and written to cache_path (cache_path None disables the cache).
+def load_cohort_index(
+        methods=('L2CS-Net', 'MCGaze'),
+        condition_map_path=default_condition_map_path,
+        gender_map_paths=default_gender_map_paths,
+        feature_extraction_folder=default_feature_extraction_folder,
+        cleaned_folder=default_cleaned_folder,
+        cache_path=default_cache_path
+        ):
+
+    methods = list(methods)
+    signature = get_source_signature(get_source_paths(methods, condition_map_path, gender_map_paths, feature_extraction_folder, cleaned_folder))
+
+    if cache_path is not None and os.path.isfile(cache_path):
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+
+            if cache['signature'] == signature:
+                return CohortIndex(cache['table'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    table = build_cohort_table(methods, condition_map_path, gender_map_paths, feature_extraction_folder, cleaned_folder)
+
+    if cache_path is not None:
+        # Every process writes its own temporary file, so that concurrent writers never leave a broken cache behind.
+        temporary_cache_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+
+        with open(temporary_cache_path, 'w') as f:
+            json.dump({'signature': signature, 'table': table}, f)
+
+        os.replace(temporary_cache_path, cache_path)
+
+    return CohortIndex(table)
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Builds the cohort index (condition, gender and parts of every SIT video) and prints a summary')
+
+    parser.add_argument(
+        '--methods',
+        dest='methods',
+        nargs='+',
+        default=['L2CS-Net', 'MCGaze']
+        )
+
+    parser.add_argument('--condition-map', dest='condition_map_path', type=str, default=default_condition_map_path)
+    parser.add_argument('--gender-maps', dest='gender_map_paths', nargs='+', type=str, default=default_gender_map_paths)
+    parser.add_argument('--cache', dest='cache_path', help='path of the cached index (default: ../.cohort_index.json)', type=str, default=default_cache_path)
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    cohort_index = load_cohort_index(args.methods, args.condition_map_path, args.gender_map_paths, cache_path=args.cache_path)
+
+    print(len(cohort_index), 'videos')
+
+    for condition in ['ASC', 'NT']:
+        print(
+            condition + ':', np.count_nonzero(cohort_index.get_mask(condition)), 'videos',
+            '(' + ', '.join(gender + ': ' + str(np.count_nonzero(cohort_index.get_mask(condition, gender))) for gender in genders) + ')'
+        )
+
+        for method in args.methods:
+            print('   ', method + ':', np.count_nonzero(cohort_index.get_mask(condition, method=method)), 'videos with cleaned data')
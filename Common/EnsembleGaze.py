@@ -0,0 +1,282 @@
+import os
+import argparse
+import warnings
+import concurrent.futures
+import numpy as np
+import GazeDataCache
+
+
+#
+# Purpose of this script:
+# Combines the gaze estimations of several methods into one consensus gaze estimation per frame, the "Ensemble". The
+# ensemble is written in the same format as the files of the methods (frame,timestamp in s,success,yaw in radians,
+# pitch in radians), so Steps 6 and 7 process it like any other method, e.g.
+# $ python PipelineRunner.py --stages 6 7 --methods L2CS-Net MCGaze Ensemble
+# instead of running the whole pipeline for every method and combining the results afterwards.
+# Step 6 treats the ensemble as a derived method (see reconcile_exclusions() of ../Step_6/CleanExtractedFeatures.py): a file
+# that is excluded for the ensemble is excluded for the ensemble only, so adding it doesn't change which files are kept for
+# L2CS-Net and MCGaze. A file excluded for one of them is excluded for the ensemble as well. If --output-method is used, the
+# name has to be added to derived_methods of ../Step_6/CleanExtractedFeatures.py.
+#
+# The files of all methods are read once and joined by frame (see align_by_frame()): every method becomes one row of a
+# (methods x frames) array, frames a method didn't estimate (or estimated without success) are nan. The layouts of
+# ../Step_3/EstimatedGaze are supported, including the OpenFace files (column "timestamp" instead of "timestamp in s",
+# several rows per frame if there are several faces, and the gaze vectors gaze_0_* and gaze_1_* of both eyes).
+# The consensus of every frame is computed in one pass over these arrays (see combine_gaze_estimations()):
+# 1. median: the median yaw resp. pitch of all methods with a gaze estimation for the frame
+# 2. weighted mean: the mean weighted by the confidence of the methods (OpenFace reports a confidence, the other methods
+#    only success, which counts as confidence 1). If all weights of a frame are 0 the unweighted mean is used.
+# Frames with gaze estimations of less than min_methods methods get success 0 and nan angles.
+#
+# Examples (run from this folder):
+# $ python EnsembleGaze.py
+# writes ../Step_5/FeatureExtractionData/Ensemble/<file> for every file of L2CS-Net or MCGaze, and
+# $ python EnsembleGaze.py --calibration --methods L2CS-Net MCGaze rt_gene OpenFace
+# writes ../Step_3/EstimatedGaze/Ensemble.csv for the calibration video.
+#
+
+
+repository_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ensemble_method = 'Ensemble'
+
+# rt_gene's pitch angles have the wrong sign (see read_estimated_yaw_and_pitch() of CalibrationAnalysis.py).
+pitch_sign_by_method = {'rt_gene': -1.0}
+
+combination_modes = ['median', 'weighted mean']
+
+
+# Returns the columns of the file of a method as numpy arrays: 'frame', 'timestamp in s', 'yaw in radians', 'pitch in radians'
+# (nan if the estimation was not successful) and 'confidence' (the column "confidence" of OpenFace times success, success for
+# the other methods). Only the first row of every frame is used.
+def read_gaze_estimations(path, method):
+
+    columns = GazeDataCache.read_gaze_data(path)
+
+    frames, first_rows = np.unique(np.asarray(columns['frame'], dtype=np.int64), return_index=True)
+    success = np.asarray(columns['success'])[first_rows] != 0
+
+    timestamps = columns['timestamp in s'] if 'timestamp in s' in columns else columns['timestamp']
+
+    if 'yaw in radians' in columns:
+        yaw = np.array(columns['yaw in radians'][first_rows], dtype=np.float64)
+        pitch = np.array(columns['pitch in radians'][first_rows], dtype=np.float64)
+    else:
+        # Gaze angles of OpenFace: angles of the sum of the gaze vectors of both eyes (x right, y down, z away from the camera).
+        x = columns['gaze_0_x'][first_rows] + columns['gaze_1_x'][first_rows]
+        y = columns['gaze_0_y'][first_rows] + columns['gaze_1_y'][first_rows]
+        z = columns['gaze_0_z'][first_rows] + columns['gaze_1_z'][first_rows]
+        yaw = np.arctan2(x, -z)
+        pitch = np.arctan2(y, -z)
+
+    pitch *= pitch_sign_by_method.get(method, 1.0)
+
+    if 'confidence' in columns:
+        confidence = np.where(success, np.asarray(columns['confidence'], dtype=np.float64)[first_rows], 0.0)
+    else:
+        confidence = success.astype(np.float64)
+
+    return {
+        'frame': frames,
+        'timestamp in s': np.asarray(timestamps, dtype=np.float64)[first_rows],
+        'yaw in radians': np.where(success, yaw, np.nan),
+        'pitch in radians': np.where(success, pitch, np.nan),
+        'confidence': confidence
+    }
+
+# Joins the gaze estimations of several methods (list of dictionaries returned by read_gaze_estimations()) by frame.
+# Returns the frames of all methods (sorted) and a dictionary with (methods x frames) arrays for 'timestamp in s',
+# 'yaw in radians', 'pitch in radians' (nan where a method has no gaze estimation for a frame) and 'confidence' (0 there).
+def align_by_frame(gaze_estimations_by_method):
+
+    frames = np.unique(np.concatenate([gaze_estimations['frame'] for gaze_estimations in gaze_estimations_by_method]))
+
+    aligned = {
+        'timestamp in s': np.full((len(gaze_estimations_by_method), len(frames)), np.nan),
+        'yaw in radians': np.full((len(gaze_estimations_by_method), len(frames)), np.nan),
+        'pitch in radians': np.full((len(gaze_estimations_by_method), len(frames)), np.nan),
+        'confidence': np.zeros((len(gaze_estimations_by_method), len(frames)))
+    }
+
+    for i, gaze_estimations in enumerate(gaze_estimations_by_method):
+
+        columns = np.searchsorted(frames, gaze_estimations['frame'])
+
+        for key in aligned:
+            aligned[key][i, columns] = gaze_estimations[key]
+
+    return frames, aligned
+
+# Combines the aligned gaze estimations (see align_by_frame()) into one per frame. Returns a dictionary with the columns
+# 'timestamp in s' (of the first method that has the frame), 'success', 'yaw in radians' and 'pitch in radians' and
+# 'count methods' (number of methods with a gaze estimation for the frame).
+def combine_gaze_estimations(aligned, mode='median', min_methods=1):
+
+    yaw = aligned['yaw in radians']
+    pitch = aligned['pitch in radians']
+
+    is_valid = ~np.isnan(yaw) & ~np.isnan(pitch)
+    count_methods = np.count_nonzero(is_valid, axis=0)
+
+    with warnings.catch_warnings():
+        # frames without any gaze estimation result in nan (and a warning)
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        if mode == 'median':
+            combined_yaw = np.nanmedian(np.where(is_valid, yaw, np.nan), axis=0)
+            combined_pitch = np.nanmedian(np.where(is_valid, pitch, np.nan), axis=0)
+        elif mode == 'weighted mean':
+            weights = np.where(is_valid, aligned['confidence'], 0.0)
+            sum_of_weights = np.sum(weights, axis=0)
+
+            # Fallback for frames where all methods with a gaze estimation have confidence 0: unweighted mean.
+            weights = np.where(sum_of_weights > 0.0, weights, is_valid.astype(np.float64))
+            sum_of_weights = np.sum(weights, axis=0)
+
+            combined_yaw = np.sum(weights * np.where(is_valid, yaw, 0.0), axis=0) / sum_of_weights
+            combined_pitch = np.sum(weights * np.where(is_valid, pitch, 0.0), axis=0) / sum_of_weights
+        else:
+            raise ValueError('unknown combination mode "' + mode + '" (valid: ' + ', '.join(combination_modes) + ')')
+
+    success = count_methods >= max(min_methods, 1)
+
+    # timestamp of the first method that has the frame
+    timestamps = aligned['timestamp in s']
+    first_method = np.argmax(~np.isnan(timestamps), axis=0)
+
+    return {
+        'timestamp in s': timestamps[first_method, np.arange(timestamps.shape[1])],
+        'success': success.astype(np.int64),
+        'yaw in radians': np.where(success, combined_yaw, np.nan),
+        'pitch in radians': np.where(success, combined_pitch, np.nan),
+        'count methods': count_methods
+    }
+
+def write_ensemble_to_file(path, frames, ensemble):
+
+    with open(path + '.tmp', 'w') as f:
+
+        f.write('frame,timestamp in s,success,yaw in radians,pitch in radians\n')
+
+        for frame, timestamp, success, yaw, pitch in zip(
+                frames.tolist(),
+                ensemble['timestamp in s'].tolist(),
+                ensemble['success'].tolist(),
+                ensemble['yaw in radians'].tolist(),
+                ensemble['pitch in radians'].tolist()
+                ):
+            f.write(str(frame) + ',' + str(timestamp) + ',' + str(success) + ',' + str(yaw) + ',' + str(pitch) + '\n')
+
+    os.replace(path + '.tmp', path)
+
+# Builds the ensemble of the files of the methods (paths_by_method: dictionary method -> path, methods without a file
+# are left out) and writes it to output_path. Returns the number of frames with a consensus gaze estimation.
+def build_ensemble_of_file(paths_by_method, output_path, mode='median', min_methods=1):
+
+    gaze_estimations_by_method = [
+        read_gaze_estimations(path, method)
+        for method, path in paths_by_method.items()
+        if path is not None and os.path.isfile(path)
+    ]
+
+    frames, aligned = align_by_frame(gaze_estimations_by_method)
+    ensemble = combine_gaze_estimations(aligned, mode, min_methods)
+
+    write_ensemble_to_file(output_path, frames, ensemble)
+
+    return int(np.count_nonzero(ensemble['success']))
+
+# Builds the ensemble of every file that exists for at least one of the methods inside folder (one subfolder per method)
+# and writes it to <folder>/<output method>/<file>. The files are distributed among count_workers processes.
+def build_ensembles_in_parallel(methods, folder, output_method=ensemble_method, mode='median', min_methods=1, count_workers=1):
+
+    filenames = sorted({
+        filename
+        for method in methods if os.path.isdir(os.path.join(folder, method))
+        for filename in os.listdir(os.path.join(folder, method))
+        if os.path.splitext(filename)[1] == '.csv'
+    })
+
+    os.makedirs(os.path.join(folder, output_method), exist_ok=True)
+
+    paths_by_method_of_files = [
+        {method: os.path.join(folder, method, filename) for method in methods}
+        for filename in filenames
+    ]
+    output_paths = [os.path.join(folder, output_method, filename) for filename in filenames]
+
+    if count_workers == 1 or len(filenames) <= 1:
+        return [
+            build_ensemble_of_file(paths_by_method, output_path, mode, min_methods)
+            for paths_by_method, output_path in zip(paths_by_method_of_files, output_paths)
+        ]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=count_workers) as executor:
+        return list(executor.map(
+            build_ensemble_of_file,
+            paths_by_method_of_files,
+            output_paths,
+            [mode for filename in filenames],
+            [min_methods for filename in filenames]
+        ))
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Combines the gaze estimations of several methods into one consensus gaze estimation per frame')
+
+    parser.add_argument(
+        '--methods',
+        dest='methods',
+        nargs='+',
+        default=['L2CS-Net', 'MCGaze']
+        )
+
+    parser.add_argument(
+        '--folder',
+        dest='folder',
+        help='folder with one subfolder of .csv files per method (default: ../Step_5/FeatureExtractionData)',
+        type=str,
+        default=os.path.join(repository_folder, 'Step_5', 'FeatureExtractionData')
+        )
+
+    parser.add_argument(
+        '--calibration',
+        dest='calibration',
+        help='combine the files <method>.csv of ../Step_3/EstimatedGaze instead (written to ' + ensemble_method + '.csv)',
+        action='store_true'
+        )
+
+    parser.add_argument('--output-method', dest='output_method', help='name of the ensemble method (default: ' + ensemble_method + ')', type=str, default=ensemble_method)
+    parser.add_argument('--mode', dest='mode', choices=combination_modes, default='median')
+    parser.add_argument('--min-methods', dest='min_methods', help='number of methods needed for a consensus (default: 1)', type=int, default=1)
+
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that combine files in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if args.calibration:
+        calibration_folder = os.path.join(repository_folder, 'Step_3', 'EstimatedGaze')
+
+        count_frames = build_ensemble_of_file(
+            {method: os.path.join(calibration_folder, method + '.csv') for method in args.methods},
+            os.path.join(calibration_folder, args.output_method + '.csv'),
+            args.mode,
+            args.min_methods
+        )
+
+        print(count_frames, 'frames with consensus gaze estimation')
+    else:
+        counts_frames = build_ensembles_in_parallel(args.methods, args.folder, args.output_method, args.mode, args.min_methods, args.count_workers)
+
+        print(len(counts_frames), 'files combined,', sum(counts_frames), 'frames with consensus gaze estimation')
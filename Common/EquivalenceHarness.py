@@ -0,0 +1,289 @@
+import os
+import sys
+import argparse
+import numpy as np
+import GazeDataCache
+import Benchmark
+
+
+#
+# Purpose of this script:
+# Shows that the fast implementations of Step 6 and Step 7 give the same results as the reference implementations
+# they replaced. Both are run side by side on the same inputs (the gaze estimations for the calibration video in
+# ../Step_3/EstimatedGaze and synthetic recordings, see Benchmark.generate_synthetic_recording()) and compared:
+# 1. outliers:   is_outlier() vs. find_outliers() (must match exactly)
+# 2. cleaning:   clean_and_check_feature_extraction_data() with vs. without reference outlier detection (kept frames and
+#                exclusion reason must match exactly); recordings without any successful gaze estimation must be excluded
+#                (the inputs include such a recording)
+# 3. fixations:  determine_fixations() vs. determine_fixations_with_running_means() (must match exactly)
+# 4. features:   features computed from determine_fixations(), compute_fixation_durations(), compute_saccades() and
+#                compute_velocity_acceleration() vs. EyeGazeFeatures.run(), BatchEyeGazeFeatures.run() and
+#                OnlineEyeGazeFeatures.features() at the end of the stream (must match within --rtol and --atol); the inputs
+#                include a recording with consecutive frames at the same timestamp
+# For every difference the first diverging frame (resp. the diverging features) is reported. The script exits with 1
+# if there is any difference.
+#
+# Example (run from this folder):
+# $ python EquivalenceHarness.py --synthetic 5 --minutes 3
+#
+
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Step_6'))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Step_7'))
+import CleanExtractedFeatures
+import FeatureEngineering
+
+
+# Returns (name, method, columns) for every .csv file in folder. The method is the name of the file. The columns are
+# renamed like the columns in ../Step_5/FeatureExtractionData (OpenFace names the timestamp column "timestamp").
+def load_calibration_recordings(folder):
+
+    recordings = []
+
+    for filename in sorted(os.listdir(folder)):
+
+        if os.path.splitext(filename)[1] != '.csv':
+            continue
+
+        column_names, columns = GazeDataCache.parse_csv_file(os.path.join(folder, filename))
+        columns = dict(zip(column_names, columns))
+
+        recordings.append((
+            filename,
+            os.path.splitext(filename)[0],
+            {
+                'frame': columns['frame'].astype(np.int64),
+                'timestamp in s': columns['timestamp in s'] if 'timestamp in s' in columns else columns['timestamp'],
+                'success': columns['success'].astype(np.int64),
+                'yaw in radians': columns['yaw in radians'],
+                'pitch in radians': columns['pitch in radians']
+            }
+        ))
+
+    return recordings
+
+# Same format as CleanExtractedFeatures.read_csv_file().
+def get_rows(columns):
+
+    return [
+        dict(zip(columns.keys(), row))
+        for row in zip(*[columns[column_name].tolist() for column_name in columns])
+    ]
+
+# Returns None if both sequences are equal, otherwise a description of the first difference.
+def find_first_difference(reference, candidate, frames):
+
+    reference = np.asarray(reference)
+    candidate = np.asarray(candidate)
+
+    if len(reference) != len(candidate):
+        return 'length ' + str(len(reference)) + ' (reference) vs. ' + str(len(candidate)) + ' (candidate)'
+
+    differences = np.flatnonzero(reference != candidate)
+
+    if len(differences) == 0:
+        return None
+
+    i = differences[0]
+
+    return (
+        str(len(differences)) + ' differences, first one at index ' + str(i) + ' (frame ' + str(frames[i]) + '): ' +
+        str(reference[i]) + ' (reference) vs. ' + str(candidate[i]) + ' (candidate)'
+    )
+
+# The features the way EyeGazeFeatures.run() computed them before it was optimized.
+def compute_reference_features(x, y, t, method):
+
+    features = FeatureEngineering.EyeGazeFeatures(x, y, t, method)
+
+    features._add_to_features('angle_x', x)
+    features._add_to_features('angle_y', y)
+
+    is_fixation = FeatureEngineering.determine_fixations(x, y, t, method)
+
+    fixation_durations, fixation_duration_corr_with_pitch, fixation_duration_corr_with_yaw = FeatureEngineering.compute_fixation_durations(x, y, t, is_fixation)
+    features._add_to_features('fixation_duration', fixation_durations)
+    features._add_to_features('fixation_duration_with_pitch', fixation_duration_corr_with_pitch)
+    features._add_to_features('fixation_duration_with_yaw', fixation_duration_corr_with_yaw)
+
+    saccade_durations, saccade_amplitudes = FeatureEngineering.compute_saccades(x, y, t, is_fixation)
+    features._add_to_features('saccade_duration', saccade_durations)
+    features._add_to_features('saccade_amplitude', saccade_amplitudes)
+
+    velocities, accelerations = FeatureEngineering.compute_velocity_acceleration(x, y, t, is_fixation)
+    features._add_to_features('velocity', velocities)
+    features._add_to_features('acceleration', accelerations)
+
+    return features._features
+
+# Returns None if all features are equal within the tolerances, otherwise a description of the differences.
+def find_feature_differences(reference, candidate, rtol, atol):
+
+    if list(reference.keys()) != list(candidate.keys()):
+        return 'different features: ' + str(list(reference.keys())) + ' (reference) vs. ' + str(list(candidate.keys())) + ' (candidate)'
+
+    differences = [
+        name + ': ' + repr(float(reference[name])) + ' (reference) vs. ' + repr(float(candidate[name])) + ' (candidate)'
+        for name in reference
+        if not np.isclose(reference[name], candidate[name], rtol=rtol, atol=atol)
+    ]
+
+    if len(differences) == 0:
+        return None
+
+    return '; '.join(differences)
+
+# Runs all comparisons for one recording. Returns a list of (comparison, difference) tuples, whereby difference is None
+# if reference and candidate match.
+def compare_recording(method, columns, rtol, atol):
+
+    results = []
+
+    rows = get_rows(columns)
+    non_NaN_rows = [elem for elem in rows if elem['success'] != 0]
+    non_NaN_frames = [elem['frame'] for elem in non_NaN_rows]
+
+    if len(non_NaN_rows) >= 2*CleanExtractedFeatures.count_neighbors:
+        results.append((
+            'outliers',
+            find_first_difference(
+                [CleanExtractedFeatures.is_outlier(non_NaN_rows, i) for i in range(len(non_NaN_rows))],
+                CleanExtractedFeatures.find_outliers(non_NaN_rows),
+                non_NaN_frames
+            )
+        ))
+
+    reference_cleaned_data, reference_exclusion_reason = CleanExtractedFeatures.clean_and_check_feature_extraction_data(rows, use_reference_outlier_detection=True)
+    cleaned_data, exclusion_reason = CleanExtractedFeatures.clean_and_check_feature_extraction_data(rows)
+
+    if reference_exclusion_reason != exclusion_reason:
+        results.append(('cleaning', 'exclusion reason ' + repr(reference_exclusion_reason) + ' (reference) vs. ' + repr(exclusion_reason) + ' (candidate)'))
+    elif exclusion_reason is None:
+        results.append((
+            'cleaning',
+            find_first_difference(
+                [elem['frame'] for elem in reference_cleaned_data],
+                [elem['frame'] for elem in cleaned_data],
+                [elem['frame'] for elem in reference_cleaned_data]
+            )
+        ))
+    else:
+        # The candidate stops cleaning as soon as the file turns out to be excluded (see is_certainly_excluded()).
+        results.append(('cleaning', None))
+
+    # Nothing is left to write for such recordings, so they must be excluded.
+    if len(non_NaN_rows) == 0:
+        results.append((
+            'exclusion without valid gaze estimations',
+            None if exclusion_reason is not None else 'the recording is not excluded'
+        ))
+
+    # Fixations and features are computed for the reference cleaned data (also for excluded files).
+    x = [elem['yaw in radians'] for elem in reference_cleaned_data]
+    y = [elem['pitch in radians'] for elem in reference_cleaned_data]
+    t = [elem['timestamp in s'] for elem in reference_cleaned_data]
+
+    if len(t) < 3:
+        return results
+
+    results.append((
+        'fixations',
+        find_first_difference(
+            FeatureEngineering.determine_fixations(x, y, t, method),
+            FeatureEngineering.determine_fixations_with_running_means(x, y, t, method),
+            [elem['frame'] for elem in reference_cleaned_data]
+        )
+    ))
+
+    reference_features = compute_reference_features(x, y, t, method)
+
+    results.append((
+        'features (EyeGazeFeatures)',
+        find_feature_differences(reference_features, FeatureEngineering.EyeGazeFeatures(x, y, t, method).run(), rtol, atol)
+    ))
+
+    batch_features = FeatureEngineering.BatchEyeGazeFeatures(x, y, t, [0, len(t)], method).run()
+
+    results.append((
+        'features (BatchEyeGazeFeatures)',
+        find_feature_differences(reference_features, dict(zip(FeatureEngineering.BatchEyeGazeFeatures.feature_names, batch_features[0])), rtol, atol)
+    ))
+
+    online_features = FeatureEngineering.OnlineEyeGazeFeatures(method)
+    online_features.update_batch(t, x, y)
+
+    results.append((
+        'features (OnlineEyeGazeFeatures)',
+        find_feature_differences(reference_features, online_features.features(), rtol, atol)
+    ))
+
+    return results
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Compares the fast implementations of Step 6 and Step 7 with the reference implementations')
+
+    parser.add_argument(
+        '--calibration-folder',
+        dest='calibration_folder',
+        help='folder with gaze estimation .csv files (default: ../Step_3/EstimatedGaze)',
+        type=str,
+        default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Step_3', 'EstimatedGaze')
+        )
+
+    parser.add_argument('--synthetic', dest='count_synthetic_recordings', help='number of synthetic recordings (default: 3)', type=int, default=3)
+    parser.add_argument('--minutes', dest='minutes', help='length of every synthetic recording (default: 3)', type=float, default=3.0)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--rtol', dest='rtol', help='relative tolerance for the features (default: 1e-9)', type=float, default=1e-9)
+    parser.add_argument('--atol', dest='atol', help='absolute tolerance for the features (default: 1e-12)', type=float, default=1e-12)
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    inputs = load_calibration_recordings(args.calibration_folder)
+
+    for i in range(args.count_synthetic_recordings):
+        for method in FeatureEngineering.threshold_by_method:
+            inputs.append((
+                'synthetic recording ' + str(i + 1) + ' (' + method + ')',
+                method,
+                Benchmark.generate_synthetic_recording(args.minutes * 60.0, method, args.seed + i)
+            ))
+
+    # A recording where gaze estimation failed for every frame.
+    failed_recording = Benchmark.generate_synthetic_recording(10.0, 'MCGaze', args.seed)
+    failed_recording['success'] = np.zeros_like(failed_recording['success'])
+    failed_recording['yaw in radians'] = np.full(len(failed_recording['frame']), np.nan)
+    failed_recording['pitch in radians'] = np.full(len(failed_recording['frame']), np.nan)
+    inputs.append(('synthetic recording without valid gaze estimations', 'MCGaze', failed_recording))
+
+    # A recording with frames shown at the same millisecond (see ../Step_3/ExtractFrameTimestamps.py).
+    recording_with_equal_timestamps = Benchmark.generate_synthetic_recording(10.0, 'MCGaze', args.seed)
+    recording_with_equal_timestamps['timestamp in s'] = np.array(recording_with_equal_timestamps['timestamp in s'])
+    recording_with_equal_timestamps['timestamp in s'][10::25] = recording_with_equal_timestamps['timestamp in s'][9:-1:25]
+    inputs.append(('synthetic recording with equal timestamps', 'MCGaze', recording_with_equal_timestamps))
+
+    count_differences = 0
+
+    for name, method, columns in inputs:
+
+        # Files of methods without fixation thresholds (e.g. OpenFace) are compared using the ones of MCGaze.
+        if method not in FeatureEngineering.threshold_by_method:
+            method = 'MCGaze'
+
+        for comparison, difference in compare_recording(method, columns, args.rtol, args.atol):
+
+            if difference is None:
+                print(name + ', ' + comparison + ': OK')
+            else:
+                print(name + ', ' + comparison + ': DIFFERENT (' + difference + ')')
+                count_differences += 1
+
+    print(count_differences, 'differences found')
+
+    if count_differences > 0:
+        exit(1)
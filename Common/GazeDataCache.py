@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import warnings
+import numpy as np
+
+
+#
+# Purpose of this script:
+# Every step used to parse the same gaze estimation .csv files (frame,timestamp in s,success,yaw in radians,pitch in radians)
+# with csv.DictReader and convert every single cell with int() resp. float(). read_gaze_data() parses a .csv file only once and
+# stores its columns in a binary cache file. Every later call loads the columns from the cache file instead, memory-mapped
+# (meaning nothing gets copied until the values are actually used).
+#
+# Layout of the cache:
+# For the file <folder>/<name>.csv the cache consists of
+# 1. <folder>/.gaze_cache/<name>.npy: 2-dimensional float64 array, row i contains column i of the .csv file
+#    (so every column is contiguous in memory).
+# 2. <folder>/.gaze_cache/<name>.json: small header with the column names and the modification time, size and
+#    SHA-256 hash of the .csv file the cache was created from.
+# The cache gets rebuilt whenever the .csv file changed. If only the modification time changed (e.g. the file was copied)
+# the hash decides.
+#
+
+
+cache_folder_name = '.gaze_cache'
+
+
+def get_cache_paths(path):
+
+    folder, filename = os.path.split(path)
+    name = os.path.splitext(filename)[0]
+    cache_folder = os.path.join(folder, cache_folder_name)
+
+    return os.path.join(cache_folder, name + '.npy'), os.path.join(cache_folder, name + '.json')
+
+def compute_file_hash(path):
+
+    file_hash = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+# Returns the column names and a 2-dimensional float64 array (row i contains column i of the file).
+# NaN values ("nan" in the file) are supported.
+def parse_csv_file(path):
+
+    with open(path) as csv_file:
+        column_names = csv_file.readline().rstrip('\r\n').split(',')
+
+    with warnings.catch_warnings():
+        # np.loadtxt warns about files that contain only the header.
+        warnings.simplefilter('ignore', UserWarning)
+        values = np.loadtxt(path, delimiter=',', skiprows=1, dtype=np.float64, ndmin=2)
+
+    if values.shape[0] == 0:
+        values = np.zeros((0, len(column_names)))
+
+    return column_names, np.ascontiguousarray(values.T)
+
+def write_cache(path, column_names, columns, source_stat, source_hash):
+
+    array_path, header_path = get_cache_paths(path)
+    os.makedirs(os.path.dirname(array_path), exist_ok=True)
+
+    # Write to temporary files first so that an interrupted write never leaves a broken cache behind
+    # (np.save would append '.npy' to a path that doesn't end with it). The temporary files are named after the process,
+    # so that worker processes that cache the same file at the same time don't write into each other's temporary file.
+    temporary_array_path = array_path[:-len('.npy')] + '.' + str(os.getpid()) + '.tmp.npy'
+    np.save(temporary_array_path, columns)
+    os.replace(temporary_array_path, array_path)
+
+    write_cache_header(header_path, column_names, source_stat, source_hash)
+
+def write_cache_header(header_path, column_names, source_stat, source_hash):
+
+    temporary_header_path = header_path + '.' + str(os.getpid()) + '.tmp'
+
+    with open(temporary_header_path, 'w') as f:
+        json.dump(
+            {
+                'columns': column_names,
+                'source modification time in ns': source_stat.st_mtime_ns,
+                'source size in bytes': source_stat.st_size,
+                'source sha256': source_hash
+            },
+            f
+        )
+
+    os.replace(temporary_header_path, header_path)
+
+# Returns the cache header if the cache for the file at path exists and is up to date, otherwise None.
+def read_valid_cache_header(path, source_stat):
+
+    array_path, header_path = get_cache_paths(path)
+
+    if not (os.path.isfile(array_path) and os.path.isfile(header_path)):
+        return None
+
+    try:
+        with open(header_path) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if header['source size in bytes'] != source_stat.st_size:
+        return None
+
+    if header['source modification time in ns'] != source_stat.st_mtime_ns:
+
+        if header['source sha256'] != compute_file_hash(path):
+            return None
+
+        # Content is unchanged, so only remember the new modification time.
+        write_cache_header(header_path, header['columns'], source_stat, header['source sha256'])
+
+    return header
+
+# Returns a dictionary with the column names of the .csv file at path as keys and the columns as numpy
+# float64 arrays (read-only, memory-mapped from the cache file) as values.
+def read_gaze_data(path):
+
+    source_stat = os.stat(path)
+    header = read_valid_cache_header(path, source_stat)
+
+    if header is None:
+        column_names, columns = parse_csv_file(path)
+        write_cache(path, column_names, columns, source_stat, compute_file_hash(path))
+    else:
+        column_names = header['columns']
+
+    columns = np.load(get_cache_paths(path)[0], mmap_mode='r')
+
+    return {column_name: columns[i] for i, column_name in enumerate(column_names)}
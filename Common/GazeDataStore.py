@@ -0,0 +1,209 @@
+import os
+import re
+import csv
+import json
+import argparse
+import numpy as np
+import GazeDataCache
+
+
+#
+# Purpose of this script:
+# Instead of thousands of separate .csv files (one per method and SIT video) a gaze data store holds all recordings of a
+# method in one contiguous memory-mapped array. An index tells where each recording (identified by video id and part)
+# is located inside this array and to which condition (ASC or NT) it belongs. Reading a recording, or all recordings
+# at once, is then just a slice of the memory-mapped array.
+#
+# Layout of the store for method <method>:
+# 1. <store folder>/<method>.npy: 2-dimensional float64 array, row i contains column i of the .csv files
+#    (all recordings concatenated).
+# 2. <store folder>/<method>.json: the column names and the index (one entry per recording with the keys 'video id',
+#    'part', 'condition', 'filename', 'first row' and 'count rows'). The recordings are ordered like the videos
+#    in FilenameToConditionMap.csv (and by part for the same video). Recordings of videos that are not found in
+#    FilenameToConditionMap.csv come last and have the condition None.
+#
+# Example (run from this folder) to build the stores for the cleaned data of Step 6:
+# $ python GazeDataStore.py --folder ../Step_6/CleanedFeatureExtractionData --store-folder ../Step_6/CleanedFeatureExtractionData/Store
+#
+
+
+# Returns a dictionary with video ids as keys and 'ASC' or 'NT' as values (in the order of the file).
+def read_condition_by_video_id(filename_to_condition_map_path):
+
+    condition_by_video_id = dict()
+
+    with open(filename_to_condition_map_path) as csv_file:
+        for row in csv.DictReader(csv_file):
+            condition_by_video_id[row['id']] = 'ASC' if int(row['SITCondition.ASD']) == 1 else 'NT'
+
+    return condition_by_video_id
+
+# Splits e.g. 'XF969267_part_2.csv' into ('XF969267', 2). Files without '_part_<n>' get the part None.
+def split_filename(filename):
+
+    match = re.fullmatch(r'(.*)_part_(\d+)\.csv', filename)
+
+    if match is None:
+        return os.path.splitext(filename)[0], None
+
+    return match.group(1), int(match.group(2))
+
+# Builds the store for all .csv files inside source_folder (the files of one method).
+def build_gaze_data_store(source_folder, store_folder, method, condition_by_video_id):
+
+    recordings = []
+
+    for filename in os.listdir(source_folder):
+        if os.path.isfile(source_folder + '/' + filename) and os.path.splitext(filename)[1] == '.csv':
+            video_id, part = split_filename(filename)
+            recordings.append({
+                'video id': video_id,
+                'part': part,
+                'condition': condition_by_video_id.get(video_id),
+                'filename': filename
+            })
+
+    position_by_video_id = {video_id: position for position, video_id in enumerate(condition_by_video_id)}
+
+    recordings.sort(key=lambda recording: (
+        position_by_video_id.get(recording['video id'], len(position_by_video_id)),
+        recording['video id'],
+        -1 if recording['part'] is None else recording['part']
+    ))
+
+    column_names = None
+    gaze_data_by_filename = dict()
+    first_row = 0
+
+    for recording in recordings:
+
+        gaze_data = GazeDataCache.read_gaze_data(source_folder + '/' + recording['filename'])
+
+        if column_names is None:
+            column_names = list(gaze_data.keys())
+        elif list(gaze_data.keys()) != column_names:
+            raise ValueError(recording['filename'] + ' has different columns than the other files in ' + source_folder)
+
+        gaze_data_by_filename[recording['filename']] = gaze_data
+
+        recording['first row'] = first_row
+        recording['count rows'] = len(gaze_data[column_names[0]])
+        first_row += recording['count rows']
+
+    if column_names is None:
+        column_names = []
+
+    os.makedirs(store_folder, exist_ok=True)
+
+    # Fill a temporary file first, so that there is never a half-written store.
+    temporary_array_path = store_folder + '/' + method + '.tmp.npy'
+    columns = np.lib.format.open_memmap(temporary_array_path, mode='w+', dtype=np.float64, shape=(len(column_names), first_row))
+
+    for recording in recordings:
+        for i, column_name in enumerate(column_names):
+            columns[i, recording['first row']:recording['first row'] + recording['count rows']] = gaze_data_by_filename[recording['filename']][column_name]
+
+    columns.flush()
+    del columns
+    os.replace(temporary_array_path, store_folder + '/' + method + '.npy')
+
+    with open(store_folder + '/' + method + '.json.tmp', 'w') as f:
+        json.dump({'columns': column_names, 'recordings': recordings}, f, indent=1)
+
+    os.replace(store_folder + '/' + method + '.json.tmp', store_folder + '/' + method + '.json')
+
+
+class GazeDataStore:
+    def __init__(self, store_folder, method):
+
+        with open(store_folder + '/' + method + '.json') as f:
+            header = json.load(f)
+
+        self.column_names = header['columns']
+        self.recordings = header['recordings']
+        self._columns = np.load(store_folder + '/' + method + '.npy', mmap_mode='r')
+
+        self._recording_by_filename = {recording['filename']: recording for recording in self.recordings}
+        self._recordings_by_video_id = dict()
+
+        for recording in self.recordings:
+            self._recordings_by_video_id.setdefault(recording['video id'], []).append(recording)
+
+        # Recording i covers the rows offsets[i] up to (excluding) offsets[i+1] of the columns returned by get_all_columns().
+        self.offsets = np.array(
+            [recording['first row'] for recording in self.recordings] + [self._columns.shape[1]],
+            dtype=np.int64
+        )
+
+    # Returns the index entries of all recordings of the given condition ('ASC' or 'NT', None returns all recordings).
+    def get_recordings(self, condition=None):
+
+        return [recording for recording in self.recordings if condition is None or recording['condition'] == condition]
+
+    # Returns the index entries of all recordings of the video with the given id (ordered by part).
+    def get_recordings_of_video(self, video_id):
+
+        return self._recordings_by_video_id.get(video_id, [])
+
+    # Returns a dictionary with the column names as keys and the columns of the recording as (memory-mapped) values.
+    def read_recording(self, recording):
+
+        first_row = recording['first row']
+        last_row = first_row + recording['count rows']
+
+        return {column_name: self._columns[i, first_row:last_row] for i, column_name in enumerate(self.column_names)}
+
+    def read_recording_by_filename(self, filename):
+
+        return self.read_recording(self._recording_by_filename[filename])
+
+    # Returns the columns of all recordings at once (split them with self.offsets).
+    def get_all_columns(self):
+
+        return {column_name: self._columns[i] for i, column_name in enumerate(self.column_names)}
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Builds a gaze data store for every method')
+
+    parser.add_argument(
+        '--folder',
+        dest='folder',
+        help='folder that contains one subfolder with .csv files per method',
+        type=str,
+        required=True
+        )
+
+    parser.add_argument(
+        '--store-folder',
+        dest='store_folder',
+        help='folder to write the stores to',
+        type=str,
+        required=True
+        )
+
+    parser.add_argument(
+        '--methods',
+        dest='methods',
+        nargs='+',
+        default=['L2CS-Net', 'MCGaze']
+        )
+
+    parser.add_argument(
+        '--condition-map',
+        dest='condition_map_path',
+        type=str,
+        default='../Step_5/FeatureExtractionData/FilenameToConditionMap.csv'
+        )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    condition_by_video_id = read_condition_by_video_id(args.condition_map_path)
+
+    for method in args.methods:
+        build_gaze_data_store(args.folder + '/' + method, args.store_folder, method, condition_by_video_id)
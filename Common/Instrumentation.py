@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import argparse
+import contextlib
+
+
+#
+# Purpose of this script:
+# Measures where the time goes in Steps 5 to 7. The step scripts wrap their work in measure() sections (e.g. one section per
+# file, with nested sections for reading the file, outlier detection and fixation detection) and add counters to them with
+# count() (rows read, NaN rows dropped, outliers removed, fixations and saccades found, bytes read and written).
+#
+# Instrumentation is off unless the environment variable PIPELINE_INSTRUMENTATION_FOLDER is set (e.g. by start_run(),
+# PipelineRunner.py --report does so). Then every finished section appends one JSON line to <folder>/<process id>.jsonl.
+# Worker processes (and the Step 5 subprocess of PipelineRunner.py) inherit the environment variable, so their sections are
+# recorded as well. write_report() merges the recorded sections into one JSON report with the total time and counters per
+# section and per file. The time of a section includes the time of its nested sections.
+#
+# If PIPELINE_PROFILING is set as well, the work on every file (the outermost section that belongs to a file) is profiled
+# with cProfile. The profiles are stored next to the recorded sections and the functions with the highest cumulative time
+# are included in the report. Sections without a file (e.g. a whole step) are not profiled, since they mostly wait for the
+# worker processes.
+#
+# Examples (run from this folder):
+# $ python PipelineRunner.py --report report.json --profile
+# or for a single step script:
+# $ PIPELINE_INSTRUMENTATION_FOLDER=/tmp/instrumentation python ../Step_7/ApplyFeatureEngineering.py
+# $ python Instrumentation.py --folder /tmp/instrumentation --output report.json
+#
+
+
+instrumentation_folder_variable = 'PIPELINE_INSTRUMENTATION_FOLDER'
+profiling_variable = 'PIPELINE_PROFILING'
+
+# The sections of this process that are currently measured (innermost last).
+open_sections = []
+count_profiles = 0
+
+
+def is_enabled():
+
+    return instrumentation_folder_variable in os.environ
+
+# Enables instrumentation for this process and all processes started by it. Records of earlier runs in folder are deleted.
+def start_run(folder, profiling=False):
+
+    os.makedirs(folder, exist_ok=True)
+
+    for filename in os.listdir(folder):
+        if os.path.splitext(filename)[1] in ['.jsonl', '.prof']:
+            os.remove(os.path.join(folder, filename))
+
+    os.environ[instrumentation_folder_variable] = os.path.abspath(folder)
+
+    if profiling:
+        os.environ[profiling_variable] = '1'
+    else:
+        os.environ.pop(profiling_variable, None)
+
+# Measures the time of everything inside the with block. Does nothing if instrumentation is off.
+# If filename is None the section belongs to the file of the enclosing section (if there is one).
+@contextlib.contextmanager
+def measure(section, filename=None):
+
+    global count_profiles
+
+    if not is_enabled():
+        yield
+        return
+
+    folder = os.environ[instrumentation_folder_variable]
+
+    # Nested sections belong to the file of the enclosing section.
+    if filename is None and len(open_sections) > 0:
+        filename = open_sections[-1]['file']
+
+    record = {'section': section, 'file': filename, 'process': os.getpid(), 'counters': dict()}
+
+    # cProfile can't profile nested sections separately, so only the outermost section of a file is profiled.
+    profile = None
+    if profiling_variable in os.environ and filename is not None and not any(elem['file'] is not None for elem in open_sections):
+        profile = cProfile.Profile()
+
+    open_sections.append(record)
+    start = time.perf_counter()
+
+    if profile is not None:
+        profile.enable()
+
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            count_profiles += 1
+            record['profile'] = str(os.getpid()) + '_' + str(count_profiles) + '.prof'
+            profile.dump_stats(os.path.join(folder, record['profile']))
+
+        record['seconds'] = time.perf_counter() - start
+        open_sections.pop()
+
+        os.makedirs(folder, exist_ok=True)
+
+        with open(os.path.join(folder, str(os.getpid()) + '.jsonl'), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+# Adds value to the counter of the innermost section that is currently measured. Does nothing if there is none.
+def count(counter, value=1):
+
+    if len(open_sections) == 0:
+        return
+
+    counters = open_sections[-1]['counters']
+    counters[counter] = counters.get(counter, 0) + value
+
+def read_records(folder):
+
+    records = []
+
+    for filename in sorted(os.listdir(folder)):
+        if os.path.splitext(filename)[1] == '.jsonl':
+            with open(os.path.join(folder, filename)) as f:
+                records += [json.loads(line) for line in f]
+
+    return records
+
+def add_counters(counters, added_counters):
+
+    for counter in added_counters:
+        counters[counter] = counters.get(counter, 0) + added_counters[counter]
+
+# Returns the count_functions functions with the highest cumulative time over all profiles in folder.
+def summarize_profiles(folder, count_functions):
+
+    paths = sorted(os.path.join(folder, filename) for filename in os.listdir(folder) if os.path.splitext(filename)[1] == '.prof')
+
+    if len(paths) == 0:
+        return []
+
+    stats = pstats.Stats(*paths).stats
+    functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:count_functions]
+
+    return [
+        {
+            'function': filename + ':' + str(line) + '(' + function_name + ')',
+            'calls': calls,
+            'total seconds': total_seconds,
+            'cumulative seconds': cumulative_seconds
+        }
+        for (filename, line, function_name), (primitive_calls, calls, total_seconds, cumulative_seconds, callers) in functions
+    ]
+
+# Merges the records in folder into one report and writes it to path (JSON). Returns the report.
+def write_report(folder, path, count_functions=30):
+
+    records = read_records(folder)
+
+    sections = dict()
+    files = dict()
+
+    for record in records:
+
+        section = sections.setdefault(record['section'], {'count': 0, 'seconds': 0.0, 'max seconds': 0.0, 'counters': dict()})
+        section['count'] += 1
+        section['seconds'] += record['seconds']
+        section['max seconds'] = max(section['max seconds'], record['seconds'])
+        add_counters(section['counters'], record['counters'])
+
+        if record['file'] is not None:
+            file = files.setdefault(record['file'], {'seconds by section': dict(), 'counters': dict()})
+            file['seconds by section'][record['section']] = file['seconds by section'].get(record['section'], 0.0) + record['seconds']
+            add_counters(file['counters'], record['counters'])
+
+    report = {
+        'sections': dict(sorted(sections.items())),
+        'files': dict(sorted(files.items())),
+        'profile': summarize_profiles(folder, count_functions)
+    }
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report, f, indent=1)
+
+    os.replace(path + '.tmp', path)
+
+    return report
+
+def print_report(report):
+
+    for section in report['sections']:
+        print(
+            section + ':', report['sections'][section]['count'], 'times,',
+            round(report['sections'][section]['seconds'], 3), 's',
+            report['sections'][section]['counters']
+        )
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Merges the recorded sections of an instrumented run into one JSON report')
+
+    parser.add_argument(
+        '--folder',
+        dest='folder',
+        help='folder the sections were recorded to (value of ' + instrumentation_folder_variable + ')',
+        type=str,
+        required=True
+        )
+
+    parser.add_argument('--output', dest='output', help='path of the report (default: report.json)', type=str, default='report.json')
+    parser.add_argument('--functions', dest='count_functions', help='number of profiled functions in the report (default: 30)', type=int, default=30)
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    print_report(write_report(args.folder, args.output, args.count_functions))
@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import contextlib
+import subprocess
+import GazeDataCache
+import Instrumentation
+
+
+#
+# Purpose of this script:
+# Runs Step 5 (TMP_OverwriteTimestamps.py), Step 6 (CleanExtractedFeatures.py) and Step 7 (ApplyFeatureEngineering.py) one after
+# another, but only redoes the work whose inputs or parameters changed since the last run. Every stage declares its inputs
+# (files, identified by their SHA-256 hash) and parameters (e.g. threshold_by_method, max_velocity_head_rotation). Both are
+# combined into a key per file (resp. per stage for Step 5) which is stored in the manifest together with the results. If the
+# key of a file is the same as in the manifest (and the output is still there), the stored results are used.
+# Example: Changing the fixation thresholds of MCGaze in ../Step_7/FeatureEngineering.py only recomputes the Step 7 features
+# of the MCGaze files.
+#
+# Notes:
+# 1. Step 5 can't be split up into files, so it is rerun entirely if any of its input files changed. Its output
+#    (Step_5/TMP_FeatureExtractionDataWithCorrectedTimestamps) is not read by Step 6, which reads Step_5/FeatureExtractionData
+#    (the files with corrected timestamps were copied there by hand).
+# 2. Changes of the code itself are not detected (only the declared parameters are), use --force after changing the code.
+# 3. Step 8 is a jupyter notebook and not part of the pipeline.
+#
+# Example (run from this folder):
+# $ python PipelineRunner.py --workers 8
+#
+# With --report the time and counters of every stage and file are written to a JSON report (see Instrumentation.py), with
+# --profile the report also lists the functions that took the most time:
+# $ python PipelineRunner.py --report report.json --profile
+#
+
+
+repository_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(os.path.join(repository_folder, 'Step_6'))
+sys.path.append(os.path.join(repository_folder, 'Step_7'))
+import CleanExtractedFeatures
+import ApplyFeatureEngineering
+import FeatureEngineering
+
+
+manifest_path = os.path.join(repository_folder, '.pipeline_manifest.json')
+
+
+# The step scripts use paths relative to their own folder.
+@contextlib.contextmanager
+def inside_folder(folder):
+
+    previous_folder = os.getcwd()
+    os.chdir(folder)
+
+    try:
+        yield
+    finally:
+        os.chdir(previous_folder)
+
+def read_manifest(path):
+
+    manifest = {
+        'file hashes': dict(),
+        'Step 5': dict(),
+        'Step 6': dict(),
+        'Step 7': dict()
+    }
+
+    if os.path.isfile(path):
+        with open(path) as f:
+            manifest.update(json.load(f))
+
+    return manifest
+
+def write_manifest(path, manifest):
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    os.replace(path + '.tmp', path)
+
+# Returns the SHA-256 hash of the file at path. The hash is only computed anew if the size or modification
+# time of the file differs from the one stored in the manifest.
+def get_file_hash(manifest, path):
+
+    path = os.path.relpath(os.path.abspath(path), repository_folder)
+    stat = os.stat(os.path.join(repository_folder, path))
+    entry = manifest['file hashes'].get(path)
+
+    if entry is None or entry['size in bytes'] != stat.st_size or entry['modification time in ns'] != stat.st_mtime_ns:
+        entry = {
+            'size in bytes': stat.st_size,
+            'modification time in ns': stat.st_mtime_ns,
+            'sha256': GazeDataCache.compute_file_hash(os.path.join(repository_folder, path))
+        }
+        manifest['file hashes'][path] = entry
+
+    return entry['sha256']
+
+def compute_key(*parts):
+
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def list_files(folder):
+
+    return sorted(
+        os.path.join(current_folder, filename)
+        for current_folder, subfolders, filenames in os.walk(folder)
+        for filename in filenames
+    )
+
+
+#
+# Step 5
+#
+
+def run_step_5(manifest, methods, force):
+
+    with inside_folder(os.path.join(repository_folder, 'Step_5')):
+
+        if not os.path.isdir('TMP_OpenFaceTimestamps'):
+            print('Step 5: skipped (TMP_OpenFaceTimestamps is missing)')
+            return
+
+        input_paths = list_files('TMP_OpenFaceTimestamps') + [
+            path for method in methods for path in list_files('FeatureExtractionData/' + method) if path.endswith('.csv')
+        ]
+        key = compute_key([(path, get_file_hash(manifest, path)) for path in input_paths])
+
+        output_paths = list_files('TMP_FeatureExtractionDataWithCorrectedTimestamps')
+        outputs_unchanged = manifest['Step 5'].get('outputs') == {path: get_file_hash(manifest, path) for path in output_paths}
+
+        if not force and manifest['Step 5'].get('key') == key and outputs_unchanged:
+            print('Step 5: up to date')
+            return
+
+        subprocess.run([sys.executable, 'TMP_OverwriteTimestamps.py'], check=True)
+
+        output_paths = list_files('TMP_FeatureExtractionDataWithCorrectedTimestamps')
+        manifest['Step 5'] = {
+            'key': key,
+            'outputs': {path: get_file_hash(manifest, path) for path in output_paths}
+        }
+
+        print('Step 5: done')
+
+
+#
+# Step 6
+#
+
+def get_step_6_parameters():
+
+    return {
+        'count neighbors': CleanExtractedFeatures.count_neighbors,
+        'max velocity head rotation': CleanExtractedFeatures.max_velocity_head_rotation,
+        'consecutive nan angle threshold': CleanExtractedFeatures.consecutive_nan_angle_threshold
+    }
+
+def run_step_6(manifest, methods, count_workers, streaming, force):
+
+    with inside_folder(os.path.join(repository_folder, 'Step_6')):
+
+        filenames = CleanExtractedFeatures.get_SIT_video_filenames()
+        tasks = [(method, filename) for method in methods for filename in sorted(filenames)]
+        parameters = get_step_6_parameters()
+
+        keys = dict()
+        entries = dict()
+        tasks_to_run = []
+
+        for method, filename in tasks:
+
+            task_name = method + '/' + filename
+            keys[task_name] = compute_key(
+                get_file_hash(manifest, '../Step_5/FeatureExtractionData/' + method + '/' + filename),
+                parameters
+            )
+            entry = manifest['Step 6'].get(task_name)
+
+            if force or entry is None or entry['key'] != keys[task_name]:
+                tasks_to_run.append((method, filename))
+                continue
+
+            # A published file must still be unchanged.
+            path = 'CleanedFeatureExtractionData/' + method + '/' + filename
+            if entry['published'] and not (os.path.isfile(path) and get_file_hash(manifest, path) == entry['output sha256']):
+                tasks_to_run.append((method, filename))
+                continue
+
+            entries[task_name] = entry
+
+        results_by_task_name = {
+            method + '/' + filename: exclusion_reason
+            for method, filename, exclusion_reason in CleanExtractedFeatures.clean_tasks_in_parallel(tasks_to_run, count_workers, streaming)
+        }
+
+        for task_name in entries:
+            results_by_task_name[task_name] = entries[task_name]['exclusion reason']
+
+        results = [(method, filename, results_by_task_name[method + '/' + filename]) for method, filename in tasks]
+        exclusion_reasons_by_filename = CleanExtractedFeatures.reconcile_exclusions(results)
+
+        # Files that were dropped by an earlier run (because they were excluded for another method), but are not anymore.
+        tasks_to_rerun = [
+            (method, filename)
+            for method, filename in tasks
+            if method + '/' + filename in entries
+            and not entries[method + '/' + filename]['published']
+            and entries[method + '/' + filename]['exclusion reason'] is None
+            and not CleanExtractedFeatures.is_excluded(exclusion_reasons_by_filename, method, filename)
+        ]
+        CleanExtractedFeatures.clean_tasks_in_parallel(tasks_to_rerun, count_workers, streaming)
+
+        CleanExtractedFeatures.print_exclusion_summary(results)
+        CleanExtractedFeatures.publish_cleaned_files(results, exclusion_reasons_by_filename)
+
+        CleanExtractedFeatures.write_exclusion_reasons_to_file('CleanedFeatureExtractionData/ExclusionReasons.csv', exclusion_reasons_by_filename)
+        CleanExtractedFeatures.write_cleaned_filenames_to_file(
+            'CleanedFeatureExtractionData/CleanedFiles.csv',
+            CleanExtractedFeatures.get_cleaned_filenames(sorted(filenames), exclusion_reasons_by_filename)
+        )
+
+        manifest['Step 6'] = dict()
+
+        for method, filename, exclusion_reason in results:
+
+            path = 'CleanedFeatureExtractionData/' + method + '/' + filename
+            published = not CleanExtractedFeatures.is_excluded(exclusion_reasons_by_filename, method, filename)
+
+            manifest['Step 6'][method + '/' + filename] = {
+                'key': keys[method + '/' + filename],
+                'exclusion reason': exclusion_reason,
+                'published': published,
+                'output sha256': get_file_hash(manifest, path) if published else None
+            }
+
+        print('Step 6:', len(tasks_to_run) + len(tasks_to_rerun), 'of', len(tasks), 'files cleaned')
+
+
+#
+# Step 7
+#
+
+def get_step_7_parameters(method):
+
+    return {
+        'yaw threshold': float(FeatureEngineering.threshold_by_method[method]['yaw']),
+        'pitch threshold': float(FeatureEngineering.threshold_by_method[method]['pitch'])
+    }
+
+def run_step_7(manifest, methods, count_workers, force):
+
+    with inside_folder(os.path.join(repository_folder, 'Step_7')):
+
+        filenames = ApplyFeatureEngineering.get_SIT_video_filenames(methods)
+        tasks = [
+            (method, condition, filename)
+            for method in methods
+            for condition in filenames[method]
+            for filename in filenames[method][condition]
+        ]
+
+        keys = dict()
+        tasks_to_run = []
+
+        for method, condition, filename in tasks:
+
+            task_name = method + '/' + filename
+            keys[task_name] = compute_key(
+                get_file_hash(manifest, '../Step_6/CleanedFeatureExtractionData/' + method + '/' + filename),
+                get_step_7_parameters(method)
+            )
+            entry = manifest['Step 7'].get(task_name)
+
+            if force or entry is None or entry['key'] != keys[task_name]:
+                tasks_to_run.append((method, condition, filename))
+
+        results = ApplyFeatureEngineering.engineer_features_of_tasks_in_parallel(tasks_to_run, count_workers)
+
+        step_7_entries = dict()
+
+        for method, condition, filename in tasks:
+            step_7_entries[method + '/' + filename] = manifest['Step 7'].get(method + '/' + filename)
+
+        for (method, condition, filename), gaze_features in zip(tasks_to_run, results):
+            step_7_entries[method + '/' + filename] = {
+                'key': keys[method + '/' + filename],
+                'features': gaze_features
+            }
+
+        manifest['Step 7'] = step_7_entries
+
+        engineered_features = dict()
+
+        for method in methods:
+            engineered_features[method] = dict()
+            for condition in filenames[method]:
+                engineered_features[method][condition] = []
+
+        for method, condition, filename in tasks:
+            engineered_features[method][condition].append(step_7_entries[method + '/' + filename]['features'])
+
+        for method in engineered_features:
+            for condition in engineered_features[method]:
+                if len(engineered_features[method][condition]) > 0:
+                    ApplyFeatureEngineering.write_features_to_file(engineered_features[method][condition], method, condition)
+
+        print('Step 7:', len(tasks_to_run), 'of', len(tasks), 'files processed')
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Runs Steps 5 to 7, but only redoes what changed since the last run')
+
+    parser.add_argument(
+        '--stages',
+        dest='stages',
+        nargs='+',
+        type=int,
+        choices=[5, 6, 7],
+        default=[5, 6, 7]
+        )
+
+    parser.add_argument(
+        '--methods',
+        dest='methods',
+        nargs='+',
+        default=['L2CS-Net', 'MCGaze']
+        )
+
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that work in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
+
+    parser.add_argument(
+        '--streaming',
+        dest='streaming',
+        help='clean the files of Step 6 with constant memory',
+        action='store_true'
+        )
+
+    parser.add_argument(
+        '--force',
+        dest='force',
+        help='ignore the manifest and redo everything',
+        action='store_true'
+        )
+
+    parser.add_argument(
+        '--report',
+        dest='report_path',
+        help='write the time and counters of every stage and file to this JSON file',
+        type=str,
+        default=None
+        )
+
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        help='profile every stage and file with cProfile (only with --report)',
+        action='store_true'
+        )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    manifest = read_manifest(manifest_path)
+
+    if args.report_path is not None:
+        Instrumentation.start_run(args.report_path + '.records', args.profile)
+
+    # The manifest is written after every stage, so the work of finished stages is kept if a later stage fails.
+    if 5 in args.stages:
+        with Instrumentation.measure('Step 5'):
+            run_step_5(manifest, args.methods, args.force)
+        write_manifest(manifest_path, manifest)
+
+    if 6 in args.stages:
+        with Instrumentation.measure('Step 6'):
+            run_step_6(manifest, args.methods, args.count_workers, args.streaming, args.force)
+        write_manifest(manifest_path, manifest)
+
+    if 7 in args.stages:
+        with Instrumentation.measure('Step 7'):
+            run_step_7(manifest, args.methods, args.count_workers, args.force)
+        write_manifest(manifest_path, manifest)
+
+    if args.report_path is not None:
+        Instrumentation.print_report(Instrumentation.write_report(args.report_path + '.records', args.report_path))
@@ -0,0 +1,203 @@
+import csv
+import json
+import argparse
+import numpy as np
+
+
+#
+# Purpose of this script:
+# Writes ./CalibrationFrames.csv, which tells for every calibration point the frames of the calibration video that were shown
+# while the participant clicked on it. The mouse click times (in ms) come from the SIT (../Step_2/CalibrationData.json, the
+# calibration points are numbered in the order of this file), the time when each frame is shown comes from
+# ExtractFrameTimestamps.py (./CalibrationVideo_Timestamps.csv, also in ms).
+# The first frame of a calibration point is the first frame shown at or after its first click, the last frame is the last
+# frame shown at or before its last click (so all frames from the first to the last frame were shown between the clicks).
+#
+# The event times are mapped to frames with a binary search in the sorted timestamps (np.searchsorted), for any number of
+# videos and events at once (see map_times_to_frames_of_videos()). So the calibration frames of every participant's own
+# calibration sequence can be determined in one call instead of being looked up by hand.
+#
+# Example (run from this folder):
+# $ python DetermineCalibrationFrames.py
+# or for several videos:
+# $ python DetermineCalibrationFrames.py --timestamps A_Timestamps.csv B_Timestamps.csv --calibration-data A.json B.json --output A_CalibrationFrames.csv B_CalibrationFrames.csv
+#
+
+
+# Returns the frames and the timestamps (in ms) of a file written by ExtractFrameTimestamps.py (numpy int64 arrays, sorted
+# by timestamp).
+def read_frame_timestamps(path):
+
+    values = np.loadtxt(path, delimiter=',', skiprows=1, dtype=np.int64, ndmin=2)
+
+    return values[:, 0], values[:, 1]
+
+# Returns the names of the calibration points and their first and last mouse click (in ms), in the order of the file.
+def read_click_intervals(calibration_data_path):
+
+    with open(calibration_data_path) as f:
+        calibration_data = json.load(f)
+
+    names = list(calibration_data.keys())
+
+    return (
+        names,
+        np.array([min(calibration_data[name]['clicks']) for name in names], dtype=np.int64),
+        np.array([max(calibration_data[name]['clicks']) for name in names], dtype=np.int64)
+    )
+
+# Maps the event times (in ms) to frames of a video with the given frames and timestamps (sorted).
+# If first_frame_at_or_after is True the first frame shown at or after every time is returned (-1 if there is none),
+# otherwise the last frame shown at or before every time (-1 if there is none).
+def map_times_to_frames(frames, timestamps, times, first_frame_at_or_after=True):
+
+    times = np.asarray(times, dtype=np.int64)
+
+    if len(timestamps) == 0:
+        return np.full(len(times), -1, dtype=np.int64)
+
+    if first_frame_at_or_after:
+        indices = np.searchsorted(timestamps, times, side='left')
+    else:
+        indices = np.searchsorted(timestamps, times, side='right') - 1
+
+    is_valid = (indices >= 0) & (indices < len(timestamps))
+
+    return np.where(is_valid, frames[np.clip(indices, 0, len(frames) - 1)], -1)
+
+# Same as map_times_to_frames(), but for several videos at once: times[j] is mapped to the frames of the video
+# video_indices[j] (frames_by_video[i] and timestamps_by_video[i] belong to video i).
+# The timestamps of all videos are shifted into disjoint ranges and concatenated, so all times are mapped with one search.
+def map_times_to_frames_of_videos(frames_by_video, timestamps_by_video, video_indices, times, first_frame_at_or_after=True):
+
+    video_indices = np.asarray(video_indices, dtype=np.int64)
+    times = np.asarray(times, dtype=np.int64)
+
+    if len(times) == 0 or all(len(timestamps) == 0 for timestamps in timestamps_by_video):
+        return np.full(len(times), -1, dtype=np.int64)
+
+    counts = np.array([len(timestamps) for timestamps in timestamps_by_video], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    # Every video gets a range of width span that contains all its timestamps and all times mapped to it.
+    minimum = min([np.min(times)] + [timestamps[0] for timestamps in timestamps_by_video if len(timestamps) > 0])
+    maximum = max([np.max(times)] + [timestamps[-1] for timestamps in timestamps_by_video if len(timestamps) > 0])
+    span = maximum - minimum + 1
+
+    all_timestamps = np.concatenate([
+        np.asarray(timestamps, dtype=np.int64) - minimum + i*span for i, timestamps in enumerate(timestamps_by_video)
+    ])
+    all_frames = np.concatenate([np.asarray(frames, dtype=np.int64) for frames in frames_by_video])
+    shifted_times = times - minimum + video_indices*span
+
+    if first_frame_at_or_after:
+        indices = np.searchsorted(all_timestamps, shifted_times, side='left')
+        is_valid = indices < offsets[video_indices + 1]
+    else:
+        indices = np.searchsorted(all_timestamps, shifted_times, side='right') - 1
+        is_valid = indices >= offsets[video_indices]
+
+    return np.where(is_valid, all_frames[np.clip(indices, 0, len(all_frames) - 1)], -1)
+
+# Determines the calibration frames of several videos at once. Returns a list with one dictionary per video with the keys
+# 'calibration points' (numbered from 1), 'first clicks', 'last clicks', 'first frames' and 'last frames' (numpy arrays).
+def determine_calibration_frames(timestamps_paths, calibration_data_paths):
+
+    frames_by_video = []
+    timestamps_by_video = []
+    click_intervals_by_video = []
+
+    for timestamps_path, calibration_data_path in zip(timestamps_paths, calibration_data_paths):
+
+        frames, timestamps = read_frame_timestamps(timestamps_path)
+        frames_by_video.append(frames)
+        timestamps_by_video.append(timestamps)
+        click_intervals_by_video.append(read_click_intervals(calibration_data_path))
+
+    video_indices = np.concatenate([np.full(len(first_clicks), i, dtype=np.int64) for i, (names, first_clicks, last_clicks) in enumerate(click_intervals_by_video)])
+    first_clicks = np.concatenate([first_clicks for names, first_clicks, last_clicks in click_intervals_by_video])
+    last_clicks = np.concatenate([last_clicks for names, first_clicks, last_clicks in click_intervals_by_video])
+
+    first_frames = map_times_to_frames_of_videos(frames_by_video, timestamps_by_video, video_indices, first_clicks, True)
+    last_frames = map_times_to_frames_of_videos(frames_by_video, timestamps_by_video, video_indices, last_clicks, False)
+
+    calibration_frames = []
+
+    for i in range(len(click_intervals_by_video)):
+
+        is_of_video = video_indices == i
+
+        calibration_frames.append({
+            'calibration points': np.arange(1, np.count_nonzero(is_of_video) + 1),
+            'first clicks': first_clicks[is_of_video],
+            'last clicks': last_clicks[is_of_video],
+            'first frames': first_frames[is_of_video],
+            'last frames': last_frames[is_of_video]
+        })
+
+    return calibration_frames
+
+# Writes the calibration frames of one video in the format of ./CalibrationFrames.csv.
+def write_calibration_frames_to_file(path, calibration_frames):
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(['calibration point', 'mouse click interval', 'first frame', 'last frame'])
+
+        for calibration_point, first_click, last_click, first_frame, last_frame in zip(
+                calibration_frames['calibration points'],
+                calibration_frames['first clicks'],
+                calibration_frames['last clicks'],
+                calibration_frames['first frames'],
+                calibration_frames['last frames']
+                ):
+            writer.writerow([calibration_point, '[' + str(first_click) + '; ' + str(last_click) + ']', first_frame, last_frame])
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Determines the frames shown during the mouse clicks on every calibration point')
+
+    parser.add_argument(
+        '--timestamps',
+        dest='timestamps_paths',
+        help='_Timestamps.csv file(s) written by ExtractFrameTimestamps.py (default: CalibrationVideo_Timestamps.csv)',
+        nargs='+',
+        type=str,
+        default=['CalibrationVideo_Timestamps.csv']
+        )
+
+    parser.add_argument(
+        '--calibration-data',
+        dest='calibration_data_paths',
+        help='calibration data of the SIT, one per timestamps file (default: ../Step_2/CalibrationData.json)',
+        nargs='+',
+        type=str,
+        default=['../Step_2/CalibrationData.json']
+        )
+
+    parser.add_argument(
+        '--output',
+        dest='output_paths',
+        help='.csv file(s) to write, one per timestamps file (default: CalibrationFrames.csv)',
+        nargs='+',
+        type=str,
+        default=['CalibrationFrames.csv']
+        )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if not (len(args.timestamps_paths) == len(args.calibration_data_paths) == len(args.output_paths)):
+        print('--timestamps, --calibration-data and --output need the same number of files!')
+        exit()
+
+    for output_path, calibration_frames in zip(args.output_paths, determine_calibration_frames(args.timestamps_paths, args.calibration_data_paths)):
+
+        write_calibration_frames_to_file(output_path, calibration_frames)
+
+        if np.any(calibration_frames['first frames'] < 0) or np.any(calibration_frames['last frames'] < 0):
+            print(output_path + ': some mouse clicks happened before the first resp. after the last frame of the video')
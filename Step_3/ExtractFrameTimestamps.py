@@ -1,5 +1,9 @@
 import os
+import json
 import argparse
+import subprocess
+import concurrent.futures
+from fractions import Fraction
 from pathlib import Path
 
 
@@ -19,30 +23,92 @@ from pathlib import Path
 # of the files generated when applying the methods on the 164 SIT videos. How these were corrected is explained
 # in TMP_OverwriteTimestamps.py found in the ../Step_5 folder.
 #
+# Originally the timestamps were extracted by letting ffmpeg write every frame as .png file named after its timestamp
+# (see extract_timestamps_by_writing_frames()), which needs a lot of disk space and time just to read the filenames.
+# By default the timestamps are now read from the video container with ffprobe instead (see extract_timestamps()), no frame
+# gets decoded or written to disk. The written .csv file (frame,timestamp with the timestamp in ms) has the same format and,
+# for videos whose frames are at least 1 ms apart (like the SIT calibration video), the same content.
+# One difference: if two frames round to the same millisecond, the .png method wrote both to the same file, so only one
+# of them was left (and the frames after it got a lower number). The ffprobe method keeps every frame, so the written file
+# can contain the same timestamp twice in a row. Code that divides by the difference of consecutive timestamps has to
+# handle a difference of 0.
+#
 
 
-def parse_args():
+# Rescales the integer timestamp from time base from_time_base to time base to_time_base (both Fractions) and rounds
+# to the nearest integer, halfway cases away from zero (like av_rescale_q() of ffmpeg does).
+def rescale_timestamp(timestamp, from_time_base, to_time_base):
 
-    parser = argparse.ArgumentParser(description='Writes the frame id with timestamp when it is shown in the video to file')
-    
-    parser.add_argument(
-        '--video',
-        dest='video_path',
-        help='path of the video to proccess',  
-        type=str
-        )
-    
-    return parser.parse_args()
+    value = timestamp * from_time_base / to_time_base
+    rounded = (abs(value.numerator) * 2 + value.denominator) // (2 * value.denominator)
 
-if __name__ == '__main__':
+    return rounded if value >= 0 else -rounded
 
-    args = parse_args()
+# Returns the time base of the first video stream (Fraction) and the start time of the container in microseconds.
+def probe_video(video_path):
 
-    if not args.video_path:
-        print("--video argument is mandatory!")
-        exit()
+    output = subprocess.run(
+        [
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'stream=time_base:format=start_time',
+            '-of', 'json', video_path
+        ],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+
+    probe_result = json.loads(output)
+    time_base = Fraction(probe_result['streams'][0]['time_base'])
+    start_time = probe_result['format'].get('start_time', 'N/A')
+
+    # ffprobe prints the start time with exactly 6 decimal places (it's stored in microseconds).
+    start_time_in_us = 0 if start_time == 'N/A' else round(Fraction(start_time) * 1000000)
+
+    return time_base, start_time_in_us
+
+# Returns the timestamps (in ms, sorted) when the frames of the video are shown, one per frame (frames that round to the
+# same millisecond are kept, see above). Only the packets of the first video stream are read (demuxing, no decoding). ffprobe's output is parsed line by line while ffprobe is still running.
+# Just like ffmpeg does when writing the frames (see extract_timestamps_by_writing_frames()) the timestamps are relative
+# to the start time of the container.
+def extract_timestamps(video_path):
 
-    frame_folder_path = 'FramesOf_' + Path(args.video_path).stem
+    time_base, start_time_in_us = probe_video(video_path)
+    start_time_in_time_base = rescale_timestamp(start_time_in_us, Fraction(1, 1000000), time_base)
+
+    timestamps = []
+
+    with subprocess.Popen(
+        [
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts',
+            '-of', 'csv=p=0', video_path
+        ],
+        stdout=subprocess.PIPE,
+        text=True
+    ) as ffprobe:
+
+        for line in ffprobe.stdout:
+
+            pts = line.strip().rstrip(',')
+
+            # packets without presentation timestamp don't result in a frame
+            if pts == '' or pts == 'N/A':
+                continue
+
+            timestamps.append(rescale_timestamp(int(pts) - start_time_in_time_base, time_base, Fraction(1, 1000)))
+
+    if ffprobe.returncode != 0:
+        raise RuntimeError('ffprobe failed for ' + video_path)
+
+    timestamps.sort()
+
+    return timestamps
+
+# The original way to extract the timestamps (writes every frame to disk).
+def extract_timestamps_by_writing_frames(video_path):
+
+    frame_folder_path = 'FramesOf_' + Path(video_path).stem
 
     if os.path.isdir(frame_folder_path):
         print('Before running this script you need to get rid of the folder \"' + frame_folder_path + '\" first')
@@ -56,11 +122,11 @@ if __name__ == '__main__':
     os.system('mkdir ' + frame_folder_path)
 
     # source: https://superuser.com/a/1421195
-    os.system('ffmpeg -i {} -vsync 0 -r 1000 -frame_pts true {}/%d.png'.format(args.video_path, frame_folder_path))
+    os.system('ffmpeg -i {} -vsync 0 -r 1000 -frame_pts true {}/%d.png'.format(video_path, frame_folder_path))
 
 
     #
-    # Second: Read in filenames and write frame number with timestamp to file
+    # Second: Read in filenames
     #
 
     timestamps = []
@@ -70,13 +136,84 @@ if __name__ == '__main__':
 
     timestamps.sort()
 
-    with open(Path(args.video_path).stem + '_Timestamps.csv', 'w') as f:
+
+    # remove temporary frame path again
+    os.system('rm -r ' + frame_folder_path)
+
+    return timestamps
+
+def write_timestamps_to_file(path, timestamps):
+
+    with open(path, 'w') as f:
 
         f.write('frame,timestamp\n')
-        
+
         for frame_index, timestamp in enumerate(timestamps):
             f.write(str(frame_index + 1) + ',' + str(timestamp) + '\n')
 
+# Extracts the timestamps of the video and writes them to <output folder>/<video name>_Timestamps.csv.
+def extract_timestamps_of_video(video_path, output_folder='.', write_frames=False):
 
-    # remove temporary frame path again
-    os.system('rm -r ' + frame_folder_path)
+    if write_frames:
+        timestamps = extract_timestamps_by_writing_frames(video_path)
+    else:
+        timestamps = extract_timestamps(video_path)
+
+    write_timestamps_to_file(os.path.join(output_folder, Path(video_path).stem + '_Timestamps.csv'), timestamps)
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Writes the frame id with timestamp when it is shown in the video to file')
+    
+    parser.add_argument(
+        '--video',
+        dest='video_paths',
+        help='path(s) of the video(s) to proccess',
+        nargs='+',
+        type=str
+        )
+
+    parser.add_argument(
+        '--output-folder',
+        dest='output_folder',
+        help='folder to write the _Timestamps.csv files to (default: current folder)',
+        type=str,
+        default='.'
+        )
+
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of videos that are processed in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
+
+    parser.add_argument(
+        '--write-frames',
+        dest='write_frames',
+        help='extract the timestamps the original way (writes every frame as .png file, one video after another)',
+        action='store_true'
+        )
+    
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if not args.video_paths:
+        print("--video argument is mandatory!")
+        exit()
+
+    if args.write_frames or args.count_workers == 1:
+        for video_path in args.video_paths:
+            extract_timestamps_of_video(video_path, args.output_folder, args.write_frames)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.count_workers) as executor:
+            list(executor.map(
+                extract_timestamps_of_video,
+                args.video_paths,
+                [args.output_folder for video_path in args.video_paths]
+            ))
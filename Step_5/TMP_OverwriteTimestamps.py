@@ -1,7 +1,13 @@
 import os
 import csv
+import argparse
+import concurrent.futures
+import sys
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import Instrumentation
+
 #
 # NOTE:
 # This was meant to be a temporary file, but ultimately I decided to not delete it, because
@@ -14,6 +20,50 @@ import numpy as np
 # with timestamps provided to me by my supervisor (apparently he had encountered this issue too when
 # applying OpenFace on the SIT videos and then corrected the timestamps).
 # 
+# The script used to read every file up to 4 times and to exit as soon as something unexpected happened. Now every file
+# is read only once, the frames are aligned with numpy, the files are processed in parallel and problems are reported
+# per file (see TimestampCorrectionError) after all files were processed.
+#
+
+
+# Folders inside TMP_OpenFaceTimestamps that contain the OpenFace files with the corrected timestamps. If a file is found
+# in several folders the first one is used.
+openface_folders = ['open_face_features_alu_mix_lab', 'open_face_features_hu_home', 'open_face_features_hu_mix_lab']
+
+
+# Base class of all problems that prevent the timestamps of a file from being corrected.
+# Note: All constructor arguments are passed on to Exception.__init__(), so the errors can be sent back from worker processes.
+class TimestampCorrectionError(Exception):
+    pass
+
+# The gaze estimation method analyzed less frames than there are in the OpenFace file.
+class TooFewFramesError(TimestampCorrectionError):
+    def __init__(self, path, count_frames, count_openface_frames):
+        super().__init__(path, count_frames, count_openface_frames)
+        self.path = path
+        self.count_frames = count_frames
+        self.count_openface_frames = count_openface_frames
+
+    def __str__(self):
+        return (
+            self.path + ': My file has LESS rows (' + str(self.count_frames) + ") than MBP team's OpenFace file (" +
+            str(self.count_openface_frames) + ')!!! How could this happen?'
+        )
+
+# Row index (counting from 0) of the file contains frame, but the same row of the OpenFace file contains openface_frame.
+class FrameMismatchError(TimestampCorrectionError):
+    def __init__(self, path, index, frame, openface_frame):
+        super().__init__(path, index, frame, openface_frame)
+        self.path = path
+        self.index = index
+        self.frame = frame
+        self.openface_frame = openface_frame
+
+    def __str__(self):
+        return (
+            self.path + ": Frames don't match!!! Row " + str(self.index + 1) + ' is frame ' + str(self.frame) +
+            ', but frame ' + str(self.openface_frame) + ' in the OpenFace file'
+        )
 
 
 def get_SIT_video_filenames():
@@ -35,29 +85,86 @@ def get_SIT_video_filenames():
 
     return filenames
 
-def read_openface_frames_with_timestamps(path):
+# Returns a dictionary with the filenames as keys and the path of the OpenFace file with the corrected timestamps as values.
+def build_openface_timestamp_index():
+
+    openface_path_by_filename = dict()
 
-    openface_frames_with_timestamps = []
-    openface_data = None
+    for folder in openface_folders:
+
+        folder_path = 'TMP_OpenFaceTimestamps/' + folder
+
+        if not os.path.isdir(folder_path):
+            continue
+
+        for filename in os.listdir(folder_path):
+            if filename not in openface_path_by_filename and os.path.isfile(folder_path + '/' + filename):
+                openface_path_by_filename[filename] = folder_path + '/' + filename
+
+    return openface_path_by_filename
+
+# Returns the frames (numpy array of ints) and the timestamps (list of strings, so they are written back unchanged).
+def read_openface_frames_with_timestamps(path):
 
     with open(path) as csv_file:
         openface_data = list(csv.DictReader(csv_file))
 
-    for row in openface_data:
-        frame_with_timestamp = dict()
-        frame_with_timestamp['frame'] = row['frame']
-        frame_with_timestamp['timestamp in s'] = row['timestamp']
-        openface_frames_with_timestamps.append(frame_with_timestamp)
+    Instrumentation.count('bytes read', os.path.getsize(path))
 
-    return openface_frames_with_timestamps
+    frames = np.array([int(row['frame']) for row in openface_data], dtype=np.int64)
+    timestamps = [row['timestamp'] for row in openface_data]
+
+    return frames, timestamps
 
 def read_extracted_features(method, filename):
 
     with open('FeatureExtractionData/' + method + '/' + filename) as csv_file:
-        return list(csv.DictReader(csv_file))
-    
+        extracted_features = list(csv.DictReader(csv_file))
+
+    Instrumentation.count('rows read', len(extracted_features))
+    Instrumentation.count('bytes read', os.path.getsize('FeatureExtractionData/' + method + '/' + filename))
+
+    return extracted_features
+
+# Overwrites the timestamps of extracted_features (rows of a file in FeatureExtractionData) with the OpenFace timestamps.
+# The timestamps of frames that are missing in the OpenFace file are estimated from the mean difference of the last
+# 10 OpenFace timestamps. Raises a TimestampCorrectionError if the frames don't match.
+def align_timestamps(path, extracted_features, openface_frames, openface_timestamps):
+
+    count_openface_frames = len(openface_frames)
+
+    if len(extracted_features) < count_openface_frames:
+        raise TooFewFramesError(path, len(extracted_features), count_openface_frames)
+
+    frames = np.array([int(elem['frame']) for elem in extracted_features[:count_openface_frames]], dtype=np.int64)
+    mismatches = np.flatnonzero(frames != openface_frames)
+
+    if len(mismatches) > 0:
+        raise FrameMismatchError(path, int(mismatches[0]), int(frames[mismatches[0]]), int(openface_frames[mismatches[0]]))
+
+    if len(extracted_features) > count_openface_frames:
+        #print(path + ': My methods analyzed', len(extracted_features) - count_openface_frames, "frames more than there are in the MBP team's OpenFace file!")
+
+        # estimate the remaining timestamps
+        last_timestamp = float(openface_timestamps[-1])
+        mean_diff_prev_10_timestamps = (last_timestamp - float(openface_timestamps[-11])) / 10.0
+
+        for i in range(0, len(extracted_features) - count_openface_frames):
+            extracted_features[count_openface_frames + i]['timestamp in s'] = str(round(
+                last_timestamp + float(i+1)*mean_diff_prev_10_timestamps,
+                3
+            ))
+
+    for i in range(0, count_openface_frames):
+        extracted_features[i]['timestamp in s'] = openface_timestamps[i]
+
+    return extracted_features
+
 def write_extracted_features_back_to_file(method, filename, extracted_features_with_adjusted_timestamps):
-    with open('TMP_FeatureExtractionDataWithCorrectedTimestamps/' + method + '/' + filename, 'w', newline='') as csv_file:
+
+    path = 'TMP_FeatureExtractionDataWithCorrectedTimestamps/' + method + '/' + filename
+
+    with open(path + '.tmp', 'w', newline='') as csv_file:
         writer = csv.DictWriter(csv_file, fieldnames=extracted_features_with_adjusted_timestamps[0].keys())
         
         writer.writeheader()
@@ -65,63 +172,88 @@ def write_extracted_features_back_to_file(method, filename, extracted_features_w
         for elem in extracted_features_with_adjusted_timestamps:
             writer.writerow(elem)
 
+    Instrumentation.count('bytes written', os.path.getsize(path + '.tmp'))
+
+    os.replace(path + '.tmp', path)
+
+# Corrects the timestamps of the file for all methods. Every file is read only once.
+# Returns (filename, error), whereby error is the TimestampCorrectionError that occurred (None if there was none).
+# Nothing is written for a file if an error occurs for one of the methods.
+def correct_timestamps_of_file(filename, openface_path, methods):
+
+    with Instrumentation.measure('Step 5: correct timestamps', filename):
+        return correct_timestamps_of_file_without_instrumentation(filename, openface_path, methods)
+
+def correct_timestamps_of_file_without_instrumentation(filename, openface_path, methods):
+
+    openface_frames, openface_timestamps = read_openface_frames_with_timestamps(openface_path)
+
+    extracted_features_by_method = {method: read_extracted_features(method, filename) for method in methods}
+
+    if 'L2CS-Net' in extracted_features_by_method and 'MCGaze' in extracted_features_by_method:
+        if len(extracted_features_by_method['L2CS-Net']) < len(extracted_features_by_method['MCGaze']):
+            print(filename + ": len(L2CSNet) < len(MCGaze)")
+        elif len(extracted_features_by_method['L2CS-Net']) > len(extracted_features_by_method['MCGaze']):
+            print(filename + ": len(L2CSNet) > len(MCGaze)!!! This is unexpected!")
+
+    try:
+        for method in methods:
+            align_timestamps(openface_path, extracted_features_by_method[method], openface_frames, openface_timestamps)
+    except TimestampCorrectionError as error:
+        return filename, error
+
+    for method in methods:
+        write_extracted_features_back_to_file(method, filename, extracted_features_by_method[method])
+
+    return filename, None
 
+# Corrects the timestamps of all files that have an OpenFace file with corrected timestamps, the files are distributed among
+# count_workers processes. Returns the results of correct_timestamps_of_file() ordered by filename.
+def correct_timestamps_in_parallel(methods, count_workers):
 
-filenames = get_SIT_video_filenames()
+    openface_path_by_filename = build_openface_timestamp_index()
+    filenames = [filename for filename in sorted(get_SIT_video_filenames()) if filename in openface_path_by_filename]
 
-for filename in filenames:
-    for folder in ['open_face_features_alu_mix_lab', 'open_face_features_hu_home', 'open_face_features_hu_mix_lab']:
-        possible_path = 'TMP_OpenFaceTimestamps/' + folder + '/' + filename
-        if os.path.isfile(possible_path):
+    if count_workers == 1:
+        return [correct_timestamps_of_file(filename, openface_path_by_filename[filename], methods) for filename in filenames]
 
-            openface_frames_with_timestamps = read_openface_frames_with_timestamps(possible_path)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=count_workers) as executor:
+        return list(executor.map(
+            correct_timestamps_of_file,
+            filenames,
+            [openface_path_by_filename[filename] for filename in filenames],
+            [methods for filename in filenames]
+        ))
 
-            for method in ['L2CS-Net', 'MCGaze']:
-                extracted_features = read_extracted_features(method, filename)
 
+def parse_args():
 
+    parser = argparse.ArgumentParser(description='Overwrites the timestamps of the SIT video files with the corrected OpenFace timestamps')
 
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that correct files in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
 
-                #
-                #
-                #
+    return parser.parse_args()
 
-                L2CSNet = read_extracted_features('L2CS-Net', filename)
-                MCGaze = read_extracted_features('MCGaze', filename)
-                if len(L2CSNet) < len(MCGaze):
-                    print(filename + ": len(L2CSNet) < len(MCGaze)")
-                elif len(L2CSNet) > len(MCGaze):
-                    print(filename + ": len(L2CSNet) > len(MCGaze)!!! This is unexpected!")
-                #
-                #
-                #
-                #
+if __name__ == '__main__':
 
+    args = parse_args()
 
-                
-                if len(extracted_features) < len(openface_frames_with_timestamps):
-                    print(possible_path + ": My file has LESS rows than MBP team's OpenFace file!!! How could this happen? Program will exit")
-                    exit()
-                elif len(extracted_features) > len(openface_frames_with_timestamps):
-                    #print(possible_path + ': My methods analyzed', len(extracted_features) - len(openface_frames_with_timestamps), "frames more than there are in the MBP team's OpenFace file!")
-                        
-                    # estimate the remaining timestamps
-                    mean_diff_prev_10_timestamps = (float(openface_frames_with_timestamps[-1]['timestamp in s']) - float(openface_frames_with_timestamps[-11]['timestamp in s'])) / 10.0
-                    
-                    for i in range(0, len(extracted_features) - len(openface_frames_with_timestamps)):
-                        extracted_features[len(openface_frames_with_timestamps) + i]['timestamp in s'] = str(round(
-                            float(openface_frames_with_timestamps[-1]['timestamp in s']) + float(i+1)*mean_diff_prev_10_timestamps,
-                            3
-                        ))
+    methods = ['L2CS-Net', 'MCGaze']
 
-                for i in range(0, len(openface_frames_with_timestamps)):
+    results = correct_timestamps_in_parallel(methods, args.count_workers)
 
-                    if int(openface_frames_with_timestamps[i]['frame']) != int(extracted_features[i]['frame']):
-                        print("Frames don't match!!! Program will exit")
-                        exit()
+    errors = [error for filename, error in results if error is not None]
 
-                    extracted_features[i]['timestamp in s'] = openface_frames_with_timestamps[i]['timestamp in s']
+    for error in errors:
+        print(error)
 
-                write_extracted_features_back_to_file(method, filename, extracted_features)
+    print(len(results) - len(errors), 'of', len(results), 'files corrected')
 
-            break
\ No newline at end of file
+    if len(errors) > 0:
+        exit(1)
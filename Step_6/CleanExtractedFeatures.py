@@ -1,8 +1,15 @@
 import os
 import csv
+import argparse
+import concurrent.futures
+import sys
 import numpy as np
 import math
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import GazeDataCache
+import Instrumentation
+
 
 def get_SIT_video_filenames():
     
@@ -22,23 +29,52 @@ def get_SIT_video_filenames():
 
     return filenames
 
+# The columns are loaded via GazeDataCache (see ../Common/GazeDataCache.py), so the file is only parsed
+# the first time it is read.
 def read_csv_file(path):
 
-    file_content = None
-
-    with open(path) as csv_file:
-        file_content = list(csv.DictReader(csv_file))
+    with Instrumentation.measure('Step 6: read file'):
+        gaze_data = GazeDataCache.read_gaze_data(path)
 
     # adjust types
-    for row in file_content:
-        row['frame'] = int(row['frame'])
-        row['timestamp in s'] = float(row['timestamp in s'])
-        row['success'] = int(row['success'])
-        row['yaw in radians'] = float(row['yaw in radians'])
-        row['pitch in radians'] = float(row['pitch in radians'])
+    columns = dict()
+    for column_name in gaze_data:
+        if column_name in ['frame', 'success']:
+            columns[column_name] = gaze_data[column_name].astype(np.int64).tolist()
+        else:
+            columns[column_name] = gaze_data[column_name].tolist()
+
+    file_content = [dict(zip(columns.keys(), row)) for row in zip(*columns.values())]
+
+    Instrumentation.count('rows read', len(file_content))
+    Instrumentation.count('bytes read', os.path.getsize(path))
 
     return file_content
 
+# Parameters of the outlier detection (used by is_outlier() as well as find_outliers()).
+# "neighbors" refers to the closest data points time-wise.
+count_neighbors = 3
+# 800 degrees per second according to:
+"""
+@inproceedings{
+    author = { Viktor Kelkkanen and Markus Fiedler and DavidLindero },
+    title = { Bitrate Requirements of Non-Panoramic VR Remote Rendering },
+    booktitle = { Proceedings of the 28th ACM International Conference on Multimedia },
+    year = { 2020 },
+    organization = { Association for Computing Machinery },
+    doi = { 10.1145/3394171.3413681 }
+}
+"""
+max_velocity_head_rotation = 800.0 / 180 * math.pi
+# Initially I calculated a maximum total velocity as sum of max. head rotation speed and max. saccade speed, but
+# I discarded that idea again. Somebody rotating head and eyes at maximum speed, perfectly synchronous
+# when they're supposed to talk to the SIT actress seems ridiculous (that would be up to 50 degrees per
+# frame at 30 FPS).
+# Since max. head rotation is faster than max. saccade speed I used only the head rotation speed.
+# The fact that for MCGaze only 69 outliers were found in approx. 900.000 gaze estimations shows that
+# the velcity is definitely not set too low when taking "only" max. head rotation velocity into account.
+#max_velocity_saccade = 700.0 / 180 * math.pi
+
 # "closest" refers to the timestamps! (NOT distance-wise)
 def find_closest_neighbors(non_NaN_feature_extraction_data, index, count_neighbors):
 
@@ -79,29 +115,6 @@ def find_closest_neighbors(non_NaN_feature_extraction_data, index, count_neighbo
 # The parameter "index" specifies which data point of non_NaN_feature_extraction_data shall be tested.
 def is_outlier(non_NaN_feature_extraction_data, index):
 
-    # "neighbors" refers to the closest data points time-wise.
-    count_neighbors = 3
-    # 800 degrees per second according to:
-    """
-    @inproceedings{
-        author = { Viktor Kelkkanen and Markus Fiedler and DavidLindero },
-        title = { Bitrate Requirements of Non-Panoramic VR Remote Rendering },
-        booktitle = { Proceedings of the 28th ACM International Conference on Multimedia },
-        year = { 2020 },
-        organization = { Association for Computing Machinery },
-        doi = { 10.1145/3394171.3413681 }
-    }
-    """
-    max_velocity_head_rotation = 800.0 / 180 * math.pi
-    # Initially I calculated a maximum total velocity as sum of max. head rotation speed and max. saccade speed, but
-    # I discarded that idea again. Somebody rotating head and eyes at maximum speed, perfectly synchronous
-    # when they're supposed to talk to the SIT actress seems ridiculous (that would be up to 50 degrees per
-    # frame at 30 FPS).
-    # Since max. head rotation is faster than max. saccade speed I used only the head rotation speed.
-    # The fact that for MCGaze only 69 outliers were found in approx. 900.000 gaze estimations shows that
-    # the velcity is definitely not set too low when taking "only" max. head rotation velocity into account.
-    #max_velocity_saccade = 700.0 / 180 * math.pi
-
     closest_neighbors = find_closest_neighbors(non_NaN_feature_extraction_data, index, count_neighbors)
 
     # Indicates how often the data point is further away (radian-wise) from the (time-wise) closest neighbors than possible given the
@@ -128,10 +141,109 @@ def is_outlier(non_NaN_feature_extraction_data, index):
     # The added epsilon is meant to prevent float precision issues.
     return outlier_fraction > 1.0 / count_neighbors + 0.00001
 
+# Vectorized version of is_outlier(): Tests all data points of non_NaN_feature_extraction_data at once.
+# Returns a numpy array of bools where element i is exactly what is_outlier(non_NaN_feature_extraction_data, i)
+# would return. is_outlier() is kept as reference implementation (clean_feature_extraction_data() can still use it).
+def find_outliers(non_NaN_feature_extraction_data):
+
+    # For files with less than 2*count_neighbors data points find_closest_neighbors() runs out of neighbor candidates
+    # (and raises an IndexError), so let the reference implementation handle these files to behave exactly the same way.
+    if len(non_NaN_feature_extraction_data) < 2*count_neighbors:
+        return np.array(
+            [is_outlier(non_NaN_feature_extraction_data, i) for i in range(len(non_NaN_feature_extraction_data))],
+            dtype=bool
+        )
+
+    timestamps = np.array([elem['timestamp in s'] for elem in non_NaN_feature_extraction_data], dtype=np.float64)
+    yaw = np.array([elem['yaw in radians'] for elem in non_NaN_feature_extraction_data], dtype=np.float64)
+    pitch = np.array([elem['pitch in radians'] for elem in non_NaN_feature_extraction_data], dtype=np.float64)
+
+    return find_outliers_in_arrays(timestamps, yaw, pitch)
+
+# Same as find_outliers(), but takes the timestamps, yaw and pitch angles of the non NaN data points as numpy arrays
+# (must contain at least 2*count_neighbors elements).
+def find_outliers_in_arrays(timestamps, yaw, pitch):
+
+    count_data_points = len(timestamps)
+
+    #
+    # First: Build the neighbor candidates for all data points at once (same order as find_closest_neighbors() does).
+    #
+
+    # Sliding window of width 2*count_neighbors around each data point. Column p of candidate_indices holds the p-th element
+    # that find_closest_neighbors() would append to neighbor_candidates.
+    indices = np.arange(count_data_points)[:, None]
+    positions = np.arange(2*count_neighbors)[None, :]
+    count_preceding = indices
+    count_succeeding = count_data_points - 1 - indices
+    # Number of loop iterations in find_closest_neighbors() that append a preceding as well as a succeeding data point.
+    count_pairs = np.minimum(np.minimum(count_preceding, count_succeeding), count_neighbors)
+
+    offsets = positions // 2 + 1
+    pair_indices = np.where(positions % 2 == 0, indices - offsets, indices + offsets)
+    # After the pairs only succeeding (if the first frames were reached) resp. only preceding (if the last frames
+    # were reached) data points are appended.
+    single_offsets = positions - count_pairs + 1
+    single_indices = np.where(count_preceding == count_pairs, indices + single_offsets, indices - single_offsets)
+
+    candidate_indices = np.where(positions < 2*count_pairs, pair_indices, single_indices)
+    is_candidate = positions < count_neighbors + count_pairs
+    candidate_indices = np.where(is_candidate, candidate_indices, indices)
+
+    #
+    # Second: Pick the count_neighbors closest (time-wise) candidates.
+    #
+
+    time_differences = np.abs(timestamps[:, None] - timestamps[candidate_indices])
+    time_differences[~is_candidate] = np.inf
+
+    # Stable sorting is important, because list.sort() in find_closest_neighbors() is stable as well (candidates with
+    # equal time difference are picked in the order they were appended).
+    closest_columns = np.argsort(time_differences, axis=1, kind='stable')[:, :count_neighbors]
+    closest_neighbors = np.take_along_axis(candidate_indices, closest_columns, axis=1)
+
+    #
+    # Third: Apply the velocity test to all data points and their closest neighbors.
+    #
+
+    outlier_thresholds = np.abs(timestamps[:, None] - timestamps[closest_neighbors]) * max_velocity_head_rotation
+    yaw_diffs = np.abs(yaw[:, None] - yaw[closest_neighbors])
+    pitch_diffs = np.abs(pitch[:, None] - pitch[closest_neighbors])
+    distances = np.sqrt(yaw_diffs*yaw_diffs + pitch_diffs*pitch_diffs)
+
+    exceeds_threshold = distances > outlier_thresholds
+
+    # np.linalg.norm() (used by is_outlier()) might round differently in the last bit. So whenever a distance is that
+    # close to its threshold, compute it exactly like is_outlier() does.
+    borderline = np.abs(distances - outlier_thresholds) <= 4*np.spacing(outlier_thresholds)
+    for i, j in zip(*np.nonzero(borderline)):
+        exceeds_threshold[i, j] = np.linalg.norm([yaw_diffs[i, j], pitch_diffs[i, j]]) > outlier_thresholds[i, j]
+
+    # Sum up in the same way as is_outlier() does to get bitwise identical fractions.
+    outlier_fractions = np.zeros(count_data_points)
+    for j in range(count_neighbors):
+        outlier_fractions += np.where(exceeds_threshold[:, j], 1.0 / count_neighbors, 0.0)
+
+    return outlier_fractions > 1.0 / count_neighbors + 0.00001
+
 # Return value is an empty list when the file to which
 # the parameter feature_extraction_data belongs must be excluded entirely
 # from further evaluation.
-def clean_feature_extraction_data(feature_extraction_data, filename):
+# Set use_reference_outlier_detection to True to test every data point with is_outlier() instead of find_outliers().
+def clean_feature_extraction_data(feature_extraction_data, filename, use_reference_outlier_detection=False):
+
+    cleaned_data, exclusion_reason = clean_and_check_feature_extraction_data(feature_extraction_data, use_reference_outlier_detection)
+
+    if exclusion_reason is not None:
+        print(filename, 'excluded (' + exclusion_reason + ')')
+        return []
+
+    return cleaned_data
+
+# Same as clean_feature_extraction_data(), but nothing gets printed. Returns the cleaned data together with the reason
+# why the file must be excluded entirely from further evaluation (None if the file is not to be excluded).
+# Note: For excluded files the returned cleaned data may be incomplete (see is_certainly_excluded()).
+def clean_and_check_feature_extraction_data(feature_extraction_data, use_reference_outlier_detection=False):
 
     #
     # First: Exclude NaN gaze angle data points.
@@ -146,18 +258,31 @@ def clean_feature_extraction_data(feature_extraction_data, filename):
 
         non_NaN_feature_extraction_data.append(elem)
 
+    Instrumentation.count('NaN rows dropped', len(feature_extraction_data) - len(non_NaN_feature_extraction_data))
+
+    # Shortcut for files that will be excluded anyway: Outliers are only removed up to the data point
+    # where the exclusion reason becomes evident.
+    if not use_reference_outlier_detection and is_certainly_excluded(non_NaN_feature_extraction_data):
+        return clean_and_check_until_excluded(non_NaN_feature_extraction_data)
+
     #
     # Second: Exclude outliers.
     #
 
     cleaned_data = []
 
+    with Instrumentation.measure('Step 6: outlier detection'):
+        if use_reference_outlier_detection:
+            outliers = [is_outlier(non_NaN_feature_extraction_data, i) for i in range(len(non_NaN_feature_extraction_data))]
+        else:
+            outliers = find_outliers(non_NaN_feature_extraction_data)
+
     for i in range(len(non_NaN_feature_extraction_data)):
 
-        if is_outlier(non_NaN_feature_extraction_data, i):
+        if outliers[i]:
             #print(
             #    'outlier with timestamp', non_NaN_feature_extraction_data[i]['timestamp in s'],
-            #    'inside non_NaN_feature_extraction_data was excluded for file', filename,
+            #    'inside non_NaN_feature_extraction_data was excluded',
             #    '(yaw =', non_NaN_feature_extraction_data[i]['yaw in radians'],
             #    'and pitch =', non_NaN_feature_extraction_data[i]['pitch in radians'], ')'
             #    )
@@ -165,14 +290,29 @@ def clean_feature_extraction_data(feature_extraction_data, filename):
 
         cleaned_data.append(non_NaN_feature_extraction_data[i])
 
+    Instrumentation.count('outliers removed', len(non_NaN_feature_extraction_data) - len(cleaned_data))
+
     #
     # Third: Find out if the video/file is to be excluded entirely.
     #
 
-    # If a method's gaze estimations are not valid for this long (in seconds) it will be
-    # considered a long nan angle sequence (the NaNs are not present in the cleaned data anymore, but the
-    # missing elements can cause huge time gaps).
-    consecutive_nan_angle_threshold = 0.25
+    return cleaned_data, determine_exclusion_reason(cleaned_data)
+
+# If a method's gaze estimations are not valid for this long (in seconds) it will be
+# considered a long nan angle sequence (the NaNs are not present in the cleaned data anymore, but the
+# missing elements can cause huge time gaps).
+consecutive_nan_angle_threshold = 0.25
+
+# Exclusion reason of files without a single data point left after cleaning (e.g. gaze estimation failed for all frames).
+no_valid_gaze_estimations = 'no valid gaze estimations'
+
+# Returns None if the file to which the parameter cleaned_data belongs can be used for further evaluation.
+# Otherwise the reason why the file must be excluded entirely is returned.
+def determine_exclusion_reason(cleaned_data):
+
+    if len(cleaned_data) == 0:
+        return no_valid_gaze_estimations
+
     # how often the consecutive nan angle threshold is exceeded
     count_long_nan_angle_sequences = 0
 
@@ -180,22 +320,54 @@ def clean_feature_extraction_data(feature_extraction_data, filename):
 
         if cleaned_data[i]['timestamp in s'] - cleaned_data[i-1]['timestamp in s'] > 2.0*consecutive_nan_angle_threshold:
 
-            print(filename, 'excluded (NaN angle sequence exceeded twice the threshold)')            
-            return []
+            return 'NaN angle sequence exceeded twice the threshold'
         elif cleaned_data[i]['timestamp in s'] - cleaned_data[i-1]['timestamp in s'] > consecutive_nan_angle_threshold:
             
             count_long_nan_angle_sequences += 1
             
             if count_long_nan_angle_sequences > 2:
-                print(filename, 'excluded (' + str(count_long_nan_angle_sequences) + ' times NaN angle threshold exceeded)')                
-                return []
+                return str(count_long_nan_angle_sequences) + ' times NaN angle threshold exceeded'
 
+    return None
 
-    return cleaned_data
-    
+# Pre-screen that is applied before the outliers are removed: Returns True if the file to which non_NaN_feature_extraction_data
+# belongs will certainly be excluded by determine_exclusion_reason(). Removing outliers only merges time gaps between the remaining
+# data points (and two merged gaps above the threshold are above twice the threshold), so if the time gaps between the non NaN
+# data points already meet an exclusion criterion, then so do the time gaps in the cleaned data.
+# False means that the file may or may not be excluded.
+def is_certainly_excluded(non_NaN_feature_extraction_data):
+
+    timestamps = np.array([elem['timestamp in s'] for elem in non_NaN_feature_extraction_data], dtype=np.float64)
+    time_gaps = np.diff(timestamps)
+
+    return bool(
+        np.any(time_gaps > 2.0*consecutive_nan_angle_threshold)
+        or np.count_nonzero(time_gaps > consecutive_nan_angle_threshold) > 2
+    )
+
+# Removes the outliers chunk by chunk (see remove_outliers_incrementally()) and stops as soon as the file turns out to be excluded,
+# which gives exactly the same exclusion reason as determine_exclusion_reason() applied to the completely cleaned data.
+# Returns the cleaned data (up to the point where the file turned out to be excluded) and the exclusion reason (None if the
+# file is not to be excluded after all, then the cleaned data is complete).
+def clean_and_check_until_excluded(non_NaN_feature_extraction_data, chunk_size=256):
+
+    cleaned_data = []
+
+    try:
+        for elem in check_exclusion_incrementally(remove_outliers_incrementally(iter(non_NaN_feature_extraction_data), chunk_size)):
+            cleaned_data.append(elem)
+    except FileExcludedError as e:
+        return cleaned_data, e.exclusion_reason
+
+    return cleaned_data, None
+
+# The data is written to a temporary file first which then replaces the file at path. So there is never a
+# half-written file at path (e.g. if the program gets interrupted).
 def write_cleaned_data_to_file(path, cleaned_data):
 
-    with open(path, 'w', newline='') as csv_file:
+    temporary_path = path + '.tmp'
+
+    with open(temporary_path, 'w', newline='') as csv_file:
         writer = csv.DictWriter(csv_file, fieldnames=cleaned_data[0].keys())
         
         writer.writeheader()
@@ -203,35 +375,391 @@ def write_cleaned_data_to_file(path, cleaned_data):
         for elem in cleaned_data:
             writer.writerow(elem)
 
+    Instrumentation.count('bytes written', os.path.getsize(temporary_path))
+
+    os.replace(temporary_path, path)
+
+
+#
+# Streaming mode:
+# The functions below do the same as clean_and_check_feature_extraction_data() followed by write_cleaned_data_to_file(),
+# but the rows are passed from one step to the next one by one (generators). Only a bounded number of rows is kept in
+# memory at any time, no matter how long the recording is, and the cleaned rows are written while the file is still being read.
+#
+
+# Raised by check_exclusion_incrementally() as soon as it is clear that the file must be excluded entirely.
+class FileExcludedError(Exception):
+    def __init__(self, exclusion_reason):
+        super().__init__(exclusion_reason)
+        self.exclusion_reason = exclusion_reason
+
+# Yields the rows of the .csv file one by one (types adjusted like read_csv_file() does).
+def read_csv_file_incrementally(path):
+
+    count_rows = 0
+
+    try:
+        with open(path) as csv_file:
+            for row in csv.DictReader(csv_file):
+                row['frame'] = int(row['frame'])
+                row['timestamp in s'] = float(row['timestamp in s'])
+                row['success'] = int(row['success'])
+                row['yaw in radians'] = float(row['yaw in radians'])
+                row['pitch in radians'] = float(row['pitch in radians'])
+                count_rows += 1
+                yield row
+    finally:
+        # Also if the file turned out to be excluded before it was read completely.
+        Instrumentation.count('rows read', count_rows)
+
+def remove_NaN_data_points_incrementally(rows):
+
+    count_NaN_rows = 0
+
+    try:
+        for row in rows:
+            if row['success'] != 0:
+                yield row
+            else:
+                count_NaN_rows += 1
+    finally:
+        Instrumentation.count('NaN rows dropped', count_NaN_rows)
+
+# Yields the non NaN data points that are no outliers. The data points are tested in chunks of chunk_size with find_outliers().
+# A data point only depends on its count_neighbors preceding and succeeding data points, so apart from the current chunk only
+# 2*count_neighbors preceding and count_neighbors succeeding data points need to be kept (that's 2*count_neighbors preceding ones,
+# so that there are always at least 2*count_neighbors data points to pass to find_outliers(), see there).
+# The results are exactly the same as when find_outliers() is applied to all data points at once.
+def remove_outliers_incrementally(non_NaN_rows, chunk_size=4096):
+
+    # find_outliers() needs at least 2*count_neighbors data points (except for files that are that short).
+    chunk_size = max(chunk_size, count_neighbors)
+
+    # buffer[0] is the data point with index buffer_start (counting all non NaN data points of the file).
+    buffer = []
+    buffer_start = 0
+    # Index of the first data point that has not been tested yet.
+    first_untested = 0
+
+    for row in non_NaN_rows:
+
+        buffer.append(row)
+
+        if buffer_start + len(buffer) - first_untested < chunk_size + count_neighbors:
+            continue
+
+        outliers = find_outliers(buffer)
+        Instrumentation.count('outliers removed', int(np.count_nonzero(outliers[first_untested - buffer_start:first_untested - buffer_start + chunk_size])))
+
+        for i in range(first_untested, first_untested + chunk_size):
+            if not outliers[i - buffer_start]:
+                yield buffer[i - buffer_start]
+
+        first_untested += chunk_size
+
+        # Drop the data points that are not needed anymore.
+        new_buffer_start = max(0, first_untested - 2*count_neighbors)
+        del buffer[:new_buffer_start - buffer_start]
+        buffer_start = new_buffer_start
+
+    # The last data points of the file.
+    outliers = find_outliers(buffer)
+    Instrumentation.count('outliers removed', int(np.count_nonzero(outliers[first_untested - buffer_start:])))
+
+    for i in range(first_untested, buffer_start + len(buffer)):
+        if not outliers[i - buffer_start]:
+            yield buffer[i - buffer_start]
+
+# Yields the cleaned rows and raises FileExcludedError as soon as determine_exclusion_reason() would return a reason.
+def check_exclusion_incrementally(cleaned_rows):
+
+    # how often the consecutive nan angle threshold is exceeded
+    count_long_nan_angle_sequences = 0
+    previous_timestamp = None
+
+    for row in cleaned_rows:
+
+        if previous_timestamp is not None:
 
+            if row['timestamp in s'] - previous_timestamp > 2.0*consecutive_nan_angle_threshold:
+
+                raise FileExcludedError('NaN angle sequence exceeded twice the threshold')
+            elif row['timestamp in s'] - previous_timestamp > consecutive_nan_angle_threshold:
+
+                count_long_nan_angle_sequences += 1
+
+                if count_long_nan_angle_sequences > 2:
+                    raise FileExcludedError(str(count_long_nan_angle_sequences) + ' times NaN angle threshold exceeded')
+
+        previous_timestamp = row['timestamp in s']
+
+        yield row
+
+# Streaming version of cleaning a file: reads the file at input_path and writes the cleaned data to output_path
+# (via a temporary file, which is deleted again if the file must be excluded).
+# Returns the reason why the file must be excluded entirely (None if the file is not to be excluded).
+def clean_file_incrementally(input_path, output_path):
+
+    temporary_path = output_path + '.tmp'
+
+    Instrumentation.count('bytes read', os.path.getsize(input_path))
+
+    cleaned_rows = check_exclusion_incrementally(
+        remove_outliers_incrementally(
+            remove_NaN_data_points_incrementally(
+                read_csv_file_incrementally(input_path)
+            )
+        )
+    )
+
+    try:
+        with open(temporary_path, 'w', newline='') as csv_file:
+
+            writer = None
+
+            for row in cleaned_rows:
+
+                if writer is None:
+                    writer = csv.DictWriter(csv_file, fieldnames=row.keys())
+                    writer.writeheader()
+
+                writer.writerow(row)
+
+    except FileExcludedError as e:
+        os.remove(temporary_path)
+        return e.exclusion_reason
+
+    # Not a single row left after cleaning (same as determine_exclusion_reason() for empty cleaned data).
+    if writer is None:
+        os.remove(temporary_path)
+        return no_valid_gaze_estimations
+
+    Instrumentation.count('bytes written', os.path.getsize(temporary_path))
+
+    os.replace(temporary_path, output_path)
+
+    return None
+
+# Path the cleaned data of a file is written to before reconcile_exclusions() decides whether it is kept (see publish_cleaned_files()).
+def get_staging_path(method, filename):
+
+    return 'CleanedFeatureExtractionData/' + method + '/' + filename + '.staged'
+
+# Cleans a single file and writes the cleaned data to ./CleanedFeatureExtractionData (unless the file is to be excluded).
+# The file is only staged (see get_staging_path()), publish_cleaned_files() moves it to its final place.
+# Returns (method, filename, exclusion reason), whereby exclusion reason is None if the file was not excluded.
+# If streaming is True the file is cleaned with clean_file_incrementally().
+def clean_file(method, filename, streaming=False):
+
+    with Instrumentation.measure('Step 6: clean file', method + '/' + filename):
+        return clean_file_without_instrumentation(method, filename, streaming)
+
+def clean_file_without_instrumentation(method, filename, streaming):
+
+    feature_extraction_data_path = '../Step_5/FeatureExtractionData'
+
+    # e.g. for ../Common/EnsembleGaze.py, which adds a new method
+    os.makedirs(os.path.dirname(get_staging_path(method, filename)), exist_ok=True)
+
+    if streaming:
+        exclusion_reason = clean_file_incrementally(
+            feature_extraction_data_path + '/' + method + '/' + filename,
+            get_staging_path(method, filename)
+        )
+
+        return method, filename, exclusion_reason
+
+    feature_extraction_data = read_csv_file(feature_extraction_data_path + '/' + method + '/' + filename)
+
+    cleaned_data, exclusion_reason = clean_and_check_feature_extraction_data(feature_extraction_data)
+
+    if exclusion_reason is None:
+        write_cleaned_data_to_file(get_staging_path(method, filename), cleaned_data)
+
+    return method, filename, exclusion_reason
+
+# Cleans all files of all methods, every file in its own task. The tasks are distributed among count_workers processes.
+# Returns the results of clean_file() for all files ordered by method and filename, hence the returned list is the same
+# regardless of count_workers.
+def clean_files_in_parallel(methods, filenames, count_workers, streaming=False):
+
+    tasks = [(method, filename) for method in methods for filename in sorted(filenames)]
+
+    return clean_tasks_in_parallel(tasks, count_workers, streaming)
+
+# Same as clean_files_in_parallel(), but for an arbitrary list of (method, filename) tasks. Returns the results in the order of tasks.
+def clean_tasks_in_parallel(tasks, count_workers, streaming=False):
+
+    if len(tasks) == 0:
+        return []
+
+    if count_workers == 1:
+        results = [clean_file(method, filename, streaming) for method, filename in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=count_workers) as executor:
+            results = list(executor.map(
+                clean_file,
+                [method for method, filename in tasks],
+                [filename for method, filename in tasks],
+                [streaming for task in tasks],
+                chunksize=max(1, len(tasks) // (4*count_workers))
+            ))
+
+    return results
+
+def print_exclusion_summary(results):
+
+    for method, filename, exclusion_reason in results:
+        if exclusion_reason is not None:
+            print(method + ':', filename, 'excluded (' + exclusion_reason + ')')
+
+    for method in dict.fromkeys(result[0] for result in results):
+        count_files = len([result for result in results if result[0] == method])
+        count_excluded_files = len([result for result in results if result[0] == method and result[2] is not None])
+        print(method + ':', count_excluded_files, 'of', count_files, 'files excluded')
+
+# Methods that are computed from the gaze estimations of the other methods (see ../Common/EnsembleGaze.py). Files excluded
+# for them are not excluded for the other methods (see reconcile_exclusions()).
+derived_methods = ['Ensemble']
+
+# Different files are excluded for different gaze estimation methods. But only if a file is excluded for all methods
+# can the t-test results for different methods be compared to each other. Hence, a file that is excluded for one method
+# gets excluded for all other methods as well.
+# Derived methods (see derived_methods) are left out of this: a file excluded for a derived method is only excluded for that
+# method, otherwise adding e.g. the ensemble would change which files are kept for the methods it was computed from. The other
+# way round a file excluded for one of the other methods is excluded for the derived methods as well.
+# Returns a dictionary with the excluded filenames as keys (sorted) and dictionaries as values which tell for every method the
+# file is excluded for why it was excluded (all methods, unless the file is only excluded for derived methods).
+def reconcile_exclusions(results):
+
+    methods = list(dict.fromkeys(result[0] for result in results))
+    exclusion_reasons_by_filename = dict()
+
+    for method, filename, exclusion_reason in results:
+        if exclusion_reason is not None:
+            exclusion_reasons_by_filename.setdefault(filename, dict())[method] = exclusion_reason
+
+    for filename in exclusion_reasons_by_filename:
+
+        excluding_methods = [method for method in exclusion_reasons_by_filename[filename] if method not in derived_methods]
+
+        if len(excluding_methods) == 0:
+            # only excluded for derived methods
+            excluded_methods = [method for method in methods if method in exclusion_reasons_by_filename[filename]]
+        else:
+            excluded_methods = methods
+
+        for method in excluded_methods:
+            if method not in exclusion_reasons_by_filename[filename]:
+                exclusion_reasons_by_filename[filename][method] = 'excluded for ' + ' and '.join(excluding_methods)
+
+        exclusion_reasons_by_filename[filename] = {method: exclusion_reasons_by_filename[filename][method] for method in excluded_methods}
+
+    return dict(sorted(exclusion_reasons_by_filename.items()))
+
+# Returns True if the file is excluded for the method (see reconcile_exclusions()).
+def is_excluded(exclusion_reasons_by_filename, method, filename):
+
+    return method in exclusion_reasons_by_filename.get(filename, dict())
+
+# Returns the filenames that are not excluded for the methods other than the derived ones (see reconcile_exclusions()),
+# in the order of filenames.
+def get_cleaned_filenames(filenames, exclusion_reasons_by_filename):
+
+    return [
+        filename for filename in filenames
+        if all(method in derived_methods for method in exclusion_reasons_by_filename.get(filename, dict()))
+    ]
+
+# Moves the staged files (see clean_file()) of all files that are not excluded to ./CleanedFeatureExtractionData
+# and deletes the other ones (as well as the files of earlier runs that are excluded now).
+def publish_cleaned_files(results, exclusion_reasons_by_filename):
+
+    for method, filename, exclusion_reason in results:
+
+        path = 'CleanedFeatureExtractionData/' + method + '/' + filename
+
+        if is_excluded(exclusion_reasons_by_filename, method, filename):
+            if exclusion_reason is None and os.path.isfile(get_staging_path(method, filename)):
+                os.remove(get_staging_path(method, filename))
+            if os.path.isfile(path):
+                os.remove(path)
+        # There is no staged file if the file from an earlier run is still up to date (see ../Common/PipelineRunner.py).
+        elif os.path.isfile(get_staging_path(method, filename)):
+            os.replace(get_staging_path(method, filename), path)
+
+# Writes one row (filename, method, exclusion reason) per excluded file and method.
+def write_exclusion_reasons_to_file(path, exclusion_reasons_by_filename):
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['filename', 'method', 'exclusion reason'])
+
+        for filename in exclusion_reasons_by_filename:
+            for method in exclusion_reasons_by_filename[filename]:
+                writer.writerow([filename, method, exclusion_reasons_by_filename[filename][method]])
+
+# Writes the names of the files that were cleaned for all methods (so Step 7 doesn't need to look for them). Files that are
+# only excluded for derived methods are listed as well (see get_cleaned_filenames()), ExclusionReasons.csv tells which.
+def write_cleaned_filenames_to_file(path, cleaned_filenames):
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['filename'])
+
+        for filename in cleaned_filenames:
+            writer.writerow([filename])
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Cleans the feature extraction data of all SIT videos')
+
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that clean files in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
+
+    parser.add_argument(
+        '--streaming',
+        dest='streaming',
+        help='clean every file with constant memory (see clean_file_incrementally())',
+        action='store_true'
+        )
+
+    return parser.parse_args()
+
+
+#
+# Note: Files that are excluded for one gaze estimation method are excluded for all other methods as well, except for files
+# that are only excluded for a derived method like the ensemble (see reconcile_exclusions()). Why a file was excluded can be looked up in
+# ./CleanedFeatureExtractionData/ExclusionReasons.csv, the files that were kept are listed in
+# ./CleanedFeatureExtractionData/CleanedFiles.csv.
 #
-# IMPORTANT NOTE:
-# As as be seen in the printed output, different files are excluded for different gaze estimation methods.
-# Hence, the files that were excluded for one method need to manually be deleted for other methods as well
-# (only then can the t-test results for different methods be compared to each other).
-# These files are located in the /CleanedFeatureExtractionData folder. Command to delete them:
-# $ rm XF969267_part_2.csv UV663516_part_2.csv VA087261_part_2.csv TZ662131_part_2.csv US366349_part_2.csv GP213121_part_2.csv pre-01-019_part_2.csv pre-01-002_part_2.csv pre-01-008_part_2.csv pre-91-047_part_2.csv SM271483_part_2.csv CU321485_part_2.csv pre-04-001_part_2.csv UG429428_part_2.csv ST268519_part_2.csv
 
 if __name__ == '__main__':
 
+    args = parse_args()
+
     methods = ['L2CS-Net', 'MCGaze']
     filenames = get_SIT_video_filenames()
 
-    for method in methods:
-        print('\n\nstarting with', method)
-        for filename in filenames:
-
-            feature_extraction_data_path = '../Step_5/FeatureExtractionData'
+    results = clean_files_in_parallel(methods, filenames, args.count_workers, args.streaming)
 
-            feature_extraction_data = read_csv_file(feature_extraction_data_path + '/' + method + '/' + filename)
+    print_exclusion_summary(results)
 
-            cleaned_data = clean_feature_extraction_data(feature_extraction_data, filename)
+    exclusion_reasons_by_filename = reconcile_exclusions(results)
+    publish_cleaned_files(results, exclusion_reasons_by_filename)
 
-            if cleaned_data == []:
-                # file must be excluded entirely from further evaluation
-                continue
+    write_exclusion_reasons_to_file('CleanedFeatureExtractionData/ExclusionReasons.csv', exclusion_reasons_by_filename)
+    write_cleaned_filenames_to_file(
+        'CleanedFeatureExtractionData/CleanedFiles.csv',
+        get_cleaned_filenames(sorted(filenames), exclusion_reasons_by_filename)
+    )
 
-            write_cleaned_data_to_file('CleanedFeatureExtractionData/' + method + '/' + filename, cleaned_data)
+    print(len(filenames) - len(get_cleaned_filenames(filenames, exclusion_reasons_by_filename)), 'of', len(filenames), 'files excluded for all methods')
 
 
 
@@ -241,8 +769,8 @@ if __name__ == '__main__':
 # Code ends here. The below is just something I used to test the is_outlier() function.
 #
 
-# When setting count_neighbors = 4 and varying max_velocity_head_rotation inside
-# the function is_outlier() between 0.99 and 1.01, then the below can be used to verify
+# When setting count_neighbors = 4 and varying max_velocity_head_rotation (both defined
+# above find_closest_neighbors()) between 0.99 and 1.01, then the below can be used to verify
 # that is_outlier() really works as intended.
 """
 test_data = [
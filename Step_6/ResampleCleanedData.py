@@ -0,0 +1,168 @@
+import os
+import csv
+import argparse
+import concurrent.futures
+import sys
+import numpy as np
+from CleanExtractedFeatures import consecutive_nan_angle_threshold
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import GazeDataCache
+
+
+#
+# Purpose of this script:
+# The SIT videos have variable frame rates (between 24.9 and 30 FPS), so the time between two gaze estimations differs
+# from frame to frame and from video to video. This script resamples the cleaned gaze angles of
+# ./CleanedFeatureExtractionData onto a uniform time grid (e.g. 60 Hz, timestamps k / rate for integer k) with linear
+# interpolation and writes them to ./ResampledFeatureExtractionData (same columns as the cleaned files).
+# Gaps that are longer than consecutive_nan_angle_threshold (see CleanExtractedFeatures.py) stay gaps: no grid points are
+# generated inside them (interpolating across them would invent gaze angles for up to half a second).
+#
+# The column "frame" of the resampled files contains k (the index of the grid point), "success" is always 1.
+#
+# Step 7 can use the resampled data via a gaze data store (see ../Common/GazeDataStore.py):
+# $ python ResampleCleanedData.py --rate 60
+# $ cd ../Common && python GazeDataStore.py --folder ../Step_6/ResampledFeatureExtractionData --store-folder ../Step_6/ResampledFeatureExtractionData/Store
+# $ cd ../Step_7 && python ApplyFeatureEngineering.py --store-folder ../Step_6/ResampledFeatureExtractionData/Store
+#
+
+
+# Returns the timestamps of the grid points together with the interpolated yaw and pitch angles.
+# Parameter rate is the number of grid points per second.
+def resample(timestamps, yaw, pitch, rate):
+
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+
+    if len(timestamps) == 0:
+        return np.array([], dtype=np.int64), np.array([]), np.array([]), np.array([])
+
+    if np.any(np.diff(timestamps) < 0):
+        raise ValueError('timestamps must be sorted')
+
+    grid_indices = np.arange(np.ceil(timestamps[0] * rate), np.floor(timestamps[-1] * rate) + 1).astype(np.int64)
+    grid_timestamps = grid_indices / rate
+
+    # The grid points that are rounded to lie slightly outside of the recording.
+    is_inside = (grid_timestamps >= timestamps[0]) & (grid_timestamps <= timestamps[-1])
+    grid_indices = grid_indices[is_inside]
+    grid_timestamps = grid_timestamps[is_inside]
+
+    # grid_timestamps[k] lies between timestamps[previous[k]] and timestamps[previous[k] + 1].
+    previous = np.searchsorted(timestamps, grid_timestamps, side='right') - 1
+    following = np.minimum(previous + 1, len(timestamps) - 1)
+
+    is_in_gap = (
+        (timestamps[following] - timestamps[previous] > consecutive_nan_angle_threshold)
+        & (grid_timestamps != timestamps[previous])
+    )
+
+    grid_indices = grid_indices[~is_in_gap]
+    grid_timestamps = grid_timestamps[~is_in_gap]
+
+    return (
+        grid_indices,
+        grid_timestamps,
+        np.interp(grid_timestamps, timestamps, yaw),
+        np.interp(grid_timestamps, timestamps, pitch)
+    )
+
+def write_resampled_data_to_file(path, grid_indices, grid_timestamps, yaw, pitch):
+
+    with open(path + '.tmp', 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['frame', 'timestamp in s', 'success', 'yaw in radians', 'pitch in radians'])
+
+        for row in zip(grid_indices.tolist(), grid_timestamps.tolist(), [1]*len(grid_indices), yaw.tolist(), pitch.tolist()):
+            writer.writerow(row)
+
+    os.replace(path + '.tmp', path)
+
+def resample_file(method, filename, rate):
+
+    gaze_data = GazeDataCache.read_gaze_data('CleanedFeatureExtractionData/' + method + '/' + filename)
+
+    resampled_data = resample(gaze_data['timestamp in s'], gaze_data['yaw in radians'], gaze_data['pitch in radians'], rate)
+
+    write_resampled_data_to_file('ResampledFeatureExtractionData/' + method + '/' + filename, *resampled_data)
+
+    return method, filename, len(resampled_data[0])
+
+# Returns the names of the cleaned files of the method (the ones listed in CleanedFeatureExtractionData/CleanedFiles.csv if
+# it exists). CleanedFiles.csv also lists the files that are only excluded for derived methods like the ensemble (see
+# reconcile_exclusions() of CleanExtractedFeatures.py), so the files ExclusionReasons.csv lists for the method are left out.
+def get_cleaned_filenames(method):
+
+    if os.path.isfile('CleanedFeatureExtractionData/CleanedFiles.csv'):
+
+        excluded_filenames = set()
+
+        if os.path.isfile('CleanedFeatureExtractionData/ExclusionReasons.csv'):
+            with open('CleanedFeatureExtractionData/ExclusionReasons.csv') as csv_file:
+                excluded_filenames = {row['filename'] for row in csv.DictReader(csv_file) if row['method'] == method}
+
+        with open('CleanedFeatureExtractionData/CleanedFiles.csv') as csv_file:
+            return sorted(row['filename'] for row in csv.DictReader(csv_file) if row['filename'] not in excluded_filenames)
+
+    return sorted(
+        filename for filename in os.listdir('CleanedFeatureExtractionData/' + method)
+        if os.path.splitext(filename)[1] == '.csv'
+    )
+
+def resample_files_in_parallel(methods, rate, count_workers):
+
+    tasks = [(method, filename) for method in methods for filename in get_cleaned_filenames(method)]
+
+    for method in methods:
+        os.makedirs('ResampledFeatureExtractionData/' + method, exist_ok=True)
+
+    if count_workers == 1:
+        return [resample_file(method, filename, rate) for method, filename in tasks]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=count_workers) as executor:
+        return list(executor.map(
+            resample_file,
+            [method for method, filename in tasks],
+            [filename for method, filename in tasks],
+            [rate for task in tasks],
+            chunksize=max(1, len(tasks) // (4*count_workers))
+        ))
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Resamples the cleaned gaze angles onto a uniform time grid')
+
+    parser.add_argument(
+        '--rate',
+        dest='rate',
+        help='grid points per second (default: 60)',
+        type=float,
+        default=60.0
+        )
+
+    parser.add_argument(
+        '--methods',
+        dest='methods',
+        nargs='+',
+        default=['L2CS-Net', 'MCGaze']
+        )
+
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that resample files in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    results = resample_files_in_parallel(args.methods, args.rate, args.count_workers)
+
+    for method in args.methods:
+        print(method + ':', len([result for result in results if result[0] == method]), 'files resampled')
@@ -1,11 +1,42 @@
 import csv
 import os
-from FeatureEngineering import EyeGazeFeatures
+import argparse
+import concurrent.futures
+import sys
+import numpy as np
+from FeatureEngineering import EyeGazeFeatures, BatchEyeGazeFeatures
 from pathlib import Path
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import GazeDataCache
+import GazeDataStore
+import CohortIndex
+import Instrumentation
 
+
+# Gaze data stores that were already opened by this process (see open_gaze_data_store()).
+gaze_data_stores = dict()
+
+
+# Returns filenames[method][condition], the list of the cleaned files (the first cleaned one of the parts 2, 3 and 4 of
+# every video) in the order of FilenameToConditionMap.csv. The files are looked up in the cohort index
+# (see ../Common/CohortIndex.py) instead of probing the file system.
 def get_SIT_video_filenames(methods):
 
+    return CohortIndex.load_cohort_index(methods).get_SIT_video_filenames(methods)
+
+# Opens the gaze data store of the method (see ../Common/GazeDataStore.py), every store only once per process.
+def open_gaze_data_store(store_folder, method):
+
+    if (store_folder, method) not in gaze_data_stores:
+        gaze_data_stores[(store_folder, method)] = GazeDataStore.GazeDataStore(store_folder, method)
+
+    return gaze_data_stores[(store_folder, method)]
+
+# Same as get_SIT_video_filenames(), but the filenames are looked up in the index of the gaze data stores
+# inside store_folder instead of probing the file system.
+def get_SIT_video_filenames_from_store(methods, store_folder):
+
     filenames = dict()
 
     for method in methods:
@@ -14,25 +45,55 @@ def get_SIT_video_filenames(methods):
             'NT': []
         }
 
-    with open('../Step_5/FeatureExtractionData/FilenameToConditionMap.csv') as csv_file:
-                    
-        file_content = list(csv.DictReader(csv_file))
+        video_ids_found = set()
 
-        for row in file_content:
+        # The recordings are ordered like the videos in FilenameToConditionMap.csv and by part, so the first
+        # recording with part 2, 3 or 4 is the one get_SIT_video_filenames() would find.
+        for recording in open_gaze_data_store(store_folder, method).get_recordings():
 
-            condition = 'ASC' if int(row['SITCondition.ASD']) == 1 else 'NT'
-            
-            for method in methods:
-                for filename_expansion in ['_part_2', '_part_3', '_part_4']:
-                    
-                    filename = row['id'] + filename_expansion + '.csv'
+            if recording['condition'] is None or recording['part'] not in [2, 3, 4] or recording['video id'] in video_ids_found:
+                continue
 
-                    if os.path.isfile('../Step_6/CleanedFeatureExtractionData/' + method + '/' + filename):
-                        filenames[method][condition].append(filename)
-                        break
+            video_ids_found.add(recording['video id'])
+            filenames[method][recording['condition']].append(recording['filename'])
 
     return filenames
 
+# Reads a single file from ../Step_6/CleanedFeatureExtractionData. Returns a dictionary with the keys 'frame', 'timestamp',
+# 'yaw' and 'pitch' where each value is a list that contains the corresponding column of the file.
+# The columns are loaded via GazeDataCache (see ../Common/GazeDataCache.py), so the file is only parsed the first time it is read.
+# If store_folder is specified the recording is read from the gaze data store of the method instead of the file.
+def read_cleaned_data(method, filename, store_folder=None):
+
+    gaze_data = read_cleaned_gaze_data(method, filename, store_folder)
+
+    cleaned_data = {
+        'frame': gaze_data['frame'].astype(np.int64).tolist(),
+        'timestamp': gaze_data['timestamp in s'].tolist(),
+        'yaw': gaze_data['yaw in radians'].tolist(),
+        'pitch': gaze_data['pitch in radians'].tolist()
+    }
+
+    return cleaned_data
+
+# Same as read_cleaned_data(), but returns the columns of the file as they are (numpy arrays, the keys are the column names).
+def read_cleaned_gaze_data(method, filename, store_folder=None):
+
+    with Instrumentation.measure('Step 7: read file'):
+        if store_folder is None:
+            gaze_data = GazeDataCache.read_gaze_data('../Step_6/CleanedFeatureExtractionData/' + method + '/' + filename)
+            Instrumentation.count('bytes read', os.path.getsize('../Step_6/CleanedFeatureExtractionData/' + method + '/' + filename))
+        else:
+            gaze_data = open_gaze_data_store(store_folder, method).read_recording_by_filename(filename)
+
+        Instrumentation.count('rows read', len(gaze_data['frame']))
+
+    if np.any(gaze_data['success'] == 0):
+        print('There are still frames in the cleaned data where gaze estimation failed! Program will exit.')
+        exit()
+
+    return gaze_data
+
 def get_extracted_features(methods):
 
     filenames = get_SIT_video_filenames(methods)
@@ -50,44 +111,136 @@ def get_extracted_features(methods):
     for method in methods:
         for condition in filenames[method]:
             for filename in filenames[method][condition]:
-                with open('../Step_6/CleanedFeatureExtractionData/' + method + '/' + filename) as csv_file:
-                    
-                    file_content = list(csv.DictReader(csv_file))
-
-                    extracted_features[method][condition][filename] = {
-                        'frame': [],
-                        'timestamp': [],
-                        'yaw': [],
-                        'pitch': []
-                    }
-
-                    for row in file_content:
-
-                        if int(row['success']) == 0:
-                            print('There are still frames in the cleaned data where gaze estimation failed! Program will exit.')
-                            exit()
-
-                        extracted_features[method][condition][filename]['frame'].append(
-                            int(row['frame'])
-                        )
-                            
-                        extracted_features[method][condition][filename]['timestamp'].append(
-                            float(row['timestamp in s'])
-                        )
-
-                        extracted_features[method][condition][filename]['yaw'].append(
-                            float(row['yaw in radians'])
-                        )
-
-                        extracted_features[method][condition][filename]['pitch'].append(
-                            float(row['pitch in radians'])
-                        )
-                    
+                extracted_features[method][condition][filename] = read_cleaned_data(method, filename)
                         
     return extracted_features
 
+# Reads a single file, computes its gaze features and returns only these (not the data read from the file).
+def engineer_features_of_file(method, filename, store_folder=None):
+
+    with Instrumentation.measure('Step 7: engineer features', method + '/' + filename):
+        return engineer_features_of_file_without_instrumentation(method, filename, store_folder)
+
+def engineer_features_of_file_without_instrumentation(method, filename, store_folder):
+
+    features_from_file = read_cleaned_data(method, filename, store_folder)
+
+
+    #
+    # BEGIN: test if timestamps are correct now
+    #
+
+    #fps_reported_by_opencv = 1.0 / ( features_from_file['timestamp'][1] / (features_from_file['frame'][1]-1) )
+    #if not (24.9 < fps_reported_by_opencv < 31):
+    #    print(filename + ": opencv reports approx.", fps_reported_by_opencv, "FPS")
+
+    #
+    # END: test if timestamps are correct now
+    #
+
+
+    gaze_features = EyeGazeFeatures(
+        features_from_file['yaw'],
+        features_from_file['pitch'],
+        features_from_file['timestamp'],
+        method
+    ).run()
+
+    return {'video': Path(filename).stem, **gaze_features}
+
+# Computes the gaze features of all files, every file in its own task. The tasks are distributed among count_workers
+# processes, so at most count_workers recordings are in memory at the same time.
+# Returns the same dictionary structure as engineered_features in the __main__ block used to have:
+# engineered_features[method][condition] is the list of feature dictionaries (one per video) in the order of
+# get_SIT_video_filenames(), regardless of count_workers.
+# If store_folder is specified the recordings are read from the gaze data stores inside this folder.
+def engineer_features_in_parallel(methods, count_workers, store_folder=None):
+
+    if store_folder is None:
+        filenames = get_SIT_video_filenames(methods)
+    else:
+        filenames = get_SIT_video_filenames_from_store(methods, store_folder)
+
+    tasks = [
+        (method, condition, filename)
+        for method in methods
+        for condition in filenames[method]
+        for filename in filenames[method][condition]
+    ]
+
+    results = engineer_features_of_tasks_in_parallel(tasks, count_workers, store_folder)
+
+    engineered_features = dict()
+
+    for method in methods:
+        engineered_features[method] = dict()
+        for condition in filenames[method]:
+            engineered_features[method][condition] = []
+
+    for (method, condition, filename), gaze_features in zip(tasks, results):
+        engineered_features[method][condition].append(gaze_features)
+
+    return engineered_features
+
+# Computes the gaze features for an arbitrary list of (method, condition, filename) tasks.
+# Returns the results of engineer_features_of_file() in the order of tasks.
+def engineer_features_of_tasks_in_parallel(tasks, count_workers, store_folder=None):
+
+    if len(tasks) == 0:
+        return []
+
+    if count_workers == 1:
+        return [engineer_features_of_file(method, filename, store_folder) for method, condition, filename in tasks]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=count_workers) as executor:
+        return list(executor.map(
+            engineer_features_of_file,
+            [method for method, condition, filename in tasks],
+            [filename for method, condition, filename in tasks],
+            [store_folder for task in tasks]
+        ))
+
+# Same as engineer_features_in_parallel(), but the features of all files of a method are computed at once with
+# BatchEyeGazeFeatures (the values might differ from the ones of EyeGazeFeatures in the last bits).
+def engineer_features_in_batch(methods, store_folder=None):
+
+    if store_folder is None:
+        filenames = get_SIT_video_filenames(methods)
+    else:
+        filenames = get_SIT_video_filenames_from_store(methods, store_folder)
+
+    engineered_features = dict()
+
+    for method in methods:
+
+        engineered_features[method] = dict()
+
+        filenames_of_method = [filename for condition in filenames[method] for filename in filenames[method][condition]]
+        gaze_data_of_files = [read_cleaned_gaze_data(method, filename, store_folder) for filename in filenames_of_method]
+        offsets = np.cumsum([0] + [len(gaze_data['timestamp in s']) for gaze_data in gaze_data_of_files])
+
+        features = BatchEyeGazeFeatures(
+            np.concatenate([gaze_data['yaw in radians'] for gaze_data in gaze_data_of_files]),
+            np.concatenate([gaze_data['pitch in radians'] for gaze_data in gaze_data_of_files]),
+            np.concatenate([gaze_data['timestamp in s'] for gaze_data in gaze_data_of_files]),
+            offsets,
+            method
+        ).run()
+
+        features_by_filename = {
+            filename: {'video': Path(filename).stem, **dict(zip(BatchEyeGazeFeatures.feature_names, features[i].tolist()))}
+            for i, filename in enumerate(filenames_of_method)
+        }
+
+        for condition in filenames[method]:
+            engineered_features[method][condition] = [features_by_filename[filename] for filename in filenames[method][condition]]
+
+    return engineered_features
+
 def write_features_to_file(features, method, condition):
 
+    os.makedirs('FeatureEngineeringData/' + method, exist_ok=True)
+
     with open('FeatureEngineeringData/' + method + '/' + condition + '.csv', 'w', newline='') as csv_file:
         writer = csv.DictWriter(csv_file, fieldnames=features[0].keys())
         
@@ -98,56 +251,51 @@ def write_features_to_file(features, method, condition):
 
 
 
-if __name__ == '__main__':
+def parse_args():
 
-    methods = ['L2CS-Net', 'MCGaze']
-    extracted_features = get_extracted_features(methods)
+    parser = argparse.ArgumentParser(description='Computes the gaze features of all cleaned SIT video files')
 
-    print('count L2CS-Net files:', len(extracted_features['L2CS-Net']['ASC']) + len(extracted_features['L2CS-Net']['NT']))
-    print('count MCGaze files:', len(extracted_features['MCGaze']['ASC']) + len(extracted_features['MCGaze']['NT']))
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that compute features in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
 
-    engineered_features = {
-        'L2CS-Net': {
-            'ASC': [],
-            'NT': []
-        },
-        'MCGaze': {
-            'ASC': [],
-            'NT': []
-        }
-    }
+    parser.add_argument(
+        '--store-folder',
+        dest='store_folder',
+        help='read the cleaned data from the gaze data stores in this folder (see ../Common/GazeDataStore.py)',
+        type=str,
+        default=None
+        )
+
+    parser.add_argument(
+        '--batch',
+        dest='batch',
+        help='compute the features of all files of a method at once (see BatchEyeGazeFeatures)',
+        action='store_true'
+        )
 
-    for method in extracted_features:
-        for condition in extracted_features[method]:
-            for filename in extracted_features[method][condition]:
+    return parser.parse_args()
 
-                features_from_file = extracted_features[method][condition][filename]
 
 
-                #
-                # BEGIN: test if timestamps are correct now
-                #
+if __name__ == '__main__':
+
+    args = parse_args()
 
-                #fps_reported_by_opencv = 1.0 / ( features_from_file['timestamp'][1] / (features_from_file['frame'][1]-1) )
-                #if not (24.9 < fps_reported_by_opencv < 31):
-                #    print(filename + ": opencv reports approx.", fps_reported_by_opencv, "FPS")
+    methods = ['L2CS-Net', 'MCGaze']
 
-                #
-                # END: test if timestamps are correct now
-                #
-                    
-                    
-                gaze_features = EyeGazeFeatures(
-                    features_from_file['yaw'],
-                    features_from_file['pitch'],
-                    features_from_file['timestamp'],
-                    method
-                ).run()
-                
-                engineered_features[method][condition].append({'video': Path(filename).stem, **gaze_features.copy()})
+    if args.batch:
+        engineered_features = engineer_features_in_batch(methods, args.store_folder)
+    else:
+        engineered_features = engineer_features_in_parallel(methods, args.count_workers, args.store_folder)
 
-                #print('features_from_file:', features_from_file)
-                #print('engineered_features:', engineered_features)
+    print('count L2CS-Net files:', len(engineered_features['L2CS-Net']['ASC']) + len(engineered_features['L2CS-Net']['NT']))
+    print('count MCGaze files:', len(engineered_features['MCGaze']['ASC']) + len(engineered_features['MCGaze']['NT']))
 
+    for method in engineered_features:
+        for condition in engineered_features[method]:
             write_features_to_file(engineered_features[method][condition], method, condition)
-
@@ -20,22 +20,41 @@
 
 import numpy as np
 import math
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import Instrumentation
 
 
 # IMPORTANT:
 # __init__() parameters "gaze_angle_x" resp. "gaze_angle_y" must not contain nan values!
 # When you remove nan value from the above mentioned parameters don't forget to remove the
 # corresonding timestamp from parameter "timestamps" as well!
+#
+# Parameter "thresholds" (optional) is a dictionary with the keys 'yaw' and 'pitch' and overrides the fixation thresholds
+# of the gaze estimation method (see threshold_by_method).
 class EyeGazeFeatures:
-    def __init__(self, gaze_angle_x, gaze_angle_y, timestamps, gaze_estimation_method):
+    def __init__(self, gaze_angle_x, gaze_angle_y, timestamps, gaze_estimation_method, thresholds=None):
         self._gaze_angle_x = gaze_angle_x
         self._gaze_angle_y = gaze_angle_y
         self._timestamps = timestamps
         self._method = gaze_estimation_method
+        self._thresholds = threshold_by_method[gaze_estimation_method] if thresholds is None else thresholds
 
         self._features = {}
 
     def run(self):
+
+        return self.run_sweep([self._thresholds])[0]
+
+    # Computes the features for every element of thresholds_grid (a list of dictionaries with the keys 'yaw' and 'pitch').
+    # Returns a list with one feature dictionary per element of thresholds_grid. Everything that does not depend on the
+    # fixation thresholds (mean and std of the gaze angles, velocities and accelerations between all consecutive frames)
+    # is computed only once.
+    def run_sweep(self, thresholds_grid):
+        self._features = {}
+
         self._add_to_features('angle_x', self._gaze_angle_x)
         # y gaze angle was excluded with the reasoning that men are taller on average than women. However, the y angle might
         # be important in the context of ASC: If people with ASC avoid looking into the eyes then they need to look elsewhere.
@@ -44,20 +63,48 @@ class EyeGazeFeatures:
         # measures against height bias) did not find such an effect.
         self._add_to_features('angle_y', self._gaze_angle_y)
 
+        features_independent_of_thresholds = self._features
 
-        is_fixation = determine_fixations(
+
+        fixation_and_saccade_velocities, fixation_and_saccade_accelerations = compute_fixation_and_saccade_velocity_acceleration(
             self._gaze_angle_x,
             self._gaze_angle_y,
-            self._timestamps,
-            self._method
+            self._timestamps
         )
 
 
-        fixation_durations, fixation_duration_corr_with_pitch, fixation_duration_corr_with_yaw = compute_fixation_durations(
+        features_by_thresholds = []
+
+        for thresholds in thresholds_grid:
+            self._features = dict(features_independent_of_thresholds)
+            self._add_to_features_for_thresholds(thresholds, fixation_and_saccade_velocities, fixation_and_saccade_accelerations)
+            features_by_thresholds.append(self._features)
+
+        return features_by_thresholds
+
+    def _add_to_features_for_thresholds(self, thresholds, fixation_and_saccade_velocities, fixation_and_saccade_accelerations):
+
+        with Instrumentation.measure('Step 7: fixation detection'):
+            is_fixation = determine_fixations_with_running_means(
+                self._gaze_angle_x,
+                self._gaze_angle_y,
+                self._timestamps,
+                self._method,
+                thresholds
+            )
+
+
+        segments = determine_segments(is_fixation)
+
+        Instrumentation.count('fixations found', len(segments['fixation starts']))
+        Instrumentation.count('saccades found', len(segments['saccade starts']))
+
+
+        fixation_durations, fixation_duration_corr_with_pitch, fixation_duration_corr_with_yaw = compute_fixation_durations_from_segments(
             self._gaze_angle_x,
             self._gaze_angle_y,
             self._timestamps,
-            is_fixation
+            segments
         )
 
         self._add_to_features('fixation_duration', fixation_durations)
@@ -65,29 +112,26 @@ class EyeGazeFeatures:
         self._add_to_features('fixation_duration_with_yaw', fixation_duration_corr_with_yaw)
 
 
-        saccade_durations, saccade_amplitudes = compute_saccades(
+        saccade_durations, saccade_amplitudes = compute_saccades_from_segments(
             self._gaze_angle_x,
             self._gaze_angle_y,
-            self._timestamps, is_fixation
+            self._timestamps,
+            segments
         )
 
         self._add_to_features('saccade_duration', saccade_durations)
         self._add_to_features('saccade_amplitude', saccade_amplitudes)
 
 
-        velocities, accelerations = compute_velocity_acceleration(
-            self._gaze_angle_x,
-            self._gaze_angle_y,
-            self._timestamps,
+        velocities, accelerations = select_saccade_velocity_acceleration(
+            fixation_and_saccade_velocities,
+            fixation_and_saccade_accelerations,
             is_fixation
         )
 
         self._add_to_features('velocity', velocities)
         self._add_to_features('acceleration', accelerations)
 
-
-        return self._features
-
     def _add_to_features(self, name, values):
 
         if isinstance(values, list):
@@ -100,38 +144,542 @@ class EyeGazeFeatures:
             self._features[f'gaze_corr_{name}'] = 0.0 if np.isnan(values) else values
 
 
-def determine_fixations(gaze_angle_x, gaze_angle_y, timestamps, method):
+# Computes the same features as EyeGazeFeatures, but for many recordings at once and without building a dictionary per recording.
+# The gaze angles and timestamps of all recordings are passed as one concatenated array each, recording i covers the
+# elements offsets[i] up to (excluding) offsets[i+1] (e.g. GazeDataStore.get_all_columns() and GazeDataStore.offsets, see
+# ../Common/GazeDataStore.py). run() returns a 2-dimensional array with one row per recording and one column per feature
+# (see BatchEyeGazeFeatures.feature_names, same order as the dictionary returned by EyeGazeFeatures.run()).
+# Only the fixation detection loops over the recordings (every frame depends on the previous ones), everything else is
+# computed for all recordings at once with grouped sums. Since these sums are not computed pairwise like np.mean() does,
+# the values might differ from the ones of EyeGazeFeatures in the last bits.
+class BatchEyeGazeFeatures:
 
-    # is_fixation[i] will be True if the eyes do not move from timestamp[i] to timestamp[i+1], otherwise is_fixation[i] will be False.
-    is_fixation = [True for i in range(0, len(timestamps) - 1)]
+    feature_names = [
+        'gaze_mean_angle_x', 'gaze_std_angle_x',
+        'gaze_mean_angle_y', 'gaze_std_angle_y',
+        'gaze_mean_fixation_duration', 'gaze_std_fixation_duration',
+        'gaze_corr_fixation_duration_with_pitch', 'gaze_corr_fixation_duration_with_yaw',
+        'gaze_mean_saccade_duration', 'gaze_std_saccade_duration',
+        'gaze_mean_saccade_amplitude', 'gaze_std_saccade_amplitude',
+        'gaze_mean_velocity', 'gaze_std_velocity',
+        'gaze_mean_acceleration', 'gaze_std_acceleration'
+    ]
+
+    def __init__(self, gaze_angle_x, gaze_angle_y, timestamps, offsets, gaze_estimation_method, thresholds=None):
+        self._gaze_angle_x = np.asarray(gaze_angle_x, dtype=np.float64)
+        self._gaze_angle_y = np.asarray(gaze_angle_y, dtype=np.float64)
+        self._timestamps = np.asarray(timestamps, dtype=np.float64)
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self._method = gaze_estimation_method
+        self._thresholds = threshold_by_method[gaze_estimation_method] if thresholds is None else thresholds
+
+        self._count_recordings = len(self._offsets) - 1
+        # recording_of_frame[j] is the index of the recording that frame j belongs to
+        self._recording_of_frame = np.repeat(np.arange(self._count_recordings), np.diff(self._offsets))
+
+        self._features = np.zeros((self._count_recordings, len(self.feature_names)))
+
+    def run(self):
+
+        x = self._gaze_angle_x
+        y = self._gaze_angle_y
+        t = self._timestamps
+
+        self._add_to_features('angle_x', *self._group_by_recording(x, np.arange(len(x))))
+        self._add_to_features('angle_y', *self._group_by_recording(y, np.arange(len(y))))
+
+
+        # Frame pair j (from frame j to frame j+1) is only valid if both frames belong to the same recording.
+        is_valid_pair = np.zeros(max(len(t) - 1, 0), dtype=bool)
+        is_fixation = np.zeros(max(len(t) - 1, 0), dtype=bool)
+
+        for i in range(self._count_recordings):
+
+            first_frame = self._offsets[i]
+            last_frame = self._offsets[i+1] - 1
+
+            if last_frame <= first_frame:
+                continue
+
+            is_valid_pair[first_frame:last_frame] = True
+            is_fixation[first_frame:last_frame] = determine_fixations_with_running_means(
+                x[first_frame:last_frame + 1],
+                y[first_frame:last_frame + 1],
+                t[first_frame:last_frame + 1],
+                self._method,
+                self._thresholds
+            )
+
+
+        segments = self._determine_segments(is_valid_pair, is_fixation)
+
+        starts = segments['fixation starts']
+        ends = segments['fixation ends']
+        fixation_durations = t[ends] - t[starts]
+        mean_pitch_angle_during_fixations = sum_over_segments(y, starts, ends) / (ends - starts + 1)
+        mean_yaw_angle_during_fixations = sum_over_segments(x, starts, ends) / (ends - starts + 1)
+
+        self._add_to_features('fixation_duration', *self._group_by_recording(fixation_durations, starts))
+        self._add_to_features('fixation_duration_with_pitch', self._correlate_by_recording(fixation_durations, mean_pitch_angle_during_fixations, starts))
+        self._add_to_features('fixation_duration_with_yaw', self._correlate_by_recording(fixation_durations, mean_yaw_angle_during_fixations, starts))
+
+
+        starts = segments['saccade starts']
+        ends = segments['saccade ends']
+        dx = x[ends] - x[starts]
+        dy = y[ends] - y[starts]
+
+        self._add_to_features('saccade_duration', *self._group_by_recording(t[ends] - t[starts], starts))
+        self._add_to_features('saccade_amplitude', *self._group_by_recording(np.sqrt(dx*dx + dy*dy), starts))
+
+
+        # The velocities and accelerations of invalid frame pairs are computed as well, but never used.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fixation_and_saccade_velocities, fixation_and_saccade_accelerations = compute_fixation_and_saccade_velocity_acceleration(x, y, t)
+
+        is_saccade = is_valid_pair & ~is_fixation
+        # Frame triple j (from frame j to frame j+2) belongs to an acceleration during saccade.
+        is_saccade_triple = is_saccade[:-1] & is_saccade[1:]
+
+        self._add_to_features('velocity', *self._group_by_recording(fixation_and_saccade_velocities[is_saccade], np.flatnonzero(is_saccade)))
+        self._add_to_features('acceleration', *self._group_by_recording(fixation_and_saccade_accelerations[is_saccade_triple], np.flatnonzero(is_saccade_triple)))
+
+
+        return self._features
+
+    # Same as determine_segments() applied to every recording, but for all recordings at once. The indices refer to the frames of
+    # all recordings (so the fixation with index k starts at self._timestamps[segments['fixation starts'][k]]).
+    def _determine_segments(self, is_valid_pair, is_fixation):
+
+        pairs = np.flatnonzero(is_valid_pair)
+
+        # A segment starts at the first pair of a recording or where a fixation turns into a saccade or vice versa.
+        is_start = np.ones(len(pairs), dtype=bool)
+        is_start[1:] = (pairs[1:] != pairs[:-1] + 1) | (is_fixation[pairs[1:]] != is_fixation[pairs[:-1]])
 
-    # Refer to Method Validation or Feature Engineering section of my thesis to find out where these values come from.
-    threshold_by_method = {
-        'L2CS-Net': {
-            ### mean + 3*sd = (1.827, 2.363)
-            ### mean + 4*sd = (2.276, 2.927)
-            ### mean + 5*sd = (2.725, 3.492)
-            ### mean + 6*sd = (3.173, 4.056)
-            # ---> mean + 7*sd = (3.622, 4.621)
-            ### mean + 8*sd = (4.07, 5.186)
-            ### mean + 9*sd = (4.519, 5.75)
-            ### mean + 10*sd = (4.968, 6.315)
-            'yaw': np.radians(3.622),
-            'pitch': np.radians(4.621)
-        },
-        'MCGaze': {
-            ### mean + 3*sd = (2.615, 3.305)
-            # ---> mean + 4*sd = (3.21, 4.147)
-            ### mean + 5*sd = (3.804, 4.989)
-            ### mean + 6*sd = (4.399, 5.832)
-            ### mean + 7*sd = (4.993, 6.674)
-            ### mean + 8*sd = (5.587, 7.516)
-            ### mean + 9*sd = (6.182, 8.359)
-            ### mean + 10*sd = (6.776, 9.201)
-            'yaw': np.radians(3.21),
-            'pitch': np.radians(4.147)
+        start_positions = np.flatnonzero(is_start)
+        end_positions = np.append(start_positions[1:], len(pairs)) - 1
+
+        starts = pairs[start_positions]
+        ends = pairs[end_positions] + 1
+
+        # Just like determine_segments() a segment that only covers the last pair of a recording is not included.
+        is_last_pair = np.ones(len(pairs), dtype=bool)
+        is_last_pair[:-1] = pairs[1:] != pairs[:-1] + 1
+        is_included = ~is_last_pair[start_positions]
+
+        starts = starts[is_included]
+        ends = ends[is_included]
+        is_fixation_segment = is_fixation[starts]
+
+        return {
+            'fixation starts': starts[is_fixation_segment],
+            'fixation ends': ends[is_fixation_segment],
+            'saccade starts': starts[~is_fixation_segment],
+            'saccade ends': ends[~is_fixation_segment]
         }
+
+    # values[k] belongs to the recording of frame frames[k]. Returns the mean and standard deviation (np.std()) of the values
+    # of every recording (NaN for recordings without values).
+    def _group_by_recording(self, values, frames):
+
+        recordings = self._recording_of_frame[frames]
+        counts = np.bincount(recordings, minlength=self._count_recordings)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.bincount(recordings, weights=values, minlength=self._count_recordings) / counts
+            deviations = values - means[recordings]
+            stds = np.sqrt(np.bincount(recordings, weights=deviations*deviations, minlength=self._count_recordings) / counts)
+
+        return means, stds
+
+    # Returns the correlation (np.corrcoef()) of values_a and values_b for every recording (NaN if not defined).
+    def _correlate_by_recording(self, values_a, values_b, frames):
+
+        recordings = self._recording_of_frame[frames]
+        means_a = self._group_by_recording(values_a, frames)[0]
+        means_b = self._group_by_recording(values_b, frames)[0]
+
+        deviations_a = values_a - means_a[recordings]
+        deviations_b = values_b - means_b[recordings]
+
+        covariances = np.bincount(recordings, weights=deviations_a*deviations_b, minlength=self._count_recordings)
+        variances_a = np.bincount(recordings, weights=deviations_a*deviations_a, minlength=self._count_recordings)
+        variances_b = np.bincount(recordings, weights=deviations_b*deviations_b, minlength=self._count_recordings)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlations = covariances / np.sqrt(variances_a * variances_b)
+
+        # np.corrcoef() clips the correlations as well.
+        return np.clip(correlations, -1.0, 1.0)
+
+    # Same as EyeGazeFeatures._add_to_features(), but for all recordings at once.
+    def _add_to_features(self, name, *values):
+
+        if len(values) == 2:
+            means, stds = values
+            self._features[:, self.feature_names.index(f'gaze_mean_{name}')] = np.where(np.isnan(means), 0.0, means)
+            self._features[:, self.feature_names.index(f'gaze_std_{name}')] = np.where(np.isnan(stds), 0.0, stds)
+        else:
+            # This case is needed for correlations.
+            self._features[:, self.feature_names.index(f'gaze_corr_{name}')] = np.where(np.isnan(values[0]), 0.0, values[0])
+
+
+# Running mean and standard deviation (Welford's algorithm) of the values passed to add() one by one.
+# std() is the population standard deviation like np.std(). Both are nan as long as there are no values.
+# Infinite and nan values are handled like np.mean() and np.std() do: the mean becomes inf resp. nan, the std nan.
+class RunningMeanAndStd:
+    def __init__(self):
+        self.count = 0
+        self._mean = 0.0
+        self._sum_of_squared_deviations = 0.0
+
+    def add(self, value):
+        self.count += 1
+
+        if not (math.isfinite(value) and math.isfinite(self._mean)):
+            self._mean += value
+            self._sum_of_squared_deviations = np.nan
+            return
+
+        deviation = value - self._mean
+        self._mean += deviation / self.count
+        self._sum_of_squared_deviations += deviation * (value - self._mean)
+
+    def mean(self):
+        return self._mean if self.count > 0 else np.nan
+
+    def std(self):
+        return math.sqrt(self._sum_of_squared_deviations / self.count) if self.count > 0 else np.nan
+
+    def copy(self):
+        running_statistics = RunningMeanAndStd()
+        running_statistics.count = self.count
+        running_statistics._mean = self._mean
+        running_statistics._sum_of_squared_deviations = self._sum_of_squared_deviations
+        return running_statistics
+
+
+# Running Pearson correlation of the pairs (a, b) passed to add() one by one (Welford's algorithm for the co-moment).
+# correlation() is nan if there are less than 2 pairs or if a or b doesn't vary, just like np.corrcoef().
+class RunningCorrelation:
+    def __init__(self):
+        self.count = 0
+        self._mean_a = 0.0
+        self._mean_b = 0.0
+        self._sum_of_squared_deviations_a = 0.0
+        self._sum_of_squared_deviations_b = 0.0
+        self._sum_of_products_of_deviations = 0.0
+
+    def add(self, a, b):
+        self.count += 1
+        deviation_a = a - self._mean_a
+        deviation_b = b - self._mean_b
+        self._mean_a += deviation_a / self.count
+        self._mean_b += deviation_b / self.count
+        self._sum_of_squared_deviations_a += deviation_a * (a - self._mean_a)
+        self._sum_of_squared_deviations_b += deviation_b * (b - self._mean_b)
+        self._sum_of_products_of_deviations += deviation_a * (b - self._mean_b)
+
+    def correlation(self):
+        denominator = math.sqrt(self._sum_of_squared_deviations_a * self._sum_of_squared_deviations_b)
+        if self.count < 2 or denominator == 0.0:
+            return np.nan
+        # np.corrcoef() clips the correlations as well.
+        return min(1.0, max(-1.0, self._sum_of_products_of_deviations / denominator))
+
+    def copy(self):
+        running_correlation = RunningCorrelation()
+        running_correlation.__dict__.update(self.__dict__)
+        return running_correlation
+
+
+# Returns numerator / denominator like numpy divides floats: inf (with the sign of the result) resp. nan instead of raising
+# ZeroDivisionError if denominator is 0.
+def divide_like_numpy(numerator, denominator):
+
+    if denominator != 0.0:
+        return numerator / denominator
+
+    if numerator == 0.0 or math.isnan(numerator):
+        return np.nan
+
+    return math.copysign(math.inf, numerator) * math.copysign(1.0, denominator)
+
+
+# Computes the same features as EyeGazeFeatures while the recording is still going on: The samples are passed to update() one by one
+# (or to update_batch() a few at once) and features() returns the features of all samples passed so far at any time. Nothing but
+# the samples of the current fixation is kept (see below), so the memory needed grows with the length of the current fixation, not
+# with the length of the recording. Every sample is processed in constant time, except for the rare samples that hit the
+# fallback to np.mean() (time linear in the number of samples of the current fixation).
+# - The fixations are determined exactly like determine_fixations_with_running_means() does (same running sums and the same
+#   fallback to np.mean() close to the thresholds, which is why the samples of the current fixation are kept).
+# - Whenever a fixation resp. saccade ends, its duration (and mean angles resp. amplitude) is added to running means, standard
+#   deviations and correlations (see RunningMeanAndStd and RunningCorrelation). The same applies to the velocities and
+#   accelerations during saccades. features() adds the fixation resp. saccade that is still going on to copies of these, so it
+#   doesn't change the state and takes constant time as well.
+# Consecutive samples with the same timestamp (see ../Step_3/ExtractFrameTimestamps.py) result in infinite resp. nan velocities and
+# accelerations, just like the divisions of numpy in compute_fixation_and_saccade_velocity_acceleration().
+# Samples with success 0 (gaze estimation failed) are skipped. Unlike Step 6 the estimator doesn't remove outliers (it can't
+# exclude a recording either), so at the end of the stream features() matches EyeGazeFeatures.run() applied to all samples with
+# success 1. The running means are not computed pairwise like np.mean() does, hence the values might differ in the last bits.
+class OnlineEyeGazeFeatures:
+    def __init__(self, gaze_estimation_method, thresholds=None):
+        self._method = gaze_estimation_method
+        self._thresholds = threshold_by_method[gaze_estimation_method] if thresholds is None else thresholds
+
+        # Number of samples so far, the last samples are kept for the differences between consecutive samples.
+        self._count_samples = 0
+        self._previous_sample = None
+        self._previous_velocity = None
+
+        # Same as the running sums in determine_fixations_with_running_means(): The gaze angles of the current fixation from
+        # fixation_start_index up to the latest sample (summed up with Neumaier summation).
+        self._fixation_x = []
+        self._fixation_y = []
+        self._sum_x = 0.0
+        self._compensation_x = 0.0
+        self._sum_y = 0.0
+        self._compensation_y = 0.0
+
+        # is_fixation of the latest pair of consecutive samples (is_fixation[count_samples - 2] in determine_fixations()).
+        self._is_fixation = None
+
+        # The fixation resp. saccade that is still going on (see determine_segments()): index and sample of its first sample,
+        # the sums of the gaze angles of its samples.
+        self._segment_start_index = 0
+        self._segment_start_sample = None
+        self._segment_sum_x = 0.0
+        self._segment_sum_y = 0.0
+
+        self._angle_x = RunningMeanAndStd()
+        self._angle_y = RunningMeanAndStd()
+        self._fixation_duration = RunningMeanAndStd()
+        self._fixation_duration_with_pitch = RunningCorrelation()
+        self._fixation_duration_with_yaw = RunningCorrelation()
+        self._saccade_duration = RunningMeanAndStd()
+        self._saccade_amplitude = RunningMeanAndStd()
+        self._velocity = RunningMeanAndStd()
+        self._acceleration = RunningMeanAndStd()
+
+    def update(self, timestamp, yaw, pitch, success=1):
+
+        if success == 0:
+            return
+
+        timestamp = float(timestamp)
+        x = float(yaw)
+        y = float(pitch)
+
+        self._angle_x.add(x)
+        self._angle_y.add(y)
+
+        i = self._count_samples
+        self._count_samples += 1
+
+        if i == 0:
+            self._previous_sample = (timestamp, x, y)
+            self._segment_start_sample = (timestamp, x, y)
+            self._segment_sum_x = x
+            self._segment_sum_y = y
+            self._add_to_fixation(x, y)
+            return
+
+        previous_timestamp, previous_x, previous_y = self._previous_sample
+
+        # is_fixation[0] is always True (see determine_fixations()).
+        if i == 1:
+            is_fixation = True
+        else:
+            is_fixation = self._determine_fixation(x, y, previous_x, previous_y)
+
+        # The pair from the previous to this sample turns the fixation into a saccade or vice versa.
+        if i >= 2 and is_fixation != self._is_fixation:
+            self._add_segment(self._segment_start_index, self._segment_start_sample, i - 1, self._previous_sample,
+                              self._is_fixation, self._fixation_duration, self._fixation_duration_with_pitch,
+                              self._fixation_duration_with_yaw, self._saccade_duration, self._saccade_amplitude)
+            self._segment_start_index = i - 1
+            self._segment_start_sample = self._previous_sample
+            self._segment_sum_x = previous_x
+            self._segment_sum_y = previous_y
+
+        self._segment_sum_x += x
+        self._segment_sum_y += y
+
+        # The fixation from the previous to this sample starts the current fixation (or continues it).
+        if is_fixation:
+            if not self._is_fixation and i >= 2:
+                self._reset_fixation()
+                self._add_to_fixation(previous_x, previous_y)
+            self._add_to_fixation(x, y)
+
+        velocity_x = divide_like_numpy(x - previous_x, timestamp - previous_timestamp)
+        velocity_y = divide_like_numpy(y - previous_y, timestamp - previous_timestamp)
+        velocity = math.sqrt(velocity_x*velocity_x + velocity_y*velocity_y)
+
+        if not is_fixation:
+            self._velocity.add(velocity)
+
+            # from the sample before the previous one to this sample the eyes moved
+            if self._is_fixation is False:
+                self._acceleration.add(divide_like_numpy(velocity - self._previous_velocity, timestamp - previous_timestamp))
+
+        self._is_fixation = is_fixation
+        self._previous_sample = (timestamp, x, y)
+        self._previous_velocity = velocity
+
+    def update_batch(self, timestamps, yaws, pitches, successes=None):
+
+        if successes is None:
+            successes = [1]*len(timestamps)
+
+        for timestamp, yaw, pitch, success in zip(timestamps, yaws, pitches, successes):
+            self.update(timestamp, yaw, pitch, success)
+
+    # Returns the features of all samples passed so far (same dictionary as EyeGazeFeatures.run()).
+    def features(self):
+
+        fixation_duration = self._fixation_duration.copy()
+        fixation_duration_with_pitch = self._fixation_duration_with_pitch.copy()
+        fixation_duration_with_yaw = self._fixation_duration_with_yaw.copy()
+        saccade_duration = self._saccade_duration.copy()
+        saccade_amplitude = self._saccade_amplitude.copy()
+
+        # Just like determine_segments() a fixation resp. saccade that only lasts from the second last to the last sample is not included.
+        if self._count_samples >= 2 and self._segment_start_index < self._count_samples - 2:
+            self._add_segment(self._segment_start_index, self._segment_start_sample, self._count_samples - 1, self._previous_sample,
+                              self._is_fixation, fixation_duration, fixation_duration_with_pitch, fixation_duration_with_yaw,
+                              saccade_duration, saccade_amplitude)
+
+        features = {}
+
+        self._add_to_features(features, 'angle_x', self._angle_x)
+        self._add_to_features(features, 'angle_y', self._angle_y)
+        self._add_to_features(features, 'fixation_duration', fixation_duration)
+        self._add_to_features(features, 'fixation_duration_with_pitch', fixation_duration_with_pitch)
+        self._add_to_features(features, 'fixation_duration_with_yaw', fixation_duration_with_yaw)
+        self._add_to_features(features, 'saccade_duration', saccade_duration)
+        self._add_to_features(features, 'saccade_amplitude', saccade_amplitude)
+        self._add_to_features(features, 'velocity', self._velocity)
+        self._add_to_features(features, 'acceleration', self._acceleration)
+
+        return features
+
+    # Same decision as in determine_fixations_with_running_means() for the pair from the previous sample to the sample (x, y).
+    def _determine_fixation(self, x, y, previous_x, previous_y):
+
+        # A running mean that deviates from np.mean() by more than this (in radians) is practically impossible.
+        tolerance = 1e-9
+
+        if self._is_fixation:
+            count = len(self._fixation_x)
+            dx = abs(x - (self._sum_x + self._compensation_x) / count)
+            dy = abs(y - (self._sum_y + self._compensation_y) / count)
+
+            if abs(dx - self._thresholds['yaw']) <= tolerance or abs(dy - self._thresholds['pitch']) <= tolerance:
+                dx = abs(x - np.mean(self._fixation_x))
+                dy = abs(y - np.mean(self._fixation_y))
+        else:
+            dx = abs(x - previous_x)
+            dy = abs(y - previous_y)
+
+        return not (dx >= self._thresholds['yaw'] or dy >= self._thresholds['pitch'])
+
+    def _reset_fixation(self):
+
+        self._fixation_x = []
+        self._fixation_y = []
+        self._sum_x = self._compensation_x = self._sum_y = self._compensation_y = 0.0
+
+    def _add_to_fixation(self, x, y):
+
+        self._fixation_x.append(x)
+        self._fixation_y.append(y)
+
+        total = self._sum_x + x
+        if abs(self._sum_x) >= abs(x):
+            self._compensation_x += (self._sum_x - total) + x
+        else:
+            self._compensation_x += (x - total) + self._sum_x
+        self._sum_x = total
+
+        total = self._sum_y + y
+        if abs(self._sum_y) >= abs(y):
+            self._compensation_y += (self._sum_y - total) + y
+        else:
+            self._compensation_y += (y - total) + self._sum_y
+        self._sum_y = total
+
+    # Adds the fixation resp. saccade from the sample with index start_index to the sample with index end_index to the passed
+    # running statistics (see compute_fixation_durations_from_segments() and compute_saccades_from_segments()).
+    def _add_segment(self, start_index, start_sample, end_index, end_sample, is_fixation, fixation_duration,
+                     fixation_duration_with_pitch, fixation_duration_with_yaw, saccade_duration, saccade_amplitude):
+
+        duration = end_sample[0] - start_sample[0]
+
+        if is_fixation:
+            count_frames = end_index - start_index + 1
+            fixation_duration.add(duration)
+            fixation_duration_with_pitch.add(duration, self._segment_sum_y / count_frames)
+            fixation_duration_with_yaw.add(duration, self._segment_sum_x / count_frames)
+        else:
+            dx = end_sample[1] - start_sample[1]
+            dy = end_sample[2] - start_sample[2]
+            saccade_duration.add(duration)
+            saccade_amplitude.add(math.sqrt(dx*dx + dy*dy))
+
+    # Same as EyeGazeFeatures._add_to_features(), but for running statistics.
+    def _add_to_features(self, features, name, running_statistics):
+
+        if isinstance(running_statistics, RunningMeanAndStd):
+            mean = running_statistics.mean()
+            std = running_statistics.std()
+            features[f'gaze_mean_{name}'] = 0.0 if np.isnan(mean) else mean
+            features[f'gaze_std_{name}'] = 0.0 if np.isnan(std) else std
+        else:
+            # This case is needed for correlations.
+            correlation = running_statistics.correlation()
+            features[f'gaze_corr_{name}'] = 0.0 if np.isnan(correlation) else correlation
+
+
+# Fixation thresholds (yaw, pitch) used by determine_fixations() and determine_fixations_with_running_means().
+# Refer to Method Validation or Feature Engineering section of my thesis to find out where these values come from.
+threshold_by_method = {
+    'L2CS-Net': {
+        ### mean + 3*sd = (1.827, 2.363)
+        ### mean + 4*sd = (2.276, 2.927)
+        ### mean + 5*sd = (2.725, 3.492)
+        ### mean + 6*sd = (3.173, 4.056)
+        # ---> mean + 7*sd = (3.622, 4.621)
+        ### mean + 8*sd = (4.07, 5.186)
+        ### mean + 9*sd = (4.519, 5.75)
+        ### mean + 10*sd = (4.968, 6.315)
+        'yaw': np.radians(3.622),
+        'pitch': np.radians(4.621)
+    },
+    'MCGaze': {
+        ### mean + 3*sd = (2.615, 3.305)
+        # ---> mean + 4*sd = (3.21, 4.147)
+        ### mean + 5*sd = (3.804, 4.989)
+        ### mean + 6*sd = (4.399, 5.832)
+        ### mean + 7*sd = (4.993, 6.674)
+        ### mean + 8*sd = (5.587, 7.516)
+        ### mean + 9*sd = (6.182, 8.359)
+        ### mean + 10*sd = (6.776, 9.201)
+        'yaw': np.radians(3.21),
+        'pitch': np.radians(4.147)
     }
+}
+
+# The consensus gaze estimation of ../Common/EnsembleGaze.py was not validated on its own, so it uses the thresholds
+# of MCGaze (the larger ones of the two methods it combines by default).
+threshold_by_method['Ensemble'] = threshold_by_method['MCGaze']
+
+
+def determine_fixations(gaze_angle_x, gaze_angle_y, timestamps, method):
+
+    # is_fixation[i] will be True if the eyes do not move from timestamp[i] to timestamp[i+1], otherwise is_fixation[i] will be False.
+    is_fixation = [True for i in range(0, len(timestamps) - 1)]
 
     fixation_start_index = 0
 
@@ -164,6 +712,93 @@ def determine_fixations(gaze_angle_x, gaze_angle_y, timestamps, method):
     return is_fixation
 
 
+# Returns exactly the same is_fixation list as determine_fixations(), but in linear time: Instead of recomputing
+# np.mean(gaze_angle_x[fixation_start_index:i]) in every iteration the sums of the gaze angles of the current fixation
+# are kept (compensated summation, so they are far more precise than the threshold comparisons need).
+# np.mean() sums up pairwise, hence the running mean might differ from it in the last bits. Whenever a difference is
+# that close to a threshold that this could matter, np.mean() is used for that frame just like determine_fixations() does.
+# determine_fixations() is kept as reference implementation.
+# Parameter "thresholds" (optional) overrides threshold_by_method[method] (dictionary with the keys 'yaw' and 'pitch').
+def determine_fixations_with_running_means(gaze_angle_x, gaze_angle_y, timestamps, method, thresholds=None):
+
+    # A running mean that deviates from np.mean() by more than this (in radians) is practically impossible
+    # (the deviations are in the order of 1e-15).
+    tolerance = 1e-9
+
+    if thresholds is None:
+        thresholds = threshold_by_method[method]
+
+    threshold_yaw = thresholds['yaw']
+    threshold_pitch = thresholds['pitch']
+
+    # Python floats are much faster to access one by one than elements of numpy arrays.
+    gaze_angle_x = np.asarray(gaze_angle_x, dtype=np.float64)
+    gaze_angle_y = np.asarray(gaze_angle_y, dtype=np.float64)
+    x = gaze_angle_x.tolist()
+    y = gaze_angle_y.tolist()
+
+    is_fixation = [True for i in range(0, len(timestamps) - 1)]
+
+    fixation_start_index = 0
+
+    # The running sums cover the gaze angles from summed_from_index up to (excluding) summed_until_index.
+    # Each sum is stored as value plus compensation (Neumaier summation).
+    summed_from_index = 0
+    summed_until_index = 0
+    sum_x = 0.0
+    compensation_x = 0.0
+    sum_y = 0.0
+    compensation_y = 0.0
+
+    for i in range(2, len(timestamps)):
+
+        if is_fixation[i-2]:
+
+            if summed_from_index != fixation_start_index:
+                # A new fixation started.
+                summed_from_index = fixation_start_index
+                summed_until_index = fixation_start_index
+                sum_x = compensation_x = sum_y = compensation_y = 0.0
+
+            while summed_until_index < i:
+
+                value = x[summed_until_index]
+                total = sum_x + value
+                if abs(sum_x) >= abs(value):
+                    compensation_x += (sum_x - total) + value
+                else:
+                    compensation_x += (value - total) + sum_x
+                sum_x = total
+
+                value = y[summed_until_index]
+                total = sum_y + value
+                if abs(sum_y) >= abs(value):
+                    compensation_y += (sum_y - total) + value
+                else:
+                    compensation_y += (value - total) + sum_y
+                sum_y = total
+
+                summed_until_index += 1
+
+            count = i - fixation_start_index
+            dx = abs(x[i] - (sum_x + compensation_x) / count)
+            dy = abs(y[i] - (sum_y + compensation_y) / count)
+
+            if abs(dx - threshold_yaw) <= tolerance or abs(dy - threshold_pitch) <= tolerance:
+                dx = abs(x[i] - np.mean(gaze_angle_x[fixation_start_index:i]))
+                dy = abs(y[i] - np.mean(gaze_angle_y[fixation_start_index:i]))
+        else:
+            dx = abs(x[i] - x[i-1])
+            dy = abs(y[i] - y[i-1])
+
+        if dx >= threshold_yaw or dy >= threshold_pitch:
+            is_fixation[i-1] = False
+        elif not is_fixation[i-2]:
+            fixation_start_index = i-1
+
+    return is_fixation
+
+
 # Call determine_fixations first to get the parameter is_fixation.
 # This function also returns the correlation of fixation durations with the corresponding mean pitch resp. yaw angle in this time period.
 # The correlation with yaw angle was just added for the reason "why not?". The correlation with pitch angle was of interest
@@ -242,6 +877,96 @@ def compute_saccades(gaze_angle_x, gaze_angle_y, timestamps, is_fixation):
     return saccade_durations, saccade_amplitudes
 
 
+# Call determine_fixations first to get the parameter is_fixation.
+# Splits is_fixation into fixations (consecutive True values) and saccades (consecutive False values) in one pass.
+# Returns a dictionary of numpy arrays: The fixation resp. saccade with index k starts at
+# timestamps[segments['fixation starts'][k]] and ends at timestamps[segments['fixation ends'][k]] (same for saccades).
+# This is the segmentation that compute_fixation_durations() and compute_saccades() do with their loops. Just like
+# these two functions a fixation resp. saccade that only lasts from the second last to the last timestamp is not included.
+def determine_segments(is_fixation):
+
+    is_fixation = np.asarray(is_fixation, dtype=bool)
+
+    # Indices where a fixation turns into a saccade or vice versa.
+    change_indices = np.flatnonzero(np.diff(is_fixation.astype(np.int8))) + 1
+
+    if len(is_fixation) == 0:
+        starts = np.array([], dtype=np.int64)
+        ends = np.array([], dtype=np.int64)
+    else:
+        starts = np.concatenate(([0], change_indices))
+        ends = np.concatenate((change_indices, [len(is_fixation)]))
+
+    if len(starts) > 0 and starts[-1] == len(is_fixation) - 1:
+        starts = starts[:-1]
+        ends = ends[:-1]
+
+    is_fixation_segment = is_fixation[starts]
+
+    return {
+        'fixation starts': starts[is_fixation_segment],
+        'fixation ends': ends[is_fixation_segment],
+        'saccade starts': starts[~is_fixation_segment],
+        'saccade ends': ends[~is_fixation_segment]
+    }
+
+
+# Returns the sums of values[starts[k]] up to (including) values[stops[k]] for every k.
+# The ranges must not overlap and must be sorted.
+def sum_over_segments(values, starts, stops):
+
+    if len(starts) == 0:
+        return np.array([], dtype=np.float64)
+
+    # Append a zero so that stops[-1] + 1 is a valid index for np.add.reduceat.
+    values = np.append(np.asarray(values, dtype=np.float64), 0.0)
+
+    indices = np.empty(2*len(starts), dtype=np.int64)
+    indices[0::2] = starts
+    indices[1::2] = stops + 1
+
+    # Every second sum covers the values between two segments, these sums are not needed.
+    return np.add.reduceat(values, indices)[0::2]
+
+
+# Same as compute_fixation_durations(), but computed from the result of determine_segments() without looping over
+# is_fixation. The mean angles are computed from segment sums, hence they might differ from np.mean() in the last bits.
+def compute_fixation_durations_from_segments(gaze_angle_x, gaze_angle_y, timestamps, segments):
+
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    starts = segments['fixation starts']
+    ends = segments['fixation ends']
+
+    # A fixation from timestamps[start] to timestamps[end] covers the gaze angles of all frames from start to end.
+    count_frames = ends - starts + 1
+
+    fixation_durations = (timestamps[ends] - timestamps[starts]).tolist()
+    mean_pitch_angle_during_fixations = (sum_over_segments(gaze_angle_y, starts, ends) / count_frames).tolist()
+    mean_yaw_angle_during_fixations = (sum_over_segments(gaze_angle_x, starts, ends) / count_frames).tolist()
+
+    return fixation_durations, np.corrcoef(fixation_durations, mean_pitch_angle_during_fixations)[0][1], np.corrcoef(fixation_durations, mean_yaw_angle_during_fixations)[0][1]
+
+
+# Same as compute_saccades(), but computed from the result of determine_segments() without looping over is_fixation.
+# The amplitudes might differ from the ones of compute_saccades() in the last bit, because pow(dx, 2) of the math
+# library is not always rounded exactly like dx*dx.
+def compute_saccades_from_segments(gaze_angle_x, gaze_angle_y, timestamps, segments):
+
+    gaze_angle_x = np.asarray(gaze_angle_x, dtype=np.float64)
+    gaze_angle_y = np.asarray(gaze_angle_y, dtype=np.float64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    starts = segments['saccade starts']
+    ends = segments['saccade ends']
+
+    saccade_durations = (timestamps[ends] - timestamps[starts]).tolist()
+
+    dx = gaze_angle_x[ends] - gaze_angle_x[starts]
+    dy = gaze_angle_y[ends] - gaze_angle_y[starts]
+    saccade_amplitudes = np.sqrt(dx*dx + dy*dy).tolist()
+
+    return saccade_durations, saccade_amplitudes
+
+
 # Call determine_fixations first to get the parameter is_fixation.
 # This function returns a list of velocities and a list of accelerations during saccades. If saccade happens between more than
 # 2 consecutive (in case of velocity) resp. more than 3 consecutive (in case of acceleration) frames the list will contain multiple
@@ -255,10 +980,11 @@ def compute_saccades(gaze_angle_x, gaze_angle_y, timestamps, is_fixation):
 # from values that already have bad precision themselves.
 def compute_velocity_acceleration(gaze_angle_x, gaze_angle_y, timestamps, is_fixation):
 
-    gaze_angles = np.array([gaze_angle_x, gaze_angle_y])
-
-    fixation_and_saccade_velocities = np.linalg.norm(np.diff(gaze_angles, axis=1) / np.diff(timestamps), axis=0)
-    fixation_and_saccade_accelerations = np.diff(fixation_and_saccade_velocities, axis=0) / np.diff(timestamps[1:])
+    fixation_and_saccade_velocities, fixation_and_saccade_accelerations = compute_fixation_and_saccade_velocity_acceleration(
+        gaze_angle_x,
+        gaze_angle_y,
+        timestamps
+    )
 
     # Return only those velocities and accelerations that belong to frames where saccade happened.
     saccade_velocities = []
@@ -274,3 +1000,28 @@ def compute_velocity_acceleration(gaze_angle_x, gaze_angle_y, timestamps, is_fix
                 saccade_accelerations.append(fixation_and_saccade_accelerations[i])
 
     return saccade_velocities, saccade_accelerations
+
+
+# The first part of compute_velocity_acceleration(), which does not depend on is_fixation: Returns the velocities
+# between all consecutive frames and the accelerations between all consecutive velocities (numpy arrays).
+def compute_fixation_and_saccade_velocity_acceleration(gaze_angle_x, gaze_angle_y, timestamps):
+
+    gaze_angles = np.array([gaze_angle_x, gaze_angle_y])
+
+    fixation_and_saccade_velocities = np.linalg.norm(np.diff(gaze_angles, axis=1) / np.diff(timestamps), axis=0)
+    fixation_and_saccade_accelerations = np.diff(fixation_and_saccade_velocities, axis=0) / np.diff(timestamps[1:])
+
+    return fixation_and_saccade_velocities, fixation_and_saccade_accelerations
+
+
+# The second part of compute_velocity_acceleration() without looping over is_fixation: Returns the same lists of
+# velocities and accelerations during saccades.
+def select_saccade_velocity_acceleration(fixation_and_saccade_velocities, fixation_and_saccade_accelerations, is_fixation):
+
+    is_saccade = ~np.asarray(is_fixation, dtype=bool)
+
+    saccade_velocities = fixation_and_saccade_velocities[is_saccade]
+    # from timestamps[i] to timestamps[i+2] the eyes moved
+    saccade_accelerations = fixation_and_saccade_accelerations[is_saccade[:-1] & is_saccade[1:]]
+
+    return saccade_velocities.tolist(), saccade_accelerations.tolist()
@@ -0,0 +1,255 @@
+import csv
+import os
+import argparse
+import itertools
+import concurrent.futures
+import sys
+import numpy as np
+from scipy import stats
+from pathlib import Path
+from FeatureEngineering import EyeGazeFeatures
+import ApplyFeatureEngineering
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Step_8'))
+from StatisticsEngine import alternative_hypothesis_by_feature_of_interest
+
+
+#
+# Purpose of this script:
+# Computes the gaze features for a whole grid of fixation thresholds (yaw, pitch) instead of only the ones in
+# threshold_by_method (see FeatureEngineering.py). Every recording is read only once and the features that don't
+# depend on the thresholds are computed only once per recording (see EyeGazeFeatures.run_sweep()).
+#
+# Output (for every method and every element of the grid):
+# ThresholdSweepData/<method>/yaw_<yaw>_pitch_<pitch>/ASC.csv and NT.csv (yaw and pitch in degrees), same layout as the
+# files in FeatureEngineeringData. With --t-tests the t-tests of ../Step_8/StatisticalEvaluation.ipynb (all genders) are
+# conducted for every element of the grid as well and written to ThresholdSweepData/<method>/TTests.csv.
+#
+# Examples:
+# $ python ThresholdSweep.py --t-tests
+# (sweeps the candidate thresholds below)
+# $ python ThresholdSweep.py --methods MCGaze --yaw 3.0 3.21 3.5 --pitch 4.0 4.147 4.5
+# (sweeps all 9 combinations of the given yaw and pitch thresholds)
+#
+
+
+# Candidate thresholds (yaw, pitch) in degrees: mean + k*sd for k = 3, ..., 10
+# (see the comments of threshold_by_method in FeatureEngineering.py).
+threshold_candidates_by_method = {
+    'L2CS-Net': [
+        (1.827, 2.363),
+        (2.276, 2.927),
+        (2.725, 3.492),
+        (3.173, 4.056),
+        (3.622, 4.621),
+        (4.07, 5.186),
+        (4.519, 5.75),
+        (4.968, 6.315)
+    ],
+    'MCGaze': [
+        (2.615, 3.305),
+        (3.21, 4.147),
+        (3.804, 4.989),
+        (4.399, 5.832),
+        (4.993, 6.674),
+        (5.587, 7.516),
+        (6.182, 8.359),
+        (6.776, 9.201)
+    ]
+}
+
+# Same fallback as in threshold_by_method (see FeatureEngineering.py): the ensemble uses the thresholds of MCGaze.
+threshold_candidates_by_method['Ensemble'] = threshold_candidates_by_method['MCGaze']
+
+
+# Parameter thresholds_grid is a list of (yaw, pitch) tuples in degrees.
+# Returns a list with the features of the file for every element of thresholds_grid.
+def sweep_thresholds_of_file(method, filename, thresholds_grid, store_folder=None):
+
+    features_from_file = ApplyFeatureEngineering.read_cleaned_data(method, filename, store_folder)
+
+    gaze_features_by_thresholds = EyeGazeFeatures(
+        features_from_file['yaw'],
+        features_from_file['pitch'],
+        features_from_file['timestamp'],
+        method
+    ).run_sweep([{'yaw': np.radians(yaw), 'pitch': np.radians(pitch)} for yaw, pitch in thresholds_grid])
+
+    return [{'video': Path(filename).stem, **gaze_features} for gaze_features in gaze_features_by_thresholds]
+
+# Returns swept_features where swept_features[method][k][condition] is the list of feature dictionaries (one per video,
+# in the order of get_SIT_video_filenames()) for the thresholds thresholds_grid_by_method[method][k].
+def sweep_thresholds_in_parallel(methods, thresholds_grid_by_method, count_workers, store_folder=None):
+
+    if store_folder is None:
+        filenames = ApplyFeatureEngineering.get_SIT_video_filenames(methods)
+    else:
+        filenames = ApplyFeatureEngineering.get_SIT_video_filenames_from_store(methods, store_folder)
+
+    tasks = [
+        (method, condition, filename)
+        for method in methods
+        for condition in filenames[method]
+        for filename in filenames[method][condition]
+    ]
+
+    if count_workers == 1:
+        results = [
+            sweep_thresholds_of_file(method, filename, thresholds_grid_by_method[method], store_folder)
+            for method, condition, filename in tasks
+        ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=count_workers) as executor:
+            results = list(executor.map(
+                sweep_thresholds_of_file,
+                [method for method, condition, filename in tasks],
+                [filename for method, condition, filename in tasks],
+                [thresholds_grid_by_method[method] for method, condition, filename in tasks],
+                [store_folder for task in tasks]
+            ))
+
+    swept_features = dict()
+
+    for method in methods:
+        swept_features[method] = [
+            {condition: [] for condition in filenames[method]}
+            for thresholds in thresholds_grid_by_method[method]
+        ]
+
+    for (method, condition, filename), gaze_features_by_thresholds in zip(tasks, results):
+        for k, gaze_features in enumerate(gaze_features_by_thresholds):
+            swept_features[method][k][condition].append(gaze_features)
+
+    return swept_features
+
+def get_sweep_folder(method, thresholds):
+
+    return 'ThresholdSweepData/' + method + '/yaw_' + str(thresholds[0]) + '_pitch_' + str(thresholds[1])
+
+def write_features_to_file(path, features):
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=features[0].keys())
+
+        writer.writeheader()
+
+        for elem in features:
+            writer.writerow(elem)
+
+# Conducts the t-tests of ../Step_8/StatisticalEvaluation.ipynb (all genders) for every element of the grid and writes
+# one row per element of the grid and feature of interest.
+def write_t_tests_to_file(path, thresholds_grid, swept_features_of_method):
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['yaw threshold in degrees', 'pitch threshold in degrees', 'feature', 'alternative', 't', 'p'])
+
+        for thresholds, features_by_condition in zip(thresholds_grid, swept_features_of_method):
+            for feature in alternative_hypothesis_by_feature_of_interest:
+
+                # NOTE: The order of first and second positional argument is important!
+                # (unless "alternative" argument is "two-sided")
+                test_result = stats.ttest_ind(
+                    [features[feature] for features in features_by_condition['ASC']],
+                    [features[feature] for features in features_by_condition['NT']],
+                    equal_var=True,
+                    alternative=alternative_hypothesis_by_feature_of_interest[feature]
+                )
+
+                writer.writerow([
+                    thresholds[0],
+                    thresholds[1],
+                    feature,
+                    alternative_hypothesis_by_feature_of_interest[feature],
+                    test_result.statistic,
+                    test_result.pvalue
+                ])
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Computes the gaze features of all cleaned SIT video files for a grid of fixation thresholds')
+
+    parser.add_argument(
+        '--methods',
+        dest='methods',
+        nargs='+',
+        default=['L2CS-Net', 'MCGaze']
+        )
+
+    parser.add_argument(
+        '--yaw',
+        dest='yaw_thresholds',
+        help='yaw thresholds in degrees (default: the candidate thresholds of the method)',
+        nargs='+',
+        type=float,
+        default=None
+        )
+
+    parser.add_argument(
+        '--pitch',
+        dest='pitch_thresholds',
+        help='pitch thresholds in degrees (every combination with the yaw thresholds is swept)',
+        nargs='+',
+        type=float,
+        default=None
+        )
+
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that compute features in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
+
+    parser.add_argument(
+        '--store-folder',
+        dest='store_folder',
+        help='read the cleaned data from the gaze data stores in this folder (see ../Common/GazeDataStore.py)',
+        type=str,
+        default=None
+        )
+
+    parser.add_argument(
+        '--t-tests',
+        dest='t_tests',
+        help='conduct the t-tests for every element of the grid',
+        action='store_true'
+        )
+
+    args = parser.parse_args()
+
+    if (args.yaw_thresholds is None) != (args.pitch_thresholds is None):
+        parser.error('--yaw and --pitch must be specified together')
+
+    return args
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    thresholds_grid_by_method = dict()
+
+    for method in args.methods:
+        if args.yaw_thresholds is None:
+            thresholds_grid_by_method[method] = threshold_candidates_by_method[method]
+        else:
+            thresholds_grid_by_method[method] = list(itertools.product(args.yaw_thresholds, args.pitch_thresholds))
+
+    swept_features = sweep_thresholds_in_parallel(args.methods, thresholds_grid_by_method, args.count_workers, args.store_folder)
+
+    for method in args.methods:
+
+        for thresholds, features_by_condition in zip(thresholds_grid_by_method[method], swept_features[method]):
+
+            os.makedirs(get_sweep_folder(method, thresholds), exist_ok=True)
+
+            for condition in features_by_condition:
+                if len(features_by_condition[condition]) > 0:
+                    write_features_to_file(get_sweep_folder(method, thresholds) + '/' + condition + '.csv', features_by_condition[condition])
+
+        if args.t_tests:
+            write_t_tests_to_file('ThresholdSweepData/' + method + '/TTests.csv', thresholds_grid_by_method[method], swept_features[method])
+
+        print(method + ':', len(thresholds_grid_by_method[method]), 'thresholds swept')
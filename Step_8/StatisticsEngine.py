@@ -0,0 +1,372 @@
+import os
+import sys
+import csv
+import argparse
+import concurrent.futures
+import numpy as np
+from scipy import stats
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+import CohortIndex
+
+
+#
+# Purpose of this script:
+# Conducts the statistical evaluation of StatisticalEvaluation.ipynb for all features at once: The gaze features of a method
+# are read into one matrix (one row per video, one column per feature) together with the condition of every video, and the
+# t-tests and effect sizes (Cohen's d) are computed for all columns at once instead of one feature after another.
+# In addition to the t-tests there are
+# 1. permutation tests: the condition labels are shuffled count_permutations times and the t statistic of every shuffle is
+#    compared with the observed one (no assumption of normally distributed features needed).
+# 2. bootstrap confidence intervals for Cohen's d: the videos of every condition are resampled with replacement
+#    count_resamples times.
+# The shuffles resp. resamples are split up into batches that are computed for all features at once and distributed among a
+# process pool. Every batch gets its own random number generator stream (spawned from the seed with np.random.SeedSequence),
+# so the results only depend on the seed and the batch size, not on the number of workers.
+#
+# Subsets of the videos (e.g. one gender only) are passed as boolean masks over the rows of the matrix. The masks of the
+# genders are taken from the cohort index (see ../Common/CohortIndex.py), as long as the gender maps are available.
+#
+# Example (run from this folder):
+# $ python StatisticsEngine.py --permutations 10000 --bootstrap 10000 --seed 0
+#
+
+
+# Only test the features where the literature suggests that it might be linked to ASC, hence the postfix
+# "_feature_of_interest". If I were to just test all the features error correction would substantially
+# increase false negative rate.
+# Valid dictionary values are 'two-sided', 'less' and 'greater' (used as parameter for scipy.stats.ttest_ind)
+# StatisticalEvaluation.ipynb and ../Step_7/ThresholdSweep.py import this dictionary.
+alternative_hypothesis_by_feature_of_interest = {
+    'gaze_std_angle_x': 'greater',
+    'gaze_mean_angle_y': 'greater',
+    'gaze_mean_fixation_duration': 'less',
+    'gaze_corr_fixation_duration_with_pitch': 'greater',
+    'gaze_mean_saccade_duration': 'greater',
+    'gaze_mean_velocity': 'less'
+}
+
+
+# Returns the names of the videos, the names of the features, the feature matrix (one row per video) and is_ASC
+# (boolean array, True for the videos of condition ASC, False for NT).
+def read_feature_matrix(method, folder='../Step_7/FeatureEngineeringData'):
+
+    video_names = []
+    rows = []
+    is_ASC = []
+
+    for condition in ['ASC', 'NT']:
+        with open(folder + '/' + method + '/' + condition + '.csv') as csv_file:
+
+            file_content = list(csv.DictReader(csv_file))
+            # name of the video is not a feature
+            feature_names = [key for key in file_content[0].keys() if key != 'video']
+
+            for row in file_content:
+                video_names.append(row['video'])
+                rows.append([float(row[feature]) for feature in feature_names])
+                is_ASC.append(condition == 'ASC')
+
+    return video_names, feature_names, np.array(rows, dtype=np.float64), np.array(is_ASC, dtype=bool)
+
+# Returns the p-values of t statistics with df degrees of freedom. Parameter alternatives holds the alternative hypothesis
+# ('two-sided', 'less' or 'greater', see scipy.stats.ttest_ind) of every column of t.
+def get_p_values(t, df, alternatives):
+
+    alternatives = np.broadcast_to(np.asarray(alternatives), np.shape(t)[-1:])
+    p_values = np.empty(np.shape(t))
+
+    for alternative in ['two-sided', 'less', 'greater']:
+
+        columns = alternatives == alternative
+
+        if alternative == 'two-sided':
+            p_values[..., columns] = 2.0 * stats.t.sf(np.abs(t[..., columns]), df)
+        elif alternative == 'less':
+            p_values[..., columns] = stats.t.cdf(t[..., columns], df)
+        else:
+            p_values[..., columns] = stats.t.sf(t[..., columns], df)
+
+    return p_values
+
+# Student's t statistic (equal variances, like scipy.stats.ttest_ind(..., equal_var=True)) for every column of the feature
+# matrix, ASC vs. NT. sums and sums_of_squares may have additional leading dimensions (e.g. one per permutation).
+def compute_t_statistics(count_ASC, sum_ASC, sum_of_squares_ASC, count_NT, sum_NT, sum_of_squares_NT):
+
+    mean_ASC = sum_ASC / count_ASC
+    mean_NT = sum_NT / count_NT
+
+    # (n-1) * sample variance
+    squared_deviations_ASC = sum_of_squares_ASC - count_ASC * mean_ASC * mean_ASC
+    squared_deviations_NT = sum_of_squares_NT - count_NT * mean_NT * mean_NT
+
+    df = count_ASC + count_NT - 2
+    pooled_variance = (squared_deviations_ASC + squared_deviations_NT) / df
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (mean_ASC - mean_NT) / np.sqrt(pooled_variance * (1.0/count_ASC + 1.0/count_NT))
+
+# Same as scipy.stats.ttest_ind(features[is_ASC, j], features[~is_ASC, j], equal_var=True, alternative=alternatives[j])
+# for every column j. Returns the t statistics and the p-values (one per column).
+def t_tests(features, is_ASC, alternatives='two-sided'):
+
+    features_ASC = features[is_ASC]
+    features_NT = features[~is_ASC]
+    count_ASC = len(features_ASC)
+    count_NT = len(features_NT)
+
+    # Computed like scipy does it (sample variances of the centered values), which is more precise than compute_t_statistics().
+    df = count_ASC + count_NT - 2
+    pooled_variance = ((count_ASC - 1) * np.var(features_ASC, axis=0, ddof=1) + (count_NT - 1) * np.var(features_NT, axis=0, ddof=1)) / df
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (np.mean(features_ASC, axis=0) - np.mean(features_NT, axis=0)) / np.sqrt(pooled_variance * (1.0/count_ASC + 1.0/count_NT))
+
+    return t, get_p_values(t, df, alternatives)
+
+# Same as calculate_cohens_d() of StatisticalEvaluation.ipynb for every column (along the last axis, the videos are along the
+# second last axis, so there may be additional leading dimensions, e.g. one per bootstrap resample).
+def cohens_d(features_ASC, features_NT):
+
+    count_ASC = features_ASC.shape[-2]
+    count_NT = features_NT.shape[-2]
+    sd_ASC = np.std(features_ASC, axis=-2)
+    sd_NT = np.std(features_NT, axis=-2)
+
+    pooled_sd = np.sqrt(((count_ASC-1)*sd_ASC*sd_ASC + (count_NT-1)*sd_NT*sd_NT) / (count_ASC + count_NT - 2))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.abs(np.mean(features_ASC, axis=-2) - np.mean(features_NT, axis=-2)) / pooled_sd
+
+# Returns the t statistics of count_permutations random shufflings of is_ASC (one row per shuffle).
+# All shuffles are computed at once: the sums of the features of the ASC videos are a matrix product of the shuffled
+# labels and the feature matrix.
+def compute_permuted_t_statistics(features, is_ASC, count_permutations, seed_sequence):
+
+    random_number_generator = np.random.default_rng(seed_sequence)
+
+    permuted_is_ASC = np.array([random_number_generator.permutation(is_ASC) for i in range(count_permutations)], dtype=np.float64)
+
+    count_ASC = np.count_nonzero(is_ASC)
+    count_NT = len(is_ASC) - count_ASC
+
+    sum_ASC = permuted_is_ASC @ features
+    sum_of_squares_ASC = permuted_is_ASC @ (features * features)
+
+    return compute_t_statistics(
+        count_ASC, sum_ASC, sum_of_squares_ASC,
+        count_NT, np.sum(features, axis=0) - sum_ASC, np.sum(features * features, axis=0) - sum_of_squares_ASC
+    )
+
+# Returns Cohen's d of count_resamples bootstrap resamples (one row per resample). The videos of both conditions are resampled
+# separately, so every resample has as many ASC resp. NT videos as the original data.
+def compute_bootstrapped_cohens_d(features, is_ASC, count_resamples, seed_sequence):
+
+    random_number_generator = np.random.default_rng(seed_sequence)
+
+    features_ASC = features[is_ASC]
+    features_NT = features[~is_ASC]
+
+    indices_ASC = random_number_generator.integers(0, len(features_ASC), size=(count_resamples, len(features_ASC)))
+    indices_NT = random_number_generator.integers(0, len(features_NT), size=(count_resamples, len(features_NT)))
+
+    return cohens_d(features_ASC[indices_ASC], features_NT[indices_NT])
+
+# Calls function(features, is_ASC, batch size, seed sequence) for batches of at most batch_size repetitions (count in total)
+# and returns the stacked results. The batches are distributed among count_workers processes.
+def run_batches_in_parallel(function, features, is_ASC, count, batch_size, seed, count_workers):
+
+    batch_sizes = [min(batch_size, count - start) for start in range(0, count, batch_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    if count_workers == 1 or len(batch_sizes) <= 1:
+        results = [function(features, is_ASC, size, seed_sequence) for size, seed_sequence in zip(batch_sizes, seed_sequences)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=count_workers) as executor:
+            results = list(executor.map(
+                function,
+                [features for size in batch_sizes],
+                [is_ASC for size in batch_sizes],
+                batch_sizes,
+                seed_sequences
+            ))
+
+    return np.concatenate(results, axis=0)
+
+# Permutation tests of the t statistics of all columns. Returns the p-values (one per column), which include the observed
+# labels as one of the permutations ((count of permutations at least as extreme + 1) / (count_permutations + 1)).
+def permutation_tests(features, is_ASC, alternatives='two-sided', count_permutations=10000, seed=0, count_workers=1, batch_size=1000):
+
+    observed_t, p_values = t_tests(features, is_ASC, alternatives)
+
+    permuted_t = run_batches_in_parallel(compute_permuted_t_statistics, features, is_ASC, count_permutations, batch_size, seed, count_workers)
+
+    alternatives = np.broadcast_to(np.asarray(alternatives), observed_t.shape)
+    # A tiny tolerance, so that permutations that give the observed t statistic count despite rounding errors.
+    tolerance = 1e-9 * np.maximum(1.0, np.abs(observed_t))
+
+    is_at_least_as_extreme = np.where(
+        alternatives == 'two-sided',
+        np.abs(permuted_t) >= np.abs(observed_t) - tolerance,
+        np.where(alternatives == 'less', permuted_t <= observed_t + tolerance, permuted_t >= observed_t - tolerance)
+    )
+
+    p_values = (np.count_nonzero(is_at_least_as_extreme, axis=0) + 1) / (count_permutations + 1)
+
+    # Like the t-tests there is no p-value if the observed t statistic isn't defined (e.g. a condition with only one video).
+    return np.where(np.isnan(observed_t), np.nan, p_values)
+
+# Percentile bootstrap confidence intervals for Cohen's d of all columns. Returns the lower and upper bounds (one per column).
+def bootstrap_confidence_intervals(features, is_ASC, confidence=0.95, count_resamples=10000, seed=0, count_workers=1, batch_size=1000):
+
+    bootstrapped_cohens_d = run_batches_in_parallel(compute_bootstrapped_cohens_d, features, is_ASC, count_resamples, batch_size, seed, count_workers)
+
+    # Resamples that contain the same value over and over again have no (resp. an infinite) Cohen's d, they are left out.
+    bootstrapped_cohens_d[~np.isfinite(bootstrapped_cohens_d)] = np.nan
+
+    return (
+        np.nanpercentile(bootstrapped_cohens_d, 100.0 * (1.0 - confidence) / 2.0, axis=0),
+        np.nanpercentile(bootstrapped_cohens_d, 100.0 * (1.0 + confidence) / 2.0, axis=0)
+    )
+
+# Evaluates the features of interest of every subset of the videos (dictionary subset name -> boolean mask over the rows of
+# features). Returns one dictionary per subset and feature of interest.
+def evaluate(feature_names, features, is_ASC, subsets, count_permutations, count_resamples, seed, count_workers, confidence=0.95):
+
+    columns = [feature_names.index(feature) for feature in alternative_hypothesis_by_feature_of_interest]
+    alternatives = list(alternative_hypothesis_by_feature_of_interest.values())
+
+    results = []
+
+    for subset in subsets:
+
+        subset_features = features[subsets[subset]][:, columns]
+        subset_is_ASC = is_ASC[subsets[subset]]
+
+        t, p_values = t_tests(subset_features, subset_is_ASC, alternatives)
+        effect_sizes = cohens_d(subset_features[subset_is_ASC], subset_features[~subset_is_ASC])
+
+        if count_permutations > 0:
+            permutation_p_values = permutation_tests(subset_features, subset_is_ASC, alternatives, count_permutations, seed, count_workers)
+        else:
+            permutation_p_values = np.full(len(columns), np.nan)
+
+        if count_resamples > 0:
+            lower_bounds, upper_bounds = bootstrap_confidence_intervals(subset_features, subset_is_ASC, confidence, count_resamples, seed, count_workers)
+        else:
+            lower_bounds = upper_bounds = np.full(len(columns), np.nan)
+
+        for j, feature in enumerate(alternative_hypothesis_by_feature_of_interest):
+            results.append({
+                'subset': subset,
+                'feature': feature,
+                'alternative': alternatives[j],
+                'count ASC': int(np.count_nonzero(subset_is_ASC)),
+                'count NT': int(np.count_nonzero(~subset_is_ASC)),
+                't': t[j],
+                'p': p_values[j],
+                'permutation p': permutation_p_values[j],
+                "Cohen's d": effect_sizes[j],
+                "Cohen's d lower bound": lower_bounds[j],
+                "Cohen's d upper bound": upper_bounds[j]
+            })
+
+    return results
+
+# Returns the subsets of the videos to evaluate (dictionary subset name -> boolean mask over video_names): all genders and,
+# like in StatisticalEvaluation.ipynb, female and male if the cohort index knows the gender of the videos.
+def get_subsets(video_names, cohort_index=None):
+
+    subsets = {'all genders': np.ones(len(video_names), dtype=bool)}
+
+    if cohort_index is not None:
+        for gender in ['female', 'male']:
+
+            mask = cohort_index.get_mask_of_videos(video_names, gender=gender)
+
+            if np.any(mask):
+                subsets[gender] = mask
+
+    return subsets
+
+def write_results_to_file(path, results_by_method):
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = None
+
+        for method in results_by_method:
+            for result in results_by_method[method]:
+
+                if writer is None:
+                    writer = csv.DictWriter(csv_file, fieldnames=['method'] + list(result.keys()))
+                    writer.writeheader()
+
+                writer.writerow({'method': method, **result})
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Conducts the t-tests, permutation tests and bootstrap confidence intervals of Cohen\'s d for all features at once')
+
+    parser.add_argument(
+        '--methods',
+        dest='methods',
+        nargs='+',
+        default=['L2CS-Net', 'MCGaze']
+        )
+
+    parser.add_argument(
+        '--features-folder',
+        dest='features_folder',
+        help='folder with the features of Step 7 (default: ../Step_7/FeatureEngineeringData)',
+        type=str,
+        default='../Step_7/FeatureEngineeringData'
+        )
+
+    parser.add_argument('--permutations', dest='count_permutations', help='number of permutations per test (default: 10000)', type=int, default=10000)
+    parser.add_argument('--bootstrap', dest='count_resamples', help='number of bootstrap resamples (default: 10000)', type=int, default=10000)
+    parser.add_argument('--confidence', dest='confidence', help='confidence level of the bootstrap intervals (default: 0.95)', type=float, default=0.95)
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+
+    parser.add_argument(
+        '--workers',
+        dest='count_workers',
+        help='number of processes that compute permutations and resamples in parallel (default: number of CPUs)',
+        type=int,
+        default=os.cpu_count()
+        )
+
+    parser.add_argument('--output', dest='output', help='path of the .csv file with the results (default: StatisticsEngineResults.csv)', type=str, default='StatisticsEngineResults.csv')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    # The cohort index needs FilenameToConditionMap.csv (see ../Step_5/FeatureExtractionData/NOTE_FileMissing.txt).
+    if os.path.isfile(CohortIndex.default_condition_map_path):
+        cohort_index = CohortIndex.load_cohort_index(args.methods)
+    else:
+        cohort_index = None
+
+    results_by_method = dict()
+
+    for method in args.methods:
+
+        video_names, feature_names, features, is_ASC = read_feature_matrix(method, args.features_folder)
+
+        results_by_method[method] = evaluate(
+            feature_names, features, is_ASC, get_subsets(video_names, cohort_index),
+            args.count_permutations, args.count_resamples, args.seed, args.count_workers, args.confidence
+        )
+
+        for result in results_by_method[method]:
+            print(
+                method + ', ' + result['subset'] + ', ' + result['feature'] + ':',
+                't =', round(result['t'], 3), 'p =', round(result['p'], 4), 'permutation p =', round(result['permutation p'], 4),
+                "d =", round(result["Cohen's d"], 3),
+                '[' + str(round(result["Cohen's d lower bound"], 3)) + ', ' + str(round(result["Cohen's d upper bound"], 3)) + ']'
+            )
+
+    write_results_to_file(args.output, results_by_method)